@@ -0,0 +1,157 @@
+import copy
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.cache import getCacheKey, resultCache
+from app.jobs import getWorkerProcessContext
+from app.lpmodel import runSimulations
+from app.metrics import createSolveStats, metricsRegistry
+
+#
+# batches of simulations, e.g. for several plants, or several forecast
+#  scenarios for a plant, solved in parallel across worker processes
+#
+# the output for each request in the batch is returned in the same order as
+#  the requests, as a dict with either:
+#   output - the output of runSimulations for the request
+#   error  - why the request couldn't be run
+#
+# so that one failing request doesn't fail the whole batch. identical
+#  requests in a batch are only solved once, and requests in the result
+#  cache aren't solved at all
+#
+# the pool of worker processes is shared by batches, and by the windows of
+#  decomposed solves (see decomposition.py) and the points of sweeps (see
+#  sweep.py). its size is fixed, whatever a request asks for, so a request
+#  can't start more processes, or resize the pool while others are using
+#  it. a request that asks for fewer workers has its work split into that
+#  many chunks, each solved in turn by one worker process
+#
+# the stats (see metrics.py) of requests solved in the worker processes are
+#  returned along with their outputs, and recorded in metrics.metricsRegistry
+#  of this process, as that of the worker processes is never rendered
+#
+# the pool of worker processes used by the service is configured with the
+#  environment variable:
+#   HYDROGEN_BATCH_WORKERS - number of worker processes (defaults to the CPU count)
+#
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def getBatchWorkers():
+    workers = os.environ.get('HYDROGEN_BATCH_WORKERS')
+    return int(workers) if workers else (os.cpu_count() or 1)
+
+
+# the pool of worker processes, of getBatchWorkers() processes
+def getBatchExecutor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=getBatchWorkers(), mp_context=getWorkerProcessContext())
+        return _executor
+
+
+def resetBatchExecutor(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+# submit fn(*args) to the pool for each of args_list, returning the pool
+#  and the futures. if the pool has broken, or been shut down since it was
+#  got (by another request finding it broken), a new pool is started and
+#  the tasks are submitted to that instead
+def submitBatchTasks(fn, args_list):
+    executor = getBatchExecutor()
+    try:
+        return executor, [ executor.submit(fn, *args) for args in args_list ]
+    except (BrokenProcessPool, RuntimeError):
+        resetBatchExecutor(executor)
+    executor = getBatchExecutor()
+    return executor, [ executor.submit(fn, *args) for args in args_list ]
+
+
+# items split into at most chunks contiguous lists, of as equal a
+#  length as possible
+def getChunks(items, chunks):
+    chunks = max(1, min(chunks, len(items)))
+    size, extra = divmod(len(items), chunks)
+    starts = [ i * size + min(i, extra) for i in range(chunks + 1) ]
+    return [ items[start:end] for start, end in zip(starts, starts[1:]) ]
+
+
+# runs in the worker processes
+def solveBatchRequest(request):
+    stats = createSolveStats()
+    output = runSimulations(request, stats=stats)
+    return output, stats
+
+
+def _describeError(error):
+    return f'{type(error).__name__}: {error}'
+
+
+# workers is the number of worker processes to solve the batch with,
+#  where 1 solves it in this process (and more than 1 uses the whole pool)
+def runBatchSimulations(requests, cache=None, workers=None):
+    if cache is None:
+        cache = resultCache
+    if workers is None:
+        workers = getBatchWorkers()
+
+    results = [ None ] * len(requests)
+
+    # requests that need solving, keyed on the request's cache key
+    #  (or its position in the batch, if the cache is disabled)
+    pending = {}
+    for i, request in enumerate(requests):
+        key = getCacheKey(request) if cache.enabled() else i
+        cached_output = cache.get(key) if cache.enabled() else None
+        if cached_output is not None:
+            results[i] = { 'output': cached_output, 'error': None }
+        else:
+            pending.setdefault(key, []).append(i)
+
+    def add_result(key, output=None, error=None):
+        if output is not None and cache.enabled() and output['statusOfOptimalModel'] == 'Optimal':
+            cache.put(key, output)
+        for position, i in enumerate(pending[key]):
+            # identical requests each get their own copy of the output
+            item_output = output if position == 0 else copy.deepcopy(output)
+            results[i] = { 'output': item_output, 'error': error }
+
+    if workers <= 1 or len(pending) <= 1:
+        # not worth the cost of passing the requests to another process
+        for key, positions in pending.items():
+            try:
+                add_result(key, output=runSimulations(requests[positions[0]]))
+            except Exception as error:
+                add_result(key, error=_describeError(error))
+        return results
+
+    executor, submitted = submitBatchTasks(solveBatchRequest, [ (requests[positions[0]],) for positions in pending.values() ])
+    futures = dict(zip(pending, submitted))
+    broken = False
+    for key, future in futures.items():
+        try:
+            output, stats = future.result()
+            metricsRegistry.recordSolve(stats)
+            add_result(key, output=output)
+        except BrokenProcessPool as error:
+            broken = True
+            add_result(key, error=_describeError(error))
+        except Exception as error:
+            add_result(key, error=_describeError(error))
+
+    if broken:
+        # a worker process died, so start a new pool for the next batch
+        resetBatchExecutor(executor)
+
+    return results
@@ -0,0 +1,444 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from app.electricity import DecompositionConfiguration, Forecast, SolverConfiguration
+from app.lpmodel import buildOptimalModel, runSimulations
+from app.metrics import createSolveStats
+
+#
+# benchmarks for the MILP model used by the "optimal" simulation
+#
+# synthetic forecasts are generated by repeating the daily profile from the
+#  24-hours test fixture, resampled to the requested resolution, so that
+#  model size can be compared across horizon lengths and formulations
+#
+# the models compared are:
+#   dense      - PuLP model, config.formulation "dense"
+#   cumulative - PuLP model, config.formulation "cumulative"
+#   matrix     - sparse arrays, config.modelBuilder "matrix"
+#
+# by default only the time to build each model and its size are measured.
+#  with --full, each case is also solved (with each of --solvers) and the
+#  time spent in each phase of runSimulations, the peak memory, and the
+#  latency of the same request through the FastAPI app are measured. each
+#  case runs in a new process, so that the peak memory of one case isn't
+#  affected by another. --fixtures adds the forecasts in test/ to the cases
+#
+# with --decomposition, each case is solved again using horizon decomposition
+#  (see decomposition.py), and the extra cost of the plan it finds relative
+#  to the plan from solving the case as a single model is reported as its gap
+#
+# with --tightened, each case is solved again with config.tightened, and its
+#  solve time and number of branch and bound nodes are reported alongside
+#  those of the original formulation
+#
+# with the fixture's limits, the electrolysers' on/off decisions hardly
+#  affect the plan, so the solver has little to branch on. the cases can be
+#  made harder with --exact-min-production (see
+#  lpmodel.calculateMinConsumptionPerPeriod), which needs --max-power-change
+#  above the min consumption for the electrolysers to be turned on or off,
+#  and optionally --min-production-rate and --storage-window (the storage
+#  between the min set point and the max storage), which replace the
+#  fixture's limits in every case
+#
+# results are printed as a table, or as JSON lines with --json. --output
+#  writes them to a JSON file along with the versions and machine they were
+#  measured on, so that they can be compared across releases
+#
+# usage (from the directory containing the app package):
+#   python -m app.benchmark --days 1 2 7 14 --resolutions 30 5
+#   python -m app.benchmark --full --days 1 7 30 --resolutions 60 30 15 5 --output results.json
+#   python -m app.benchmark --full --models cumulative --days 7 30 --decomposition 4 96
+#   python -m app.benchmark --full --models cumulative matrix --solvers CBC --days 2 7 14 --resolutions 60 30 --tightened
+#   python -m app.benchmark --full --models cumulative --days 1 2 --resolutions 30 --tightened --exact-min-production --max-power-change 4 --min-production-rate 0.5
+#
+
+TEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test')
+FIXTURE_PATH = os.path.join(TEST_PATH, '24-hours', 'sample-input.json')
+FIXTURES = [ '30-minutes', '60-minutes', '24-hours', '48-hours' ]
+
+MODELS = [ 'dense', 'cumulative', 'matrix' ]
+SOLVERS = [ 'CBC', 'HiGHS' ]
+
+OPTIMISATION_PATH = '/electricity/hydrogen-production-optimisation'
+
+
+def generateForecast(days, resolution_minutes, formulation='dense', model_builder='pulp'):
+    with open(FIXTURE_PATH) as fixture_file:
+        fixture = json.load(fixture_file)
+
+    profile = fixture['forecasts']
+    profile_duration = fixture['config']['range']['periodDuration']
+    period_duration = resolution_minutes / 60
+    periods = int(round(days * 24 / period_duration))
+
+    # quantities in the fixture are per fixture period, so are scaled
+    #  to the length of the synthetic periods (prices are not scaled)
+    scale = period_duration / profile_duration
+
+    forecasts = []
+    for i in range(periods):
+        hour_of_day = (i * period_duration) % 24
+        sample = profile[int(hour_of_day / profile_duration) % len(profile)]
+        forecasts.append({
+            'timestamp': f'synthetic-{i}',
+            'renewableGeneration': sample['renewableGeneration'] * scale,
+            'hydrogenDemand': sample['hydrogenDemand'] * scale,
+            'gridPrice': sample['gridPrice'],
+            'renewablePrice': sample['renewablePrice']
+        })
+
+    config = dict(fixture['config'])
+    config['range'] = { 'periods': periods, 'periodDuration': period_duration }
+    config['formulation'] = formulation
+    config['modelBuilder'] = model_builder
+
+    return Forecast.parse_obj({ 'config': config, 'forecasts': forecasts })
+
+
+# replace the request's limits with those given for the case (see getLimits)
+def applyLimits(request, limits):
+    if not limits:
+        return
+    config = request.config
+    if limits.get('exactMinProduction'):
+        config.exactMinProduction = True
+    if limits.get('maxPowerChangePh') is not None:
+        config.productionLimits.maxPowerChangePh = limits['maxPowerChangePh']
+    if limits.get('minProductionRate') is not None:
+        config.productionLimits.minProductionRate = limits['minProductionRate']
+    if limits.get('storageWindow') is not None:
+        config.storage.maxStorage = config.storage.minStorageSetPoint + limits['storageWindow']
+        config.storage.initialStorage = min(config.storage.initialStorage, config.storage.maxStorage)
+        if config.storage.finalStorage is not None:
+            config.storage.finalStorage = min(config.storage.finalStorage, config.storage.maxStorage)
+
+
+# number of non-zero coefficients across all of the constraints in the model
+def countModelNonZeros(model):
+    return sum(len(constraint) for constraint in model.constraints.values())
+
+
+def benchmarkModelBuild(days, resolution_minutes, model_name):
+    if model_name == 'matrix':
+        # imported here so that scipy is only needed for this model
+        from app.matrixmodel import buildMatrixModel
+
+        request = generateForecast(days, resolution_minutes, model_builder='matrix')
+        start = time.perf_counter()
+        matrix_model = buildMatrixModel(request)
+        build_seconds = time.perf_counter() - start
+        variables = len(matrix_model.c)
+        constraints = matrix_model.A.shape[0]
+        non_zeros = matrix_model.A.nnz
+    else:
+        request = generateForecast(days, resolution_minutes, formulation=model_name)
+        start = time.perf_counter()
+        model, _, _, _ = buildOptimalModel(request)
+        build_seconds = time.perf_counter() - start
+        variables = len(model.variables())
+        constraints = len(model.constraints)
+        non_zeros = countModelNonZeros(model)
+
+    return {
+        'days': days,
+        'resolutionMinutes': resolution_minutes,
+        'periods': request.config.range.periods,
+        'model': model_name,
+        'buildSeconds': build_seconds,
+        'variables': variables,
+        'constraints': constraints,
+        'nonZeros': non_zeros
+    }
+
+
+def loadFixture(fixture, formulation='dense', model_builder='pulp'):
+    request = Forecast.parse_file(os.path.join(TEST_PATH, fixture, 'sample-input.json'))
+    request.config.formulation = formulation
+    request.config.modelBuilder = model_builder
+    return request
+
+
+# peak resident memory of this process and of the solver processes
+#  it has run (CBC), in MB, where the platform reports it
+def getPeakMemory():
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in bytes on macOS, and KB elsewhere
+    unit = 1 if sys.platform == 'darwin' else 1024
+    to_mb = lambda usage: usage.ru_maxrss * unit / 2**20
+    return to_mb(resource.getrusage(resource.RUSAGE_SELF)), to_mb(resource.getrusage(resource.RUSAGE_CHILDREN))
+
+
+# solve a case with runSimulations, then again through the FastAPI app
+#
+# case is a dict with days and resolutionMinutes for a synthetic forecast,
+#  or fixture for one of the forecasts in test/, along with model, solver
+#  and timeLimit (in seconds), and optionally decomposition - the
+#  aggregatePeriods and windowPeriods to also solve the case with - and
+#  tightened, to also solve the case with the tightened formulation, and
+#  limits, to replace the forecast's limits (see applyLimits)
+def benchmarkSimulation(case, http=True):
+    model_name = case['model']
+    formulation = 'cumulative' if model_name == 'cumulative' else 'dense'
+    model_builder = 'matrix' if model_name == 'matrix' else 'pulp'
+    if case.get('fixture'):
+        request = loadFixture(case['fixture'], formulation, model_builder)
+    else:
+        request = generateForecast(case['days'], case['resolutionMinutes'], formulation, model_builder)
+    applyLimits(request, case.get('limits'))
+    request.config.solver = SolverConfiguration(name=case['solver'], timeLimit=case.get('timeLimit'))
+
+    stats = createSolveStats()
+    start = time.perf_counter()
+    output = runSimulations(request, stats=stats)
+    total_seconds = time.perf_counter() - start
+    peak_memory, solver_peak_memory = getPeakMemory()
+
+    result = dict(case)
+    result.update({
+        'periods': request.config.range.periods,
+        'status': output['statusOfOptimalModel'],
+        'solverOfOptimalModel': output['solverOfOptimalModel'],
+        'objective': stats['objective'],
+        'mipGap': stats['mipGap'],
+        'nodes': stats['nodes'],
+        'variables': stats['variables'],
+        'integerVariables': stats['integerVariables'],
+        'constraints': stats['constraints'],
+        'nonZeros': stats['nonZeros'],
+        'buildSeconds': stats['timings'].get('build'),
+        'solveSeconds': stats['timings'].get('solve'),
+        'extractSeconds': stats['timings'].get('extract'),
+        'postProcessSeconds': stats['timings'].get('postProcess'),
+        'totalSeconds': total_seconds,
+        'peakMemoryMB': peak_memory,
+        'solverPeakMemoryMB': solver_peak_memory,
+        'httpSeconds': None,
+        'httpStatus': None,
+        'httpResponseBytes': None,
+        'decomposedStatus': None,
+        'decomposedSeconds': None,
+        'decomposedObjective': None,
+        'decompositionGap': None,
+        'tightenedStatus': None,
+        'tightenedSolveSeconds': None,
+        'tightenedNodes': None,
+        'tightenedObjective': None
+    })
+
+    if case.get('decomposition'):
+        aggregate_periods, window_periods = case['decomposition']
+        decomposed_request = request.copy(deep=True)
+        decomposed_request.config.decomposition = DecompositionConfiguration(aggregatePeriods=aggregate_periods, windowPeriods=window_periods)
+        decomposed_stats = createSolveStats()
+        start = time.perf_counter()
+        decomposed_output = runSimulations(decomposed_request, stats=decomposed_stats)
+        result['decomposedSeconds'] = time.perf_counter() - start
+        result['decomposedStatus'] = decomposed_output['statusOfOptimalModel']
+        result['decomposedObjective'] = decomposed_stats['objective']
+        if stats['objective'] is not None and decomposed_stats['objective'] is not None:
+            result['decompositionGap'] = (decomposed_stats['objective'] - stats['objective']) / max(abs(stats['objective']), 1e-10)
+
+    if case.get('tightened'):
+        tightened_request = request.copy(deep=True)
+        tightened_request.config.tightened = True
+        tightened_stats = createSolveStats()
+        tightened_output = runSimulations(tightened_request, stats=tightened_stats)
+        result['tightenedStatus'] = tightened_output['statusOfOptimalModel']
+        result['tightenedSolveSeconds'] = tightened_stats['timings'].get('solve')
+        result['tightenedNodes'] = tightened_stats['nodes']
+        result['tightenedObjective'] = tightened_stats['objective']
+
+    if http:
+        from fastapi.testclient import TestClient
+        from app.cache import resultCache
+        from app.main import app
+
+        # otherwise the result cache could answer the request without solving it
+        resultCache.clear()
+
+        body = request.json().encode('utf-8')
+        with TestClient(app) as client:
+            start = time.perf_counter()
+            response = client.post(OPTIMISATION_PATH, content=body, headers={ 'content-type': 'application/json' })
+            result['httpSeconds'] = time.perf_counter() - start
+        result['httpStatus'] = response.status_code
+        result['httpResponseBytes'] = len(response.content)
+
+    return result
+
+
+# runs in the process for each case, so that the solvers' logs don't
+#  end up amongst the results
+def _silenceOutput():
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+
+# run each case in a new process, returning the results in the same order
+#  (or the reason a case failed)
+def runIsolated(cases, http=True):
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for case in cases:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_silenceOutput) as executor:
+            try:
+                results.append(executor.submit(benchmarkSimulation, case, http).result())
+            except Exception as error:
+                results.append(dict(case, error=f'{type(error).__name__}: {error}'))
+    return results
+
+
+def getPackageVersion(package):
+    try:
+        from importlib.metadata import version
+        return version(package)
+    except Exception:
+        return None
+
+
+# the versions and machine the benchmarks were run on
+def getEnvironment():
+    try:
+        commit = subprocess.run([ 'git', 'rev-parse', 'HEAD' ], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'packages': { package: getPackageVersion(package) for package in [ 'pulp', 'highspy', 'numpy', 'scipy', 'pydantic', 'fastapi' ] }
+    }
+
+
+# the limits given on the command line, to replace the forecasts' limits
+def getLimits(args):
+    limits = {
+        'exactMinProduction': args.exact_min_production,
+        'maxPowerChangePh': args.max_power_change,
+        'minProductionRate': args.min_production_rate,
+        'storageWindow': args.storage_window
+    }
+    return { name: value for name, value in limits.items() if value } or None
+
+
+def getCases(args):
+    limits = getLimits(args)
+    cases = []
+    for model_name in args.models:
+        solvers = [ 'HiGHS' ] if model_name == 'matrix' else args.solvers
+        for solver_name in solvers:
+            if args.fixtures:
+                for fixture in FIXTURES:
+                    cases.append({ 'fixture': fixture, 'days': None, 'resolutionMinutes': None, 'model': model_name, 'solver': solver_name, 'timeLimit': args.time_limit, 'decomposition': args.decomposition, 'tightened': args.tightened, 'limits': limits })
+            for days in args.days:
+                for resolution_minutes in args.resolutions:
+                    periods = int(round(days * 24 * 60 / resolution_minutes))
+                    if model_name == 'dense' and periods > args.max_dense_periods:
+                        continue
+                    cases.append({ 'fixture': None, 'days': days, 'resolutionMinutes': resolution_minutes, 'model': model_name, 'solver': solver_name, 'timeLimit': args.time_limit, 'decomposition': args.decomposition, 'tightened': args.tightened, 'limits': limits })
+    return cases
+
+
+def printFullResult(result):
+    if 'error' in result:
+        name = result['fixture'] or f"{result['days']:g}d/{result['resolutionMinutes']}m"
+        print(f"{name:>12} {result['model']:>10} {result['solver']:>6} {result['error']}")
+        return
+
+    format_seconds = lambda seconds: f'{seconds:>8.3f}' if seconds is not None else f"{'-':>8}"
+    format_number = lambda value, width, spec='': f'{value:>{width}{spec}}' if value is not None else f"{'-':>{width}}"
+    name = result['fixture'] or f"{result['days']:g}d/{result['resolutionMinutes']}m"
+    print(f"{name:>12} {result['periods']:>7} {result['model']:>10} {result['solver']:>6} {result['status']:>10} "
+          f"{format_seconds(result['buildSeconds'])} {format_seconds(result['solveSeconds'])} {format_seconds(result['extractSeconds'])} "
+          f"{format_seconds(result['postProcessSeconds'])} {format_seconds(result['httpSeconds'])} "
+          f"{format_number(result['peakMemoryMB'], 8, '.0f')} {format_number(result['mipGap'], 8, '.2e')} {format_number(result['nonZeros'], 9)} "
+          f"{format_seconds(result['decomposedSeconds'])} {format_number(result['decompositionGap'], 8, '.2e')} "
+          f"{format_number(result['nodes'], 8)} {format_seconds(result['tightenedSolveSeconds'])} {format_number(result['tightenedNodes'], 8)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hydrogen production model')
+    parser.add_argument('--days', type=float, nargs='+', default=[1, 2, 7, 14])
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[30, 15, 5], help='period length in minutes')
+    parser.add_argument('--models', nargs='+', default=MODELS, choices=MODELS)
+    parser.add_argument('--max-dense-periods', type=int, default=2000,
+        help='skip the dense formulation above this many periods, as it grows quadratically')
+    parser.add_argument('--full', action='store_true',
+        help='also solve each model, measuring each phase, peak memory and HTTP latency')
+    parser.add_argument('--solvers', nargs='+', default=SOLVERS, help='solvers for the PuLP models, with --full')
+    parser.add_argument('--time-limit', type=float, default=60, help='time limit for each solve in seconds, with --full')
+    parser.add_argument('--fixtures', action='store_true', help='also benchmark the forecasts in test/, with --full')
+    parser.add_argument('--decomposition', type=int, nargs=2, metavar=('AGGREGATE_PERIODS', 'WINDOW_PERIODS'),
+        help='also solve each case with horizon decomposition, reporting its gap to the single model, with --full')
+    parser.add_argument('--tightened', action='store_true',
+        help='also solve each case with the tightened formulation, reporting its solve time and nodes, with --full')
+    parser.add_argument('--exact-min-production', action='store_true',
+        help='use config.exactMinProduction, so that the on/off decisions affect the plan, with --full')
+    parser.add_argument('--max-power-change', type=float, help='maxPowerChangePh for every case, with --full')
+    parser.add_argument('--min-production-rate', type=float, help='minProductionRate for every case, with --full')
+    parser.add_argument('--storage-window', type=int,
+        help='storage between minStorageSetPoint and maxStorage for every case, with --full')
+    parser.add_argument('--no-http', action='store_true', help="don't measure HTTP latency, with --full")
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    parser.add_argument('--output', help='write the results, and the environment they were measured in, to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+
+    if args.full:
+        if not args.json:
+            print(f"{'case':>12} {'periods':>7} {'model':>10} {'solver':>6} {'status':>10} {'build(s)':>8} {'solve(s)':>8} "
+                  f"{'extr(s)':>8} {'post(s)':>8} {'http(s)':>8} {'mem(MB)':>8} {'gap':>8} {'nnz':>9} {'dec(s)':>8} {'dec gap':>8} "
+                  f"{'nodes':>8} {'tgt(s)':>8} {'tgt nds':>8}")
+        for case in getCases(args):
+            result = runIsolated([ case ], http=not args.no_http)[0]
+            results.append(result)
+            if args.json:
+                print(json.dumps(result), flush=True)
+            else:
+                printFullResult(result)
+                sys.stdout.flush()
+    else:
+        if not args.json:
+            print(f"{'days':>6} {'res(min)':>8} {'periods':>8} {'model':>12} {'build(s)':>10} {'vars':>8} {'rows':>8} {'nnz':>10}")
+
+        for days in args.days:
+            for resolution_minutes in args.resolutions:
+                for model_name in args.models:
+                    periods = int(round(days * 24 * 60 / resolution_minutes))
+                    if model_name == 'dense' and periods > args.max_dense_periods:
+                        continue
+
+                    result = benchmarkModelBuild(days, resolution_minutes, model_name)
+                    results.append(result)
+                    if args.json:
+                        print(json.dumps(result))
+                    else:
+                        print(f"{result['days']:>6g} {result['resolutionMinutes']:>8} {result['periods']:>8} {result['model']:>12} "
+                              f"{result['buildSeconds']:>10.3f} {result['variables']:>8} {result['constraints']:>8} {result['nonZeros']:>10}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({ 'environment': getEnvironment(), 'full': args.full, 'results': results }, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from app.lpmodel import runSimulations
+from app.solvers import getSolverConfiguration
+
+#
+# cache of simulation outputs, so that identical requests don't each
+#  need the model to be solved
+#
+# outputs are keyed on a hash of the request (config and forecasts), along
+#  with the solver options that would be used for it and whether the output
+#  is columnar. only outputs where the
+#  optimal model was solved to optimality are cached
+#
+# the in-memory tier holds the most recently used outputs, up to a maximum
+#  number of entries. if a directory is given, outputs are also written there
+#  so that they survive restarts. entries in both tiers expire after a time
+#  to live. the directory is swept when the cache is created and after each
+#  write, removing expired entries and then the oldest entries (by the time
+#  they were written) beyond its own maximum number of entries
+#
+# the cache used by the service is configured with environment variables:
+#   HYDROGEN_CACHE_SIZE  - max entries held in memory (0 disables the cache)
+#   HYDROGEN_CACHE_TTL   - time to live of an entry, in seconds
+#   HYDROGEN_CACHE_DIR   - directory for the on-disk tier (optional)
+#   HYDROGEN_CACHE_DISK_SIZE - max entries held in the directory
+#
+
+DEFAULT_CACHE_SIZE = 128
+DEFAULT_CACHE_TTL = 600
+DEFAULT_CACHE_DISK_SIZE = 1024
+
+
+def getCacheKey(request, columnar=False):
+    canonical = {
+        'request': request.dict(exclude={ 'config': { 'solver' } }),
+        'solver': getSolverConfiguration(request).dict(),
+        'columnar': columnar
+    }
+    canonical_json = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical_json.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, directory=None, max_disk_entries=DEFAULT_CACHE_DISK_SIZE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        # key -> (expiry time, output), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._sweepDisk(time.time())
+
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, output = entry
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(output)
+                del self.entries[key]
+
+        entry = self._readFromDisk(key, now)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._putInMemory(key, entry)
+        return copy.deepcopy(entry[1])
+
+    def put(self, key, output):
+        now = time.time()
+        entry = (now + self.ttl, copy.deepcopy(output))
+        with self.lock:
+            self._putInMemory(key, entry)
+        if self.directory is not None:
+            self._writeToDisk(key, entry, now)
+            self._sweepDisk(now)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.directory is not None:
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.json'):
+                    os.remove(os.path.join(self.directory, filename))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'maxEntries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'diskEvictions': self.disk_evictions
+            }
+
+    # must be called holding self.lock
+    def _putInMemory(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _getPath(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _readFromDisk(self, key, now):
+        if self.directory is None:
+            return None
+        path = self._getPath(key)
+        try:
+            with open(path, encoding='utf-8') as cache_file:
+                stored = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if stored['expires'] <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return stored['expires'], stored['output']
+
+    def _writeToDisk(self, key, entry, now):
+        expires, output = entry
+        # write to a temporary file first, so that a partly written
+        #  entry is never read back
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as cache_file:
+            json.dump({ 'expires': expires, 'output': output }, cache_file)
+        # the entry's age is taken from when it was written
+        os.utime(temp_path, (now, now))
+        os.replace(temp_path, self._getPath(key))
+
+    # remove the expired entries from the directory, then the oldest
+    #  beyond max_disk_entries
+    def _sweepDisk(self, now):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                # removed by another sweep
+                pass
+        entries.sort()
+
+        remaining = len(entries)
+        for written, path in entries:
+            if written + self.ttl > now and remaining <= self.max_disk_entries:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            remaining -= 1
+            with self.lock:
+                self.disk_evictions += 1
+
+
+def createServiceResultCache():
+    return ResultCache(
+        max_entries=int(os.environ.get('HYDROGEN_CACHE_SIZE', DEFAULT_CACHE_SIZE)),
+        ttl=float(os.environ.get('HYDROGEN_CACHE_TTL', DEFAULT_CACHE_TTL)),
+        directory=os.environ.get('HYDROGEN_CACHE_DIR') or None,
+        max_disk_entries=int(os.environ.get('HYDROGEN_CACHE_DISK_SIZE', DEFAULT_CACHE_DISK_SIZE)))
+
+
+resultCache = createServiceResultCache()
+
+
+# stats (if given) is filled in as described in metrics.py, or just
+#  marked as cached if the output came from the cache
+def runCachedSimulations(request, cache=None, columnar=False, stats=None):
+    if cache is None:
+        cache = resultCache
+    if not cache.enabled():
+        return runSimulations(request, columnar, stats)
+
+    key = getCacheKey(request, columnar)
+    output = cache.get(key)
+    if output is None:
+        output = runSimulations(request, columnar, stats)
+        if output['statusOfOptimalModel'] == 'Optimal':
+            cache.put(key, output)
+    elif stats is not None:
+        stats['cached'] = True
+        stats['status'] = output['statusOfOptimalModel']
+        stats['solver'] = output['solverOfOptimalModel']
+    return output
@@ -0,0 +1,242 @@
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from app.batch import getBatchWorkers, getChunks, resetBatchExecutor, submitBatchTasks
+from app.electricity import ColumnarForecast, ForecastColumns
+from app.lpmodel import PLAN_STATUSES, ModelSolution, getForecastColumns, runOptimalSimulation
+from app.metrics import createSolveStats, timePhase
+
+#
+# horizon decomposition, for forecasts too long to solve as a single model
+#
+# the binary on/off variable per period makes the MILP much harder to solve
+#  as the horizon grows, so with config.decomposition the "optimal" simulation
+#  is solved in three stages:
+#
+#   1 - a coarse model, where every aggregatePeriods periods are merged into
+#       one (summing renewable generation and hydrogen demand, and averaging
+#       prices), is solved to decide how much hydrogen should be in storage
+#       at the end of each window
+#   2 - the forecast is split into windows of windowPeriods periods, which
+#       are solved at full resolution, each starting from the storage the
+#       coarse model planned for the end of the previous window and ending
+#       at the storage it planned for the end of this one
+#   3 - as the windows are solved independently, the power used at the end
+#       of one window can be far from the power used at the start of the
+#       next. so the periods either side of each boundary between windows
+#       (a seam, of half a window) are solved again at full resolution,
+#       starting and ending with the storage and power of the plan from the
+#       windows, which applies the ramp limit across the boundary
+#
+# as the windows only depend on the coarse model, and the seams only depend
+#  on the windows, the windows and then the seams are each solved in
+#  parallel in the pool of worker processes used for batches. every model
+#  is solved with the model builder and solver in the request's config
+#
+# the plan found can cost more than one found by solving the whole forecast
+#  as a single model, as the storage at the end of each window is fixed by
+#  the coarse model. benchmark.py --decomposition measures the difference in
+#  cost on the benchmark horizons
+#
+# if the coarse model can't be solved, the whole forecast is solved as a
+#  single model instead
+#
+
+# the plan from the windows only keeps storage above the min set point to
+#  within the solver's tolerance, so the seams may go this far below it (in
+#  m^3) rather than be infeasible where the plan was right on the limit
+SEAM_STORAGE_TOLERANCE = 1e-4
+
+
+# the forecast with every aggregate_periods periods merged into one, where
+#  the last period merges whatever periods are left over
+def aggregateForecasts(forecasts, aggregate_periods):
+    periods = len(forecasts['timestamp'])
+    starts = np.arange(0, periods, aggregate_periods)
+    counts = np.diff(np.append(starts, periods))
+
+    total = lambda field: np.add.reduceat(np.asarray(forecasts[field], dtype=float), starts)
+    return {
+        'timestamp': [ forecasts['timestamp'][start] for start in starts.tolist() ],
+        'renewableGeneration': total('renewableGeneration').tolist(),
+        'hydrogenDemand': total('hydrogenDemand').tolist(),
+        'gridPrice': (total('gridPrice') / counts).tolist(),
+        'renewablePrice': (total('renewablePrice') / counts).tolist()
+    }
+
+
+# request for a slice of the forecast, from start to end
+def createSubRequest(request, forecasts, start, end, range_config, storage_update, production_limits_update):
+    config = request.config.copy(update={
+        'range': range_config,
+        # planned storage levels aren't whole m^3, so are set without
+        #  being validated
+        'storage': request.config.storage.copy(update=storage_update),
+        'productionLimits': request.config.productionLimits.copy(update=production_limits_update),
+        'decomposition': None
+    })
+    return ColumnarForecast(config=config, forecasts=ForecastColumns(**{ field: values[start:end] for field, values in forecasts.items() }))
+
+
+def createCoarseRequest(request, forecasts):
+    aggregate_periods = request.config.decomposition.aggregatePeriods
+    coarse_forecasts = aggregateForecasts(forecasts, aggregate_periods)
+    range_config = request.config.range.copy(update={
+        'periods': len(coarse_forecasts['timestamp']),
+        'periodDuration': request.config.range.periodDuration * aggregate_periods
+    })
+    # the power before and after the forecast is for a single period, so
+    #  doesn't apply to the coarse periods
+    return createSubRequest(request, coarse_forecasts, 0, None, range_config, {}, { 'initialPower': None, 'finalPower': None })
+
+
+# hydrogen in storage at the end of each window, as planned by the coarse
+#  model (kept within the storage limits, in case of rounding by the solver)
+def getStorageTargets(request, forecasts, coarse_solution):
+    storage_config = request.config.storage
+    decomposition = request.config.decomposition
+    coarse_periods_per_window = decomposition.windowPeriods // decomposition.aggregatePeriods
+
+    coarse_demand = np.asarray(aggregateForecasts(forecasts, decomposition.aggregatePeriods)['hydrogenDemand'])
+    production = (coarse_solution.gridPower + coarse_solution.windPower) * request.config.productionLimits.productionFactor
+    storage = storage_config.initialStorage + np.cumsum(production - coarse_demand)
+
+    window_ends = np.arange(coarse_periods_per_window, len(storage) + coarse_periods_per_window, coarse_periods_per_window)
+    window_ends = np.minimum(window_ends, len(storage)) - 1
+    storage_targets = np.clip(storage[window_ends], storage_config.minStorageSetPoint, storage_config.maxStorage).tolist()
+    if storage_config.finalStorage is not None:
+        storage_targets[-1] = storage_config.finalStorage
+    return storage_targets
+
+
+def createWindowRequests(request, forecasts, storage_targets):
+    window_periods = request.config.decomposition.windowPeriods
+    periods = request.config.range.periods
+
+    window_requests = []
+    initial_storage = request.config.storage.initialStorage
+    for start, final_storage in zip(range(0, periods, window_periods), storage_targets):
+        end = min(start + window_periods, periods)
+        range_config = request.config.range.copy(update={ 'periods': end - start })
+        # the power before and after the forecast only applies to the
+        #  first and last windows
+        window_requests.append(createSubRequest(request, forecasts, start, end, range_config,
+            { 'initialStorage': initial_storage, 'finalStorage': final_storage },
+            { 'initialPower': request.config.productionLimits.initialPower if start == 0 else None,
+              'finalPower': request.config.productionLimits.finalPower if end == periods else None }))
+        initial_storage = final_storage
+    return window_requests
+
+
+# the first and last period of the seam around each boundary between
+#  windows (where the last period is excluded)
+def getSeams(request):
+    window_periods = request.config.decomposition.windowPeriods
+    periods = request.config.range.periods
+    half_seam = max(1, window_periods // 4)
+    return [ (boundary - half_seam, min(boundary + half_seam, periods)) for boundary in range(window_periods, periods, window_periods) ]
+
+
+# requests for the seams, starting and ending with the storage and power
+#  of the plan from the windows
+def createSeamRequests(request, forecasts, seams, solution):
+    power = solution.gridPower + solution.windPower
+    production = power * request.config.productionLimits.productionFactor
+    storage = request.config.storage.initialStorage + np.cumsum(production - np.asarray(forecasts['hydrogenDemand'], dtype=float))
+    periods = request.config.range.periods
+
+    seam_requests = []
+    for start, end in seams:
+        range_config = request.config.range.copy(update={ 'periods': end - start })
+        seam_requests.append(createSubRequest(request, forecasts, start, end, range_config,
+            { 'initialStorage': float(storage[start - 1]), 'finalStorage': float(storage[end - 1]),
+              'minStorageSetPoint': request.config.storage.minStorageSetPoint - SEAM_STORAGE_TOLERANCE },
+            { 'initialPower': float(power[start - 1]),
+              'finalPower': float(power[end]) if end < periods else request.config.productionLimits.finalPower }))
+    return seam_requests
+
+
+# runs in the worker processes
+def solveSubRequest(window_request):
+    stats = createSolveStats()
+    solution, model_status, solver_name = runOptimalSimulation(window_request, stats)
+    return solution, model_status, solver_name, stats
+
+
+# runs in the worker processes
+def solveSubRequestChunk(sub_requests):
+    return [ solveSubRequest(sub_request) for sub_request in sub_requests ]
+
+
+# solved in at most workers chunks of consecutive sub requests, so that
+#  the request uses no more of the shared pool than that
+def solveSubRequests(sub_requests, workers):
+    if workers <= 1 or len(sub_requests) <= 1:
+        return solveSubRequestChunk(sub_requests)
+
+    executor, futures = submitBatchTasks(solveSubRequestChunk, [ (chunk,) for chunk in getChunks(sub_requests, workers) ])
+    try:
+        return [ result for future in futures for result in future.result() ]
+    except BrokenProcessPool:
+        # a worker process died, so start a new pool for the next batch
+        resetBatchExecutor(executor)
+        raise
+
+
+# combine what the solver reported for each window and seam into stats -
+#  the size is of the largest model, and the gap is the largest of any model
+def addSubRequestStats(stats, sub_request_stats):
+    largest = max(sub_request_stats, key=lambda sub_stats: sub_stats['variables'] or 0)
+    for field in [ 'variables', 'integerVariables', 'constraints', 'nonZeros' ]:
+        stats[field] = largest[field]
+
+    for field, combine in [ ('mipGap', max), ('nodes', sum) ]:
+        values = [ sub_stats[field] for sub_stats in sub_request_stats ]
+        stats[field] = combine(values) if None not in values else None
+
+
+# solve the "optimal" simulation for a request with config.decomposition,
+#  returning the same as lpmodel.runOptimalSimulation
+#
+# stats (if given) has the timings of the coarse model, with the time spent
+#  solving the windows and seams (including building them) added to the
+#  solve phase
+def runDecomposedModel(request, stats=None):
+    if stats is None:
+        stats = createSolveStats()
+
+    forecasts = getForecastColumns(request.forecasts)
+    workers = request.config.decomposition.workers or getBatchWorkers()
+
+    coarse_solution, coarse_status, _ = runOptimalSimulation(createCoarseRequest(request, forecasts), stats)
+    if coarse_status not in PLAN_STATUSES:
+        return runOptimalSimulation(request.copy(update={ 'config': request.config.copy(update={ 'decomposition': None }) }), stats)
+
+    window_requests = createWindowRequests(request, forecasts, getStorageTargets(request, forecasts, coarse_solution))
+    with timePhase(stats, 'solve'):
+        windows = solveSubRequests(window_requests, workers)
+    solution = ModelSolution(*(np.concatenate([ window[0][i] for window in windows ]) for i in range(3)))
+
+    # the status of the first window that wasn't solved to optimality
+    model_status = next((window[1] for window in windows if window[1] != 'Optimal'), 'Optimal')
+
+    seams = getSeams(request)
+    seam_results = []
+    if model_status in PLAN_STATUSES and seams:
+        with timePhase(stats, 'solve'):
+            seam_results = solveSubRequests(createSeamRequests(request, forecasts, seams, solution), workers)
+        for (start, end), (seam_solution, seam_status, _, _) in zip(seams, seam_results):
+            if seam_status not in PLAN_STATUSES:
+                # keep the plan from the windows around this boundary,
+                #  along with their status
+                continue
+            if seam_status != 'Optimal' and model_status == 'Optimal':
+                model_status = seam_status
+            for values, seam_values in zip(solution, seam_solution):
+                values[start:end] = seam_values
+
+    addSubRequestStats(stats, [ window[3] for window in windows ] + [ seam[3] for seam in seam_results ])
+    stats['objective'] = float(np.dot(forecasts['gridPrice'], solution.gridPower) + np.dot(forecasts['renewablePrice'], solution.windPower))
+
+    return solution, model_status, windows[0][2]
@@ -1,10 +1,17 @@
-from pydantic import BaseModel, conlist
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel, conint, conlist, root_validator
 
 
 # --------------------------------------------------------
 #  INPUTS
 # --------------------------------------------------------
 
+# most worker processes a request can ask to be solved with, which are
+#  taken from the shared pool of HYDROGEN_BATCH_WORKERS processes (see
+#  batch.py), so a request never gets more than that many
+MAX_REQUEST_WORKERS = 256
+
 class ForecastItem(BaseModel):
     # unique identifier for the 30-minute window
     timestamp: str
@@ -27,6 +34,17 @@ class ProductionLimitsConfiguration(BaseModel):
     # proportion of electrolyser maximum
     #   (e.g. 0.15 would mean 15% of electrolyser maximum)
     minProductionRate: float
+    # in MWh, power used in the period before the simulation starts,
+    #   which the ramp limit applies to (by default there is no limit
+    #   on the power used in the first period)
+    initialPower: Optional[float] = None
+    # in MWh, power that will be used in the period after the
+    #   simulation ends, which the ramp limit applies to
+    finalPower: Optional[float] = None
+
+class ElectrolyserStackConfiguration(ProductionLimitsConfiguration):
+    # identifies the stack in the output
+    name: str
 
 class StorageConfiguration(BaseModel):
     # in m^3
@@ -35,6 +53,9 @@ class StorageConfiguration(BaseModel):
     maxStorage: int
     # in m^3
     minStorageSetPoint: int
+    # in m^3, storage to end the simulation with
+    #   (by default, storage ends no higher than initialStorage)
+    finalStorage: Optional[float] = None
 
 class RangeConfiguration(BaseModel):
     # number of periods being considered
@@ -42,15 +63,171 @@ class RangeConfiguration(BaseModel):
     # duration of a period in hours
     periodDuration: float
 
+class SolverConfiguration(BaseModel):
+    # solver for the "optimal" simulation - "CBC", "HiGHS" or
+    #   any other PuLP solver name (see pulp.listSolvers())
+    name: Optional[str] = None
+    # number of threads the solver may use
+    threads: Optional[int] = None
+    # in seconds
+    timeLimit: Optional[float] = None
+    # relative MIP gap at which the solver can stop
+    #   (e.g. 0.01 would stop within 1% of the best possible cost)
+    gapRel: Optional[float] = None
+
+class DecompositionConfiguration(BaseModel):
+    # number of periods merged into each period of the coarse model
+    aggregatePeriods: int
+    # number of periods in each window solved at full resolution
+    #   (must be a multiple of aggregatePeriods)
+    windowPeriods: int
+    # number of worker processes to solve the windows with
+    #   (defaults to HYDROGEN_BATCH_WORKERS)
+    workers: Optional[conint(ge=1, le=MAX_REQUEST_WORKERS)] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_window_periods(cls, values):
+        if values['aggregatePeriods'] < 1:
+            raise ValueError('aggregatePeriods must be at least 1')
+        if values['windowPeriods'] < 1 or values['windowPeriods'] % values['aggregatePeriods'] != 0:
+            raise ValueError('windowPeriods must be a multiple of aggregatePeriods')
+        return values
+
 class ModelConfiguration(BaseModel):
     range: RangeConfiguration
     productionLimits: ProductionLimitsConfiguration
     storage: StorageConfiguration
+    # how the storage constraints are expressed in the model
+    #   "dense" re-sums every earlier period in each constraint
+    #   "cumulative" uses a running-total variable per period,
+    #     which keeps the model size linear in the number of periods
+    formulation: Literal['dense', 'cumulative'] = 'dense'
+    # how the "optimal" model is assembled and solved
+    #   "pulp" builds the model from PuLP expressions, solved by CBC
+    #   "matrix" builds sparse arrays directly from the forecasts,
+    #     solved in-process by HiGHS (requires numpy and scipy)
+    modelBuilder: Literal['pulp', 'matrix'] = 'pulp'
+    # if true, the model uses tighter on/off constraints (see
+    #   lpmodel.buildOptimalModel), which allow the same plans but leave
+    #   the solver fewer branch and bound nodes to explore
+    tightened: bool = False
+    # if true, the electrolysers use at least minProductionRate of their
+    #   max consumption while on, rather than that divided by
+    #   productionFactor a second time (see
+    #   lpmodel.calculateMinConsumptionPerPeriod)
+    exactMinProduction: bool = False
+    # overrides the solver options configured for the service
+    solver: Optional[SolverConfiguration] = None
+    # if set, long horizons are solved as a coarse model followed
+    #   by windows at full resolution (see decomposition.py)
+    decomposition: Optional[DecompositionConfiguration] = None
+    # if set, the plant is modelled as these electrolyser stacks, each
+    #   with its own limits, rather than the single electrolyser of
+    #   productionLimits (see stacks.py)
+    stacks: Optional[conlist(item_type=ElectrolyserStackConfiguration, min_items=1)] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_stacks(cls, values):
+        stacks = values['stacks']
+        if stacks is None:
+            return values
+        names = [ stack.name for stack in stacks ]
+        if len(set(names)) != len(names):
+            raise ValueError('every stack must have a different name')
+        if values['decomposition'] is not None:
+            raise ValueError('decomposition can\'t be used with stacks')
+        return values
 
 class Forecast(BaseModel):
     config: ModelConfiguration
     forecasts: conlist(item_type=ForecastItem, min_items=1, unique_items=False)
 
+class ForecastColumns(BaseModel):
+    # the same fields as ForecastItem, as a list of values
+    #   per field - one value for each period
+    timestamp: conlist(item_type=str, min_items=1, unique_items=False)
+    renewableGeneration: List[float]
+    hydrogenDemand: List[float]
+    gridPrice: List[float]
+    renewablePrice: List[float]
+
+    @root_validator(skip_on_failure=True)
+    def check_same_length(cls, values):
+        periods = len(values['timestamp'])
+        for field in [ 'renewableGeneration', 'hydrogenDemand', 'gridPrice', 'renewablePrice' ]:
+            if len(values[field]) != periods:
+                raise ValueError(f'{field} has {len(values[field])} values, but there are {periods} timestamps')
+        return values
+
+class ColumnarForecast(BaseModel):
+    config: ModelConfiguration
+    forecasts: ForecastColumns
+
+class SweepConfiguration(BaseModel):
+    # values of storage.minStorageSetPoint to solve for
+    #   (defaults to the request's)
+    minStorageSetPoint: Optional[conlist(item_type=int, min_items=1)] = None
+    # values of storage.maxStorage to solve for
+    #   (defaults to the request's)
+    maxStorage: Optional[conlist(item_type=int, min_items=1)] = None
+    # factors to scale every gridPrice by (defaults to 1)
+    gridPriceScale: Optional[conlist(item_type=float, min_items=1)] = None
+    # number of worker processes to solve the points with
+    #   (defaults to HYDROGEN_BATCH_WORKERS)
+    workers: Optional[conint(ge=1, le=MAX_REQUEST_WORKERS)] = None
+
+class ForecastSweep(Forecast):
+    # the request is solved for every combination of the values
+    #   given here (see sweep.py)
+    sweep: SweepConfiguration
+
+class EnsembleConfiguration(BaseModel):
+    # renewableGeneration for each member of a forecast ensemble,
+    #   as a list of values per member - one value for each period
+    members: conlist(item_type=List[float], min_items=1)
+    # probability of each member (defaults to equal probabilities)
+    probabilities: Optional[List[float]] = None
+    # number of periods at the start of the forecast whose power and
+    #   on/off status must be the same for every member
+    firstStagePeriods: int = 1
+    # number of representative scenarios the members are clustered
+    #   into (defaults to DEFAULT_SCENARIOS in stochastic.py)
+    scenarios: Optional[int] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_members(cls, values):
+        members = values['members']
+        if any(len(member) != len(members[0]) for member in members):
+            raise ValueError('every member must have the same number of values')
+        probabilities = values['probabilities']
+        if probabilities is not None:
+            if len(probabilities) != len(members):
+                raise ValueError(f'there are {len(probabilities)} probabilities, but {len(members)} members')
+            if any(probability < 0 for probability in probabilities) or abs(sum(probabilities) - 1) > 1e-6:
+                raise ValueError('probabilities must be at least 0 and add up to 1')
+        if values['firstStagePeriods'] < 1:
+            raise ValueError('firstStagePeriods must be at least 1')
+        if values['scenarios'] is not None and values['scenarios'] < 1:
+            raise ValueError('scenarios must be at least 1')
+        return values
+
+class ForecastEnsemble(Forecast):
+    # the "optimal" simulation is solved for the renewable generation
+    #   of every member, rather than that of the forecasts (see
+    #   stochastic.py)
+    ensemble: EnsembleConfiguration
+
+    @root_validator(skip_on_failure=True)
+    def check_ensemble_periods(cls, values):
+        periods = len(values['forecasts'])
+        if len(values['ensemble'].members[0]) != periods:
+            raise ValueError(f'ensemble members have {len(values["ensemble"].members[0])} values, but there are {periods} forecasts')
+        if values['ensemble'].firstStagePeriods > periods:
+            raise ValueError('firstStagePeriods must not be more than the number of forecasts')
+        if values['config'].stacks is not None:
+            raise ValueError('an ensemble can\'t be used with stacks')
+        return values
+
 
 # --------------------------------------------------------
 #  OUTPUTS
@@ -83,7 +260,178 @@ class SimulationType(BaseModel):
     optimal: SimulationOutputPerPeriod
     hypotheticalWindOnly: SimulationOutputPerPeriod
 
+class ElectricitySourceColumns(BaseModel):
+    wind: List[float]
+    grid: List[float]
+    total: List[float]
+
+class StackOutput(BaseModel):
+    name: str
+    # the power used and hydrogen produced by the stack in the "optimal"
+    #   simulation, as a list of values per field - one for each period
+    electricityUsage: ElectricitySourceColumns
+    hydrogenProduced: ElectricitySourceColumns
+    electrolyserOn: List[bool]
+
 class SimulationOutput(BaseModel):
     simulations: conlist(item_type=SimulationType, min_items=1, unique_items=False)
     statusOfOptimalModel: str
+    # name of the solver that produced the "optimal" simulation
+    solverOfOptimalModel: str
+    # relative gap between the cost of the "optimal" simulation and the
+    #   best possible cost, if the solver stopped before proving it
+    #   optimal (status Feasible or Heuristic)
+    mipGapOfOptimalModel: Optional[float] = None
+    # the "optimal" simulation of each stack, if config.stacks is set
+    stacks: Optional[List[StackOutput]] = None
+    units: OutputUnits
+
+class SimulationColumns(BaseModel):
+    # the same fields as SimulationOutputPerPeriod, as a list of
+    #   values per field - one value for each period
+    electricityUsage: ElectricitySourceColumns
+    electricityCost: ElectricitySourceColumns
+    electricityCostCumulative: ElectricitySourceColumns
+    hydrogenProduced: ElectricitySourceColumns
+    hydrogenInStorage: List[float]
+    electrolyserOn: List[bool]
+
+class SimulationTypeColumns(BaseModel):
+    timestamp: List[str]
+    optimal: SimulationColumns
+    hypotheticalWindOnly: SimulationColumns
+
+class ColumnarSimulationOutput(BaseModel):
+    simulations: SimulationTypeColumns
+    statusOfOptimalModel: str
+    solverOfOptimalModel: str
+    mipGapOfOptimalModel: Optional[float] = None
+    stacks: Optional[List[StackOutput]] = None
+    units: OutputUnits
+
+class ScenarioOutput(BaseModel):
+    # probability of the scenario - the total of the members it represents
+    probability: float
+    # position in ensemble.members of the member whose renewable
+    #   generation the scenario was solved for
+    representative: int
+    # positions of all the members the scenario represents
+    members: List[int]
+    # simulations for the representative's renewable generation, which
+    #   share the plan for the first stage periods with every scenario
+    simulations: SimulationTypeColumns
+
+class StochasticSimulationOutput(BaseModel):
+    scenarios: List[ScenarioOutput]
+    firstStagePeriods: int
+    # probability-weighted electricityCost of the "optimal" simulation
+    #   over all periods of every scenario
+    expectedCost: Optional[float] = None
+    statusOfOptimalModel: str
+    solverOfOptimalModel: str
+    mipGapOfOptimalModel: Optional[float] = None
     units: OutputUnits
+
+class SolveMetadata(BaseModel):
+    # seconds spent in each phase of the run - feasibility, build,
+    #   solve, extract and postProcess
+    timings: Dict[str, float]
+    # size of the model for the "optimal" simulation
+    variables: Optional[int] = None
+    integerVariables: Optional[int] = None
+    constraints: Optional[int] = None
+    nonZeros: Optional[int] = None
+    status: Optional[str] = None
+    solver: Optional[str] = None
+    # cost of the plan found by the solver
+    objective: Optional[float] = None
+    # relative gap between the plan found and the best possible plan
+    mipGap: Optional[float] = None
+    # number of branch and bound nodes explored by the solver
+    nodes: Optional[int] = None
+    # whether the output came from the result cache, rather
+    #   than the model being solved
+    cached: bool = False
+
+class SimulationOutputWithMetadata(SimulationOutput):
+    # only included when asked for
+    metadata: Optional[SolveMetadata] = None
+
+class ForecastBatch(BaseModel):
+    items: conlist(item_type=Forecast, min_items=1, unique_items=False)
+
+class BatchItemOutput(BaseModel):
+    # output for the forecast at the same position in the batch
+    output: Optional[SimulationOutput] = None
+    # reason the forecast couldn't be run, if it failed
+    error: Optional[str] = None
+
+class SimulationOutputBatch(BaseModel):
+    items: List[BatchItemOutput]
+
+class JobStatus(BaseModel):
+    jobId: str
+    # queued, running, succeeded, failed, cancelled or timedOut
+    status: str
+    # seconds since the epoch
+    submittedAt: float
+    startedAt: Optional[float] = None
+    finishedAt: Optional[float] = None
+    # reason the job failed or timed out
+    error: Optional[str] = None
+    # output of the job, once it has succeeded
+    result: Optional[SimulationOutput] = None
+
+class PlanSetpoints(BaseModel):
+    # electricityUsage of the period, in MWh
+    gridPower: float
+    windPower: float
+    electrolyserOn: bool
+
+class PlanPeriodChange(PlanSetpoints):
+    timestamp: str
+    # setpoints of the period in the earlier plan, or null if it
+    #   wasn't in that plan
+    previous: Optional[PlanSetpoints] = None
+
+class PlanChanges(BaseModel):
+    plantId: str
+    planId: int
+    # seconds since the epoch
+    createdAt: float
+    # plan the periods changed from, or null if every period is returned
+    previousPlanId: Optional[int] = None
+    periods: List[PlanPeriodChange]
+
+class PlanSummary(BaseModel):
+    planId: int
+    createdAt: float
+    statusOfOptimalModel: str
+    solverOfOptimalModel: str
+    periods: int
+
+class SweepTable(BaseModel):
+    # one value for each combination of the swept parameters
+    minStorageSetPoint: List[int]
+    maxStorage: List[int]
+    gridPriceScale: List[float]
+    statusOfOptimalModel: List[str]
+    mipGapOfOptimalModel: List[Optional[float]]
+    # totals over all periods of the "optimal" simulation, which
+    #   are null where there's no plan
+    electricityCost: List[Optional[float]]
+    electricityUsageWind: List[Optional[float]]
+    electricityUsageGrid: List[Optional[float]]
+    hydrogenProduced: List[Optional[float]]
+    # hydrogen in storage at the end of the last period
+    finalHydrogenInStorage: List[Optional[float]]
+    # number of periods the electrolyser is on for
+    periodsElectrolyserOn: List[Optional[int]]
+    # why there's no plan, where the request was rejected
+    #   before being solved
+    error: List[Optional[str]]
+
+class SweepOutput(BaseModel):
+    table: SweepTable
+    solverOfOptimalModel: str
+    units: Dict[str, Optional[str]]
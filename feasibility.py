@@ -0,0 +1,217 @@
+import numpy as np
+
+from app.lpmodel import calculateMaxConsumptionPerPeriod, calculateMinConsumptionPerPeriod, getForecastColumns, getMinimumStorage
+
+#
+# checks that a request could have a plan before building its model
+#
+# some requests can't be met by any plan - e.g. a minStorageSetPoint that
+#  can't be reached after a spike in demand without producing faster than
+#  maxProductionPh allows, or a ramp from initialPower that is too slow to
+#  keep up with demand. the solver takes as long to prove that as it does
+#  to solve a feasible request (or runs to its time limit and gives up), so
+#  instead the bounds the model's constraints put on the electricity
+#  consumed are checked first, with a few array operations over the
+#  periods:
+#
+#   power - the power used each period is bounded by:
+#             constraint 2 (maxProductionPh), and constraint 7 ramping
+#             from initialPower and to finalPower where they are given
+#           and must be either 0 or at least the min production rate
+#             (constraint 5)
+#
+#   min storage - the electricity consumed up to each period must be
+#           enough to keep storage above the min set point (constraint 3),
+#           which can't be met if it's more than could be consumed since
+#           the start, or since any earlier period where storage had to be
+#           below maxStorage (constraint 4)
+#
+#   max storage - likewise the electricity consumed up to each period must
+#           not fill storage past maxStorage (constraint 4), which can't be
+#           met if the least that has to be consumed since the start, or
+#           since any earlier period where storage had to be above the min
+#           set point (constraint 3), is more than that
+#
+# these are necessary conditions only, so a request that passes may still
+#  turn out to be infeasible when solved (e.g. because of the ramp limits
+#  between periods), but a request that fails is rejected with an
+#  InfeasibleRequestError naming the first period that can't be met, and
+#  the constraint of the model that would be broken there
+#
+# with several stacks (config.stacks), the power bounds are those of each
+#  stack, and as stacks with different production factors can only be added
+#  up as the hydrogen they produce, the storage bounds are checked in m^3
+#  of hydrogen rather than MWh
+#
+
+# slack (in MWh) allowed for rounding before a bound is taken to be broken
+FEASIBILITY_TOLERANCE = 1e-6
+
+# names of the model's constraints (see lpmodel.buildOptimalModel),
+#  without the period
+MAX_CONSUMPTION_CONSTRAINT = 'Max elec consumption'
+MIN_STORAGE_CONSTRAINT = 'Elec to maintain min storage'
+MAX_STORAGE_CONSTRAINT = 'Max elec used given storage limit'
+
+
+class InfeasibleRequestError(ValueError):
+    def __init__(self, period, timestamp, constraint, message):
+        super().__init__(f'no plan can meet the request: period {period} ({timestamp}) breaks constraint "{constraint}": {message}')
+        self.period = period
+        self.timestamp = timestamp
+        self.constraint = constraint
+        self.reason = message
+
+    # as returned in the detail of the service's error responses
+    def toDict(self):
+        return {
+            'period': self.period,
+            'timestamp': self.timestamp,
+            'constraint': self.constraint,
+            'message': self.reason
+        }
+
+
+# the least and most power (in MWh) that can be used in each period,
+#  from the limits on the power of the electrolysers alone
+#
+# limits are the productionLimits of the config, or one of its stacks
+def calculatePowerBounds(config, limits=None):
+    periods = config.range.periods
+    if limits is None:
+        limits = config.productionLimits
+    max_consumption = calculateMaxConsumptionPerPeriod(config, limits)
+    # as in constraint 5 of the model
+    min_consumption = calculateMinConsumptionPerPeriod(config, limits)
+    max_power_change = limits.maxPowerChangePh * config.range.periodDuration
+
+    upper = np.full(periods, max_consumption, dtype=float)
+    lower = np.zeros(periods)
+    if limits.initialPower is not None:
+        periods_from_start = np.arange(1, periods + 1)
+        upper = np.minimum(upper, limits.initialPower + periods_from_start * max_power_change)
+        lower = np.maximum(lower, limits.initialPower - periods_from_start * max_power_change)
+    if limits.finalPower is not None:
+        periods_to_end = np.arange(periods, 0, -1)
+        upper = np.minimum(upper, limits.finalPower + periods_to_end * max_power_change)
+        lower = np.maximum(lower, limits.finalPower - periods_to_end * max_power_change)
+
+    # the electrolyser is off in periods where it can't reach its min
+    #  production rate, and must reach it in periods where it can't be off
+    upper = np.where(upper < min_consumption - FEASIBILITY_TOLERANCE, 0.0, upper)
+    lower = np.where(lower > FEASIBILITY_TOLERANCE, np.maximum(lower, min_consumption), lower)
+    return lower, upper
+
+
+# the least and most electricity (in MWh) that must be consumed from the
+#  start of the simulation up to the end of each period to keep storage
+#  within its limits (constraints 3 and 4 of the model), or with a
+#  production_factor of 1, the least and most hydrogen (in m^3) produced
+def calculateStorageBounds(request, production_factor=None):
+    periods = request.config.range.periods
+    storage = request.config.storage
+    if production_factor is None:
+        production_factor = request.config.productionLimits.productionFactor
+    cumulative_demand = np.cumsum(np.asarray(getForecastColumns(request.forecasts)['hydrogenDemand'], dtype=float))
+
+    min_storage = np.full(periods, storage.minStorageSetPoint, dtype=float)
+    min_storage[-1] = getMinimumStorage(storage, True)
+    max_storage = np.full(periods, storage.maxStorage, dtype=float)
+    # storage ends where it started, unless a final storage is given
+    max_storage[-1] = storage.finalStorage if storage.finalStorage is not None else storage.initialStorage
+
+    lower = np.maximum(0, (min_storage - storage.initialStorage + cumulative_demand) / production_factor)
+    upper = (max_storage - storage.initialStorage + cumulative_demand) / production_factor
+    return lower, upper
+
+
+def _firstViolation(violated):
+    periods = np.flatnonzero(violated)
+    return int(periods[0]) if len(periods) else None
+
+
+# the earlier period (or -1 for the start of the simulation) that a bound
+#  on the electricity consumed since then is tightest from, for each period
+def _runningArgBest(values, accumulate):
+    best = accumulate(values)
+    positions = np.where(values == best, np.arange(len(values)), 0)
+    return np.maximum.accumulate(positions) - 1
+
+
+# raises InfeasibleRequestError if no plan can meet the request
+def checkFeasibility(request):
+    config = request.config
+    timestamps = getForecastColumns(request.forecasts)['timestamp']
+
+    if config.stacks is None:
+        units = [ ('the electrolysers', config.productionLimits) ]
+    else:
+        units = [ (f'stack {stack.name}', stack) for stack in config.stacks ]
+    unit_bounds = [ calculatePowerBounds(config, limits) for _, limits in units ]
+    unit_violated = [ lower > upper + FEASIBILITY_TOLERANCE for lower, upper in unit_bounds ]
+    power_violated = np.any(unit_violated, axis=0)
+
+    if config.stacks is None:
+        power_lower, power_upper = unit_bounds[0]
+        consumed_lower, consumed_upper = calculateStorageBounds(request)
+        quantity, consumed, consume = 'MWh', 'consumed', 'consume'
+        tolerance = FEASIBILITY_TOLERANCE
+    else:
+        factors = [ limits.productionFactor for _, limits in units ]
+        power_lower = sum(lower * factor for (lower, _), factor in zip(unit_bounds, factors))
+        power_upper = sum(upper * factor for (_, upper), factor in zip(unit_bounds, factors))
+        consumed_lower, consumed_upper = calculateStorageBounds(request, production_factor=1)
+        quantity, consumed, consume = 'm^3 of hydrogen', 'produced', 'produce'
+        tolerance = FEASIBILITY_TOLERANCE * max(factors)
+
+    # electricity that can be consumed from the start up to each period,
+    #  with 0 for the start of the simulation itself
+    most_consumed = np.concatenate(([ 0.0 ], np.cumsum(power_upper)))
+    least_consumed = np.concatenate(([ 0.0 ], np.cumsum(power_lower)))
+
+    # min storage: consumed_lower[i] - most_consumed[i] <= consumed_upper[k] - most_consumed[k]
+    #  for every earlier period k (or the start)
+    headroom = np.concatenate(([ 0.0 ], consumed_upper - most_consumed[1:]))
+    tightest_headroom = np.minimum.accumulate(headroom)[1:]
+    min_storage_violated = consumed_lower - most_consumed[1:] > tightest_headroom + tolerance
+
+    # max storage: consumed_lower[k] - least_consumed[k] <= consumed_upper[i] - least_consumed[i]
+    #  for every earlier period k (or the start)
+    shortfall = np.concatenate(([ 0.0 ], consumed_lower - least_consumed[1:]))
+    largest_shortfall = np.maximum.accumulate(shortfall)[1:]
+    max_storage_violated = largest_shortfall > consumed_upper - least_consumed[1:] + tolerance
+
+    first_periods = [ _firstViolation(violated) for violated in [ power_violated, min_storage_violated, max_storage_violated ] ]
+    first_period = min([ period for period in first_periods if period is not None ], default=None)
+    if first_period is None:
+        return
+
+    i = first_period
+    if first_periods[0] == i:
+        j = next(j for j, violated in enumerate(unit_violated) if violated[i])
+        electrolysers = units[j][0]
+        lower, upper = unit_bounds[j]
+        raise InfeasibleRequestError(i, timestamps[i], MAX_CONSUMPTION_CONSTRAINT,
+            f'the power used must be at least {lower[i]:g} MWh to ramp from initialPower / to finalPower, '
+            f'but {electrolysers} can use at most {upper[i]:g} MWh')
+
+    if first_periods[1] == i:
+        k = _runningArgBest(headroom, np.minimum.accumulate)[i + 1]
+        needed = consumed_lower[i] - (consumed_upper[k] if k >= 0 else 0)
+        available = most_consumed[i + 1] - most_consumed[k + 1]
+        since = f'period {k} ({timestamps[k]}), when storage must be at most {config.storage.maxStorage:g} m^3' if k >= 0 else 'the start of the simulation'
+        if k == i:
+            # the storage limits can't both be met, whatever is consumed
+            raise InfeasibleRequestError(i, timestamps[i], MIN_STORAGE_CONSTRAINT if consumed_lower[i] > 0 else MAX_STORAGE_CONSTRAINT,
+                f'keeping storage above the min set point needs at least {consumed_lower[i]:g} {quantity} to be {consumed}, '
+                f'but at most {consumed_upper[i]:g} {quantity} can be {consumed} without going over the storage limit')
+        raise InfeasibleRequestError(i, timestamps[i], MIN_STORAGE_CONSTRAINT,
+            f'keeping storage above the min set point needs at least {needed:g} {quantity} to be {consumed} since {since}, '
+            f'but the electrolysers can {consume} at most {available:g} {quantity} in that time')
+
+    k = _runningArgBest(shortfall, np.maximum.accumulate)[i + 1]
+    required = least_consumed[i + 1] - least_consumed[k + 1] + (consumed_lower[k] if k >= 0 else 0)
+    since = f'keeping storage above the min set point in period {k} ({timestamps[k]}) and then ' if k >= 0 else ''
+    raise InfeasibleRequestError(i, timestamps[i], MAX_STORAGE_CONSTRAINT,
+        f'keeping storage under its limit needs at most {consumed_upper[i]:g} {quantity} to be {consumed}, '
+        f'but {since}using the least power the electrolysers can needs at least {required:g} {quantity}')
@@ -0,0 +1,279 @@
+import json
+
+from app.electricity import ColumnarForecast, Forecast
+from app.lpmodel import iterSimulationColumns
+
+#
+# formats for the requests and responses of the optimisation endpoint
+#
+# forecasts and simulation outputs can either be sent as a list of objects,
+#  one per period (Forecast and SimulationOutput), or as columns - a list of
+#  values per field (ColumnarForecast and ColumnarSimulationOutput) - which
+#  is much smaller and quicker to read and write for long horizons
+#
+# the format of a request is given by its Content-Type header, and the
+#  format of the response is chosen from its Accept header:
+#   application/json                          - one object per period (the default)
+#   application/vnd.hydrogen.columnar+json    - columns, as JSON
+#   application/vnd.hydrogen.columnar+msgpack - columns, as MessagePack (requires msgpack)
+#   application/vnd.apache.arrow.stream       - columns, as an Arrow IPC stream (requires pyarrow)
+#
+# responses (but not requests) can also be streamed a period at a time:
+#   application/x-ndjson - a line of JSON per record
+#   text/event-stream    - an event per record, as Server-Sent Events
+#
+#  where the first record (a "header" event) has everything but the
+#  simulations, along with the number of periods, and each record after
+#  that (a "period" event) is a period of the simulations, in the same form
+#  as the periods of the application/json output. the records are written
+#  from the columns of the output as they are sent, so the whole response is
+#  never held in memory. an event stream ends with an "end" event
+#
+# in an Arrow stream each forecast or simulation field is a column of the
+#  record batch, with dotted names for nested simulation fields (e.g.
+#  optimal.electricityUsage.wind). everything else (the config of a request,
+#  or the status and units of a response) is JSON in the schema metadata
+#
+
+JSON = 'application/json'
+COLUMNAR_JSON = 'application/vnd.hydrogen.columnar+json'
+COLUMNAR_MSGPACK = 'application/vnd.hydrogen.columnar+msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+NDJSON = 'application/x-ndjson'
+EVENT_STREAM = 'text/event-stream'
+
+# formats of requests and responses
+FORMATS = [ JSON, COLUMNAR_JSON, COLUMNAR_MSGPACK, ARROW ]
+# formats only of responses
+STREAMING_FORMATS = [ NDJSON, EVENT_STREAM ]
+RESPONSE_FORMATS = FORMATS + STREAMING_FORMATS
+
+# number of periods written to each chunk of a streamed response
+STREAM_CHUNK_PERIODS = 64
+
+# the packages needed for each binary format
+FORMAT_PACKAGES = {
+    COLUMNAR_MSGPACK: 'msgpack',
+    ARROW: 'pyarrow'
+}
+
+SIMULATION_NAMES = [ 'optimal', 'hypotheticalWindOnly' ]
+SOURCE_FIELDS = [ 'electricityUsage', 'electricityCost', 'electricityCostCumulative', 'hydrogenProduced' ]
+ARROW_METADATA_FIELDS = [ 'statusOfOptimalModel', 'solverOfOptimalModel', 'mipGapOfOptimalModel', 'stacks', 'units' ]
+
+
+class UnsupportedMediaTypeError(ValueError):
+    pass
+
+class NotAcceptableError(ValueError):
+    pass
+
+# the body of a request couldn't be decoded in the format it was sent in
+class InvalidBodyError(ValueError):
+    pass
+
+
+def isColumnar(media_type):
+    return media_type != JSON
+
+
+def isStreaming(media_type):
+    return media_type in STREAMING_FORMATS
+
+
+def isFormatAvailable(media_type):
+    package = FORMAT_PACKAGES.get(media_type)
+    if package is None:
+        return True
+    try:
+        __import__(package)
+    except ImportError:
+        return False
+    return True
+
+
+# the media type of a Content-Type header, without any parameters
+def getMediaType(content_type):
+    return content_type.split(';')[0].strip().lower()
+
+
+# choose the format of the response from an Accept header, preferring
+#  the types with the highest quality, then the order they are listed in
+def negotiateResponseFormat(accept):
+    if not accept:
+        return JSON
+
+    accepted = []
+    for position, entry in enumerate(accept.split(',')):
+        media_type, *parameters = [ part.strip() for part in entry.split(';') ]
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.append((-quality, position, media_type.lower()))
+
+    for _, _, media_type in sorted(accepted):
+        if media_type in ('*/*', 'application/*'):
+            return JSON
+        if media_type in RESPONSE_FORMATS and isFormatAvailable(media_type):
+            return media_type
+
+    available = [ media_type for media_type in RESPONSE_FORMATS if isFormatAvailable(media_type) ]
+    raise NotAcceptableError(f'cannot respond with any of: {accept} (available: {", ".join(available)})')
+
+
+# read a Forecast or ColumnarForecast from the body of a request
+#  (raises pydantic.ValidationError if it isn't a valid forecast)
+def parseForecast(body, content_type):
+    media_type = getMediaType(content_type) if content_type else JSON
+
+    if media_type == JSON:
+        return Forecast.parse_raw(body)
+    if media_type == COLUMNAR_JSON:
+        return ColumnarForecast.parse_raw(body)
+    if media_type not in FORMATS:
+        raise UnsupportedMediaTypeError(f'unsupported request format: {media_type} (supported: {", ".join(FORMATS)})')
+    if not isFormatAvailable(media_type):
+        raise UnsupportedMediaTypeError(f'{media_type} requires the {FORMAT_PACKAGES[media_type]} package')
+
+    if media_type == COLUMNAR_MSGPACK:
+        import msgpack
+        try:
+            data = msgpack.unpackb(body)
+        except Exception as error:
+            raise InvalidBodyError(f'invalid MessagePack: {error}')
+        return ColumnarForecast.parse_obj(data)
+
+    table = _readArrowTable(body)
+    metadata = table.schema.metadata or {}
+    if b'config' not in metadata:
+        raise InvalidBodyError('Arrow stream has no config in its schema metadata')
+    return ColumnarForecast.parse_obj({
+        'config': json.loads(metadata[b'config']),
+        'forecasts': table.to_pydict()
+    })
+
+
+# write the output of lpmodel.runSimulations in the given format, where
+#  the output must be columnar for any format other than JSON
+def encodeSimulationOutput(output, media_type):
+    if isStreaming(media_type):
+        return b''.join(iterSimulationOutput(output, media_type))
+
+    if media_type in (JSON, COLUMNAR_JSON):
+        # as written by FastAPI's JSONResponse
+        return json.dumps(output, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+    if media_type == COLUMNAR_MSGPACK:
+        import msgpack
+        return msgpack.packb(output)
+
+    import pyarrow as pa
+    simulations = output['simulations']
+    columns = { 'timestamp': pa.array(simulations['timestamp'], type=pa.string()) }
+    for simulation_name in SIMULATION_NAMES:
+        simulation = simulations[simulation_name]
+        for field in SOURCE_FIELDS:
+            for source in [ 'wind', 'grid', 'total' ]:
+                columns[f'{simulation_name}.{field}.{source}'] = pa.array(simulation[field][source], type=pa.float64())
+        columns[f'{simulation_name}.hydrogenInStorage'] = pa.array(simulation['hydrogenInStorage'], type=pa.float64())
+        columns[f'{simulation_name}.electrolyserOn'] = pa.array(simulation['electrolyserOn'], type=pa.bool_())
+
+    metadata = { field: json.dumps(output[field]) for field in ARROW_METADATA_FIELDS }
+    table = pa.table(columns, metadata=metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# write a columnar output of lpmodel.runSimulations as the chunks of a
+#  streamed response (see the top of this file)
+def iterSimulationOutput(output, media_type):
+    simulations = output['simulations']
+    header = { field: value for field, value in output.items() if field != 'simulations' }
+    header['periods'] = len(simulations['timestamp'])
+    yield _encodeRecord('header', header, media_type)
+
+    chunk = []
+    for timestamp, optimal, hypothetical_wind_only in zip(simulations['timestamp'],
+            iterSimulationColumns(simulations['optimal']),
+            iterSimulationColumns(simulations['hypotheticalWindOnly'])):
+        chunk.append(_encodeRecord('period', { 'timestamp': timestamp, 'optimal': optimal, 'hypotheticalWindOnly': hypothetical_wind_only }, media_type))
+        if len(chunk) == STREAM_CHUNK_PERIODS:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
+
+    if media_type == EVENT_STREAM:
+        yield _encodeRecord('end', {}, media_type)
+
+
+def _encodeRecord(event, record, media_type):
+    data = json.dumps(record, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    if media_type == EVENT_STREAM:
+        return f'event: {event}\ndata: {data}\n\n'.encode('utf-8')
+    return (data + '\n').encode('utf-8')
+
+
+# read an output written by encodeSimulationOutput, where a streamed
+#  output is read as the (non-columnar) JSON output
+def decodeSimulationOutput(body, media_type):
+    if isStreaming(media_type):
+        records = _decodeRecords(body, media_type)
+        output = records[0]
+        del output['periods']
+        output['simulations'] = records[1:]
+        return output
+
+    if media_type in (JSON, COLUMNAR_JSON):
+        return json.loads(body)
+
+    if media_type == COLUMNAR_MSGPACK:
+        import msgpack
+        return msgpack.unpackb(body)
+
+    table = _readArrowTable(body)
+    columns = table.to_pydict()
+    simulations = { 'timestamp': columns['timestamp'] }
+    for simulation_name in SIMULATION_NAMES:
+        simulation = {}
+        for field in SOURCE_FIELDS:
+            simulation[field] = { source: columns[f'{simulation_name}.{field}.{source}'] for source in [ 'wind', 'grid', 'total' ] }
+        simulation['hydrogenInStorage'] = columns[f'{simulation_name}.hydrogenInStorage']
+        simulation['electrolyserOn'] = columns[f'{simulation_name}.electrolyserOn']
+        simulations[simulation_name] = simulation
+
+    output = { 'simulations': simulations }
+    for field in ARROW_METADATA_FIELDS:
+        output[field] = json.loads(table.schema.metadata[field.encode('utf-8')])
+    return output
+
+
+def _decodeRecords(body, media_type):
+    text = body.decode('utf-8')
+    if media_type == NDJSON:
+        return [ json.loads(line) for line in text.splitlines() if line ]
+    records = []
+    for event in text.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in event.splitlines())
+        if fields.get('event') in ('header', 'period'):
+            records.append(json.loads(fields['data']))
+    return records
+
+
+def _readArrowTable(body):
+    import pyarrow as pa
+    try:
+        with pa.ipc.open_stream(body) as reader:
+            return reader.read_all()
+    except pa.ArrowInvalid as error:
+        raise InvalidBodyError(f'invalid Arrow stream: {error}')
@@ -0,0 +1,304 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+
+from app.cache import getCacheKey, resultCache
+from app.lpmodel import runSimulations
+from app.metrics import createSolveStats, metricsRegistry
+
+#
+# asynchronous optimisation jobs
+#
+# jobs are queued and run in worker processes, so long solves don't tie up
+#  the threads that serve other requests. each job runs in its own process
+#  (forked from a server process that has already imported the model), so a
+#  job that is cancelled or runs past its timeout can be killed along with
+#  any solver process it started, without affecting other jobs
+#
+# a job's stats (see metrics.py) are returned from its worker process along
+#  with its output, and recorded in metrics.metricsRegistry of this process,
+#  as that of the worker process is lost when it exits
+#
+# back-pressure is applied by limiting both the number of jobs running at
+#  once and the number waiting to run; submitting a job when the queue is
+#  full raises JobQueueFullError
+#
+# the job manager used by the service is configured with environment variables:
+#   HYDROGEN_JOB_WORKERS    - max jobs running at once (defaults to the CPU count)
+#   HYDROGEN_JOB_QUEUE_SIZE - max jobs waiting to run
+#   HYDROGEN_JOB_TIMEOUT    - default time a job may run for, in seconds
+#   HYDROGEN_JOB_RETENTION  - time finished jobs are kept for, in seconds
+#
+
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_TIMEOUT = 300
+DEFAULT_RETENTION = 3600
+
+# how often a running job is checked for a result, cancellation or timeout
+POLL_INTERVAL = 0.05
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timedOut'
+
+FINISHED_STATUSES = [ SUCCEEDED, FAILED, CANCELLED, TIMED_OUT ]
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, request, timeout):
+        self.id = str(uuid.uuid4())
+        self.request = request
+        self.timeout = timeout
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.finished = threading.Event()
+        # key of the job's output in the result cache
+        self.cache_key = None
+
+    def isFinished(self):
+        return self.status in FINISHED_STATUSES
+
+    def toDict(self):
+        return {
+            'jobId': self.id,
+            'status': self.status,
+            'submittedAt': self.submitted_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+            'error': self.error,
+            'result': self.result
+        }
+
+
+# modules imported by the forkserver before worker processes are forked
+#  from it (modules whose optional packages aren't installed are skipped)
+WORKER_PRELOAD_MODULES = [ 'app.lpmodel', 'app.matrixmodel' ]
+
+
+# multiprocessing context for worker processes - forked from a server
+#  process that has already imported the model where that's supported
+def getWorkerProcessContext():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(WORKER_PRELOAD_MODULES)
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+# runs in the worker process
+def _runJobInProcess(run, request, connection):
+    # put the worker in its own process group, so that it can be
+    #  killed along with the solver
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    try:
+        stats = createSolveStats()
+        output = run(request, stats=stats)
+        connection.send((SUCCEEDED, (output, stats)))
+    except Exception as error:
+        connection.send((FAILED, f'{type(error).__name__}: {error}'))
+    finally:
+        connection.close()
+
+
+def _killProcess(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        # no process groups on this platform, or the worker
+        #  hasn't started its own group yet
+        process.kill()
+    process.join()
+
+
+# run is the function the worker processes call for each job's request,
+#  as run(request, stats=stats) where it fills in stats like
+#  lpmodel.runSimulations, and must be importable by them
+class JobManager:
+    def __init__(self, workers=None, queue_size=DEFAULT_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT, retention=DEFAULT_RETENTION, cache=None, run=runSimulations):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retention = retention
+        self.cache = cache if cache is not None else resultCache
+        self.run = run
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.queued = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        self.context = None
+
+    def _start(self):
+        # must be called holding self.lock
+        if self.threads:
+            return
+        self.context = getWorkerProcessContext()
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._dispatch, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # submit a job, which may ask for a shorter timeout than the
+    #  manager's default (but not a longer one)
+    def submit(self, request, timeout=None):
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        job = Job(request, timeout)
+
+        # serve the job straight from the cache if we can
+        if self.cache.enabled():
+            job.cache_key = getCacheKey(request)
+        cached_output = self.cache.get(job.cache_key) if job.cache_key else None
+
+        with self.lock:
+            self._removeExpiredJobs()
+            self.jobs[job.id] = job
+            if cached_output is not None:
+                job.started_at = job.submitted_at
+                self._finish(job, SUCCEEDED, result=cached_output)
+                return job
+
+            if self.queued >= self.queue_size:
+                del self.jobs[job.id]
+                raise JobQueueFullError(f'too many jobs waiting to run (max {self.queue_size})')
+            self.queued += 1
+            self._start()
+
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    # cancel a job, returning False if it had already finished
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.isFinished():
+                return False
+            job.cancel_requested = True
+            if job.status == QUEUED:
+                self.queued -= 1
+                self._finish(job, CANCELLED)
+            # running jobs are killed by their dispatcher thread
+        return True
+
+    def stats(self):
+        with self.lock:
+            running = sum(1 for job in self.jobs.values() if job.status == RUNNING)
+            return { 'workers': self.workers, 'queued': self.queued, 'queueSize': self.queue_size, 'running': running }
+
+    # cancel all jobs, and wait for the dispatcher threads to stop
+    def shutdown(self):
+        with self.lock:
+            for job in self.jobs.values():
+                if job.isFinished():
+                    continue
+                job.cancel_requested = True
+                if job.status == QUEUED:
+                    self.queued -= 1
+                    self._finish(job, CANCELLED)
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    # must be called holding self.lock
+    def _finish(self, job, status, result=None, error=None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.finished.set()
+
+    # must be called holding self.lock
+    def _removeExpiredJobs(self):
+        expired_before = time.time() - self.retention
+        for job_id in [ job.id for job in self.jobs.values() if job.isFinished() and job.finished_at < expired_before ]:
+            del self.jobs[job_id]
+
+    def _dispatch(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+
+            with self.lock:
+                if job.status != QUEUED:
+                    # cancelled while waiting
+                    continue
+                self.queued -= 1
+                job.status = RUNNING
+                job.started_at = time.time()
+
+            status, result, error = self._runJob(job)
+
+            if status == SUCCEEDED and job.cache_key and result['statusOfOptimalModel'] == 'Optimal':
+                self.cache.put(job.cache_key, result)
+
+            with self.lock:
+                self._finish(job, status, result=result, error=error)
+
+    def _runJob(self, job):
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_runJobInProcess, args=(self.run, job.request, sender), daemon=True)
+        process.start()
+        sender.close()
+
+        deadline = job.started_at + job.timeout
+        try:
+            while True:
+                if receiver.poll(POLL_INTERVAL):
+                    try:
+                        status, value = receiver.recv()
+                    except EOFError:
+                        return FAILED, None, f'worker process exited with code {process.exitcode}'
+                    if status == SUCCEEDED:
+                        output, stats = value
+                        # a run that didn't fill in stats isn't recorded
+                        if stats['status'] is not None:
+                            metricsRegistry.recordSolve(stats)
+                        return SUCCEEDED, output, None
+                    return FAILED, None, value
+
+                if job.cancel_requested:
+                    _killProcess(process)
+                    return CANCELLED, None, None
+
+                if time.time() > deadline:
+                    _killProcess(process)
+                    return TIMED_OUT, None, f'job did not finish within {job.timeout} seconds'
+        finally:
+            receiver.close()
+            process.join(timeout=1)
+
+
+def createServiceJobManager():
+    workers = os.environ.get('HYDROGEN_JOB_WORKERS')
+    return JobManager(
+        workers=int(workers) if workers else None,
+        queue_size=int(os.environ.get('HYDROGEN_JOB_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+        timeout=float(os.environ.get('HYDROGEN_JOB_TIMEOUT', DEFAULT_TIMEOUT)),
+        retention=float(os.environ.get('HYDROGEN_JOB_RETENTION', DEFAULT_RETENTION)))
+
+
+jobManager = createServiceJobManager()
@@ -1,6 +1,16 @@
+import os
+import sys
+import tempfile
+from collections import namedtuple
+
+import numpy as np
 from pulp import LpProblem, LpVariable, lpSum
 import pulp
 
+from app.electricity import ForecastColumns
+from app.metrics import createSolveStats, metricsRegistry, timePhase
+from app.solvers import getHighsSolveInfo, getPulpSolver, getRelativeGap, getSolverConfiguration, parseCbcLog
+
 #
 # input:
 #   data about a timeseries - for each time interval:
@@ -75,136 +85,315 @@ def calculate_elec_needed_to_maintain_min_storage(storage_at_simulation_start, c
     elec_to_maintain_min_storage = production_to_maintain_min_storage / productionFactor
     return max(0, elec_to_maintain_min_storage)
 
-def get_model_output(model_variable):
-    for model_variable_type in [ 'gridPower', 'windPower', 'onOff' ]:
-        if model_variable.name.startswith(model_variable_type):
-            idx = int(model_variable.name[len(model_variable_type):])
-            value = model_variable.value()
-            return model_variable_type, idx, value
-    # TODO handle reaching this point where there was no model output
-
-
-
-def calculateCostPerPeriod(timePeriodForecast, lpGridPowerVariable, lpWindPowerVariable):
-    gridCost = lpGridPowerVariable * timePeriodForecast.gridPrice
-    windCost = lpWindPowerVariable * timePeriodForecast.renewablePrice
+def calculate_max_elec_consumption_given_storage(storage_at_simulation_start, cumulativeHydrogenDemand, max_storage, productionFactor, is_final_period, final_storage=None):
+    if is_final_period:
+        if final_storage is not None:
+            # ensure we end up at the storage asked for
+            return (final_storage - storage_at_simulation_start + cumulativeHydrogenDemand) / productionFactor
+        # ensure we end up where we started
+        return cumulativeHydrogenDemand / productionFactor
+    return (max_storage - storage_at_simulation_start + cumulativeHydrogenDemand) / productionFactor
+
+# storage must stay above the min set point, and end the simulation at the
+#  final storage, if one is given
+def getMinimumStorage(storage_config, is_final_period):
+    if is_final_period and storage_config.finalStorage is not None:
+        return max(storage_config.minStorageSetPoint, storage_config.finalStorage)
+    return storage_config.minStorageSetPoint
+
+# the values recommended by a simulation for each time period, as arrays
+#  indexed by time period
+ModelSolution = namedtuple('ModelSolution', [
+    # grid and wind power consumed in MWh
+    'gridPower', 'windPower',
+    # 1 if the electrolyser is on, 0 if off
+    'onOff'
+])
+
+
+# statuses of the "optimal" simulation, as well as those of PuLP
+#  (pulp.LpStatus), for plans that the solver didn't prove optimal:
+#   Feasible  - the solver stopped at its time limit with a plan, but
+#               before proving it optimal
+#   Heuristic - the solver stopped at its time limit without a plan, so
+#               the plan was found from the LP relaxation of the model
+#  in both cases mipGapOfOptimalModel bounds how far the plan's cost could
+#  be from the optimal plan's
+FEASIBLE_STATUS = 'Feasible'
+HEURISTIC_STATUS = 'Heuristic'
+
+# statuses where the "optimal" simulation has a plan that meets every constraint
+PLAN_STATUSES = [ 'Optimal', FEASIBLE_STATUS, HEURISTIC_STATUS ]
+
+# power (in MWh) above which the LP relaxation is taken to be using the electrolyser
+RELAXATION_POWER_TOLERANCE = 1e-6
+
+
+def calculateCostPerPeriod(gridPrice, renewablePrice, lpGridPowerVariable, lpWindPowerVariable):
+    gridCost = lpGridPowerVariable * gridPrice
+    windCost = lpWindPowerVariable * renewablePrice
     return gridCost + windCost
 
-def calculateMaxConsumptionPerPeriod(config):
-    max_production_per_period = config.productionLimits.maxProductionPh * config.range.periodDuration
-    max_consumption_per_period = max_production_per_period / config.productionLimits.productionFactor
+# fields of each forecast item
+FORECAST_FIELDS = [ 'timestamp', 'renewableGeneration', 'hydrogenDemand', 'gridPrice', 'renewablePrice' ]
+
+# forecasts as a list of values per field, from either a list of
+#  ForecastItem or ForecastColumns, so the models can read either form
+def getForecastColumns(forecasts):
+    if isinstance(forecasts, ForecastColumns):
+        return { field: getattr(forecasts, field) for field in FORECAST_FIELDS }
+    return { field: [ getattr(forecast, field) for forecast in forecasts ] for field in FORECAST_FIELDS }
+
+# limits are the productionLimits of the config, or one of its stacks
+#  (config.stacks, see stacks.py)
+def calculateMaxConsumptionPerPeriod(config, limits=None):
+    if limits is None:
+        limits = config.productionLimits
+    max_production_per_period = limits.maxProductionPh * config.range.periodDuration
+    max_consumption_per_period = max_production_per_period / limits.productionFactor
     return max_consumption_per_period
 
 
+# the least electricity (in MWh) the electrolysers can use in a period while
+#  they are on (constraint 5)
+#
+# the original model divides the max consumption by productionFactor a
+#  second time, so the minimum is far below minProductionRate of the max
+#  consumption, and in practice the on/off variables rarely change the plan.
+#  that is kept as the default, as the exact minimum is above the ramp limit
+#  of the test forecasts, which would leave the electrolysers unable to be
+#  turned on or off at all (and would change the plans for them). with
+#  config.exactMinProduction, the minimum is minProductionRate of the max
+#  consumption
+def calculateMinConsumptionPerPeriod(config, limits=None):
+    if limits is None:
+        limits = config.productionLimits
+    max_consumption_per_period = calculateMaxConsumptionPerPeriod(config, limits)
+    if config.exactMinProduction:
+        return max_consumption_per_period * limits.minProductionRate
+    return max_consumption_per_period / limits.productionFactor * limits.minProductionRate
+
+
+# the M of constraint 6 for each period, as an array. the original model
+#  uses ten times the max consumption, while the tightened formulation uses
+#  the most that can be used in each period - the max consumption, less
+#  where the ramp from initialPower or to finalPower limits it further
+def calculateOnOffLimits(config, limits=None):
+    max_consumption_per_period = calculateMaxConsumptionPerPeriod(config, limits)
+    if not config.tightened:
+        return np.full(config.range.periods, max_consumption_per_period * 10)
+    # imported here as feasibility.py imports this module
+    from app.feasibility import calculatePowerBounds
+    return calculatePowerBounds(config, limits)[1]
+
+
+# the hydrogen (in m^3) produced per MWh by the electrolysers, or with
+#  several stacks (config.stacks), an array of that of each stack
+def getProductionFactor(config):
+    if config.stacks is None:
+        return config.productionLimits.productionFactor
+    return np.array([ stack.productionFactor for stack in config.stacks ], dtype=float)
+
+
 
 # run the simulation assuming that the electrolysers are run
 #  using only electricity from wind/renewable sources, limited
-#  only by:
+#  only by:
 # - storage capacity of the tanks
 # - availability of wind electricity
 # - production limit of the electrolysers
-def runMaxRenewableSimulation(request):
+#
+# returns the grid power, wind power and on/off status for each
+#  time period as a ModelSolution
+def calculateMaxRenewableSimulation(request):
     periods = request.config.range.periods
     production_factor = request.config.productionLimits.productionFactor
     max_production_per_period = request.config.productionLimits.maxProductionPh * request.config.range.periodDuration
 
-    simulation_output_by_timestamp = list(map(lambda n: {}, range(periods)))
-    for i in range(periods):
-        forecast = request.forecasts[i]
+    renewable_generation = np.asarray(getForecastColumns(request.forecasts)['renewableGeneration'], dtype=float)
 
-        # for this simulation we won't use any electricity from the grid
-        simulation_output_by_timestamp[i]['gridPower'] = 0
+    # for this simulation we won't use any electricity from the grid
+    grid_power = np.zeros(periods)
 
-        # how much hydrogen could we generate in this time period
-        #  if we used all available wind power?
-        production = max(forecast.renewableGeneration * production_factor, max_production_per_period)
-        power_used = production / production_factor
-        simulation_output_by_timestamp[i]['windPower'] = power_used
+    # how much hydrogen could we generate in each time period
+    #  if we used all available wind power?
+    production = np.maximum(renewable_generation * production_factor, max_production_per_period)
+    wind_power = production / production_factor
 
-        # assume that we run the electrolysers all the time
-        #  under this simulation
-        simulation_output_by_timestamp[i]['onOff'] = True
+    # assume that we run the electrolysers all the time
+    #  under this simulation
+    on_off = np.ones(periods)
 
-    return simulation_output_by_timestamp
+    return ModelSolution(grid_power, wind_power, on_off)
 
 
-def addSimulationResultToOutput(simulation_name, model_output_by_timestamp, periods, period_duration, production_factor, storage_at_simulation_start, max_storage, forecasts, output):
-    cumulativeStorage = storage_at_simulation_start
-    cumulativeElectricityCost = { 'wind' : 0.0, 'grid' : 0.0 }
+# cumulative sum, starting from the given value and adding each
+#  value in turn (so the result is identical to adding them up in a loop)
+def cumulativeSumFrom(start, values):
+    return np.cumsum(np.concatenate(([start], values)))[1:]
 
-    for i in range(periods):
-        # how much power does the model say would be optimal for this time period
-        modelOutputWindPower = model_output_by_timestamp[i]['windPower']
-        modelOutputGridPower = model_output_by_timestamp[i]['gridPower']
-        # whether the model says the electrolyser should be on or off for this time period
-        modelOutputOnOff     = model_output_by_timestamp[i]['onOff']
-
-        # the cost of electricity to follow the model's recommendation
-        modelOutputWindCost = modelOutputWindPower * (period_duration * forecasts[i].renewablePrice)
-        modelOutputGridCost = modelOutputGridPower * (period_duration * forecasts[i].gridPrice)
-
-        cumulativeElectricityCost['wind'] += modelOutputWindCost
-        cumulativeElectricityCost['grid'] += modelOutputGridCost
-
-        # the amount of hydrogen produced by following the model's recommendation
-        hydrogenProducedWind = modelOutputWindPower * production_factor
-        hydrogenProducedGrid = modelOutputGridPower * production_factor
-        hydrogenProduced = hydrogenProducedWind + hydrogenProducedGrid
-
-        # the amount of hydrogen stored by following the model's recommendation
-        changeInStoredHydrogen = hydrogenProduced - forecasts[i].hydrogenDemand
-        cumulativeStorage += changeInStoredHydrogen
-
-        # check we haven't produced too much (shouldn't happen when using the
-        #  model, but is possible under alternate simulations)
-        excess_hydrogen = cumulativeStorage - max_storage
-        if excess_hydrogen > 0:
-            cumulativeStorage = max_storage
-            changeInStoredHydrogen -= excess_hydrogen
-
-        output[i][simulation_name] = {
-            'electricityUsage': {
-                'wind': modelOutputWindPower,
-                'grid': modelOutputGridPower,
-                'total': modelOutputWindPower + modelOutputGridPower
-            },
-            'electricityCost': {
-                'wind': modelOutputWindCost,
-                'grid': modelOutputGridCost,
-                'total': modelOutputWindCost + modelOutputGridCost
-            },
-            'electricityCostCumulative': {
-                'wind': cumulativeElectricityCost['wind'],
-                'grid': cumulativeElectricityCost['grid'],
-                'total': cumulativeElectricityCost['wind'] + cumulativeElectricityCost['grid']
-            },
+
+# hydrogen in storage at the end of each time period, where any hydrogen
+#  produced beyond the storage capacity is lost
+#
+# the hydrogen lost by the end of a period is the most the running total
+#  has gone over max_storage in that period or any before it, so the
+#  storage is the running total less that
+def calculateStorageTrajectory(storage_at_simulation_start, change_in_stored_hydrogen, max_storage):
+    running_total = cumulativeSumFrom(storage_at_simulation_start, np.asarray(change_in_stored_hydrogen, dtype=float))
+    lost = np.maximum(0, np.maximum.accumulate(running_total - max_storage))
+    return running_total - lost
+
+
+# calculate the results of following a simulation's recommended grid
+#  power, wind power and on/off status (a ModelSolution), as arrays
+#  indexed by time period
+#
+# with several stacks (see stacks.py), the solution has a row per stack,
+#  and production_factor a value per stack (see getProductionFactor). the
+#  results are for all of the stacks together, which are on in a period
+#  if any stack is on
+#
+# forecast_columns are the forecasts as returned by getForecastColumns
+def calculateSimulationResult(solution, period_duration, production_factor, storage_at_simulation_start, max_storage, forecast_columns):
+    grid_power, wind_power, on_off = solution
+
+    # the amount of hydrogen produced by following the recommendation
+    if np.ndim(grid_power) == 2:
+        production_factor = np.reshape(production_factor, (-1, 1))
+        hydrogen_produced_wind = (wind_power * production_factor).sum(axis=0)
+        hydrogen_produced_grid = (grid_power * production_factor).sum(axis=0)
+        grid_power, wind_power, on_off = grid_power.sum(axis=0), wind_power.sum(axis=0), on_off.max(axis=0)
+    else:
+        hydrogen_produced_wind = wind_power * production_factor
+        hydrogen_produced_grid = grid_power * production_factor
+    hydrogen_produced = hydrogen_produced_wind + hydrogen_produced_grid
+
+    renewable_price = np.asarray(forecast_columns['renewablePrice'], dtype=float)
+    grid_price = np.asarray(forecast_columns['gridPrice'], dtype=float)
+    hydrogen_demand = np.asarray(forecast_columns['hydrogenDemand'], dtype=float)
+
+    # the cost of electricity to follow the recommendation
+    wind_cost = wind_power * (period_duration * renewable_price)
+    grid_cost = grid_power * (period_duration * grid_price)
+    cumulative_wind_cost = cumulativeSumFrom(0.0, wind_cost)
+    cumulative_grid_cost = cumulativeSumFrom(0.0, grid_cost)
+
+    # the amount of hydrogen stored by following the recommendation (which
+    #  shouldn't exceed the storage capacity when using the model, but is
+    #  possible under alternate simulations)
+    hydrogen_in_storage = calculateStorageTrajectory(storage_at_simulation_start, hydrogen_produced - hydrogen_demand, max_storage)
+
+    return {
+        'electricityUsageWind': wind_power,
+        'electricityUsageGrid': grid_power,
+        'electricityUsageTotal': wind_power + grid_power,
+        'electricityCostWind': wind_cost,
+        'electricityCostGrid': grid_cost,
+        'electricityCostTotal': wind_cost + grid_cost,
+        'electricityCostCumulativeWind': cumulative_wind_cost,
+        'electricityCostCumulativeGrid': cumulative_grid_cost,
+        'electricityCostCumulativeTotal': cumulative_wind_cost + cumulative_grid_cost,
+        'hydrogenProducedWind': hydrogen_produced_wind,
+        'hydrogenProducedGrid': hydrogen_produced_grid,
+        'hydrogenProducedTotal': hydrogen_produced,
+        'hydrogenInStorage': hydrogen_in_storage,
+        'electrolyserOn': on_off == 1
+    }
+
+
+# the results of a simulation as a list of values per output field,
+#  in the same structure as the per-period output
+def getSimulationColumns(result):
+    columns = { name: values.tolist() for name, values in result.items() }
+    return {
+        'electricityUsage': { 'wind': columns['electricityUsageWind'], 'grid': columns['electricityUsageGrid'], 'total': columns['electricityUsageTotal'] },
+        'electricityCost': { 'wind': columns['electricityCostWind'], 'grid': columns['electricityCostGrid'], 'total': columns['electricityCostTotal'] },
+        'electricityCostCumulative': { 'wind': columns['electricityCostCumulativeWind'], 'grid': columns['electricityCostCumulativeGrid'], 'total': columns['electricityCostCumulativeTotal'] },
+        'hydrogenProduced': { 'wind': columns['hydrogenProducedWind'], 'grid': columns['hydrogenProducedGrid'], 'total': columns['hydrogenProducedTotal'] },
+        'hydrogenInStorage': columns['hydrogenInStorage'],
+        'electrolyserOn': columns['electrolyserOn']
+    }
+
+
+# power used and hydrogen produced by each stack of a solution with a row
+#  per stack (see calculateSimulationResult), as a list of values per
+#  field for each stack, in the order of config.stacks
+def getStackColumns(solution, stacks):
+    columns = []
+    for stack, grid_power, wind_power, on_off in zip(stacks, *solution):
+        columns.append({
+            'name': stack.name,
+            'electricityUsage': { 'wind': wind_power.tolist(), 'grid': grid_power.tolist(), 'total': (wind_power + grid_power).tolist() },
             'hydrogenProduced': {
-                'wind': hydrogenProducedWind,
-                'grid': hydrogenProducedGrid,
-                'total': hydrogenProducedWind + hydrogenProducedGrid
+                'wind': (wind_power * stack.productionFactor).tolist(),
+                'grid': (grid_power * stack.productionFactor).tolist(),
+                'total': ((wind_power + grid_power) * stack.productionFactor).tolist()
             },
-            'hydrogenInStorage': cumulativeStorage,
-            'electrolyserOn': modelOutputOnOff == 1
+            'electrolyserOn': (on_off == 1).tolist()
+        })
+    return columns
+
+
+# add the results of a simulation to each period of the output
+def addSimulationColumnsToOutput(simulation_name, columns, output):
+    for i, period in enumerate(iterSimulationColumns(columns)):
+        output[i][simulation_name] = period
+
+
+# the results of a simulation for each period in turn, from its columns
+def iterSimulationColumns(columns):
+    for values in zip(
+            columns['electricityUsage']['wind'], columns['electricityUsage']['grid'], columns['electricityUsage']['total'],
+            columns['electricityCost']['wind'], columns['electricityCost']['grid'], columns['electricityCost']['total'],
+            columns['electricityCostCumulative']['wind'], columns['electricityCostCumulative']['grid'], columns['electricityCostCumulative']['total'],
+            columns['hydrogenProduced']['wind'], columns['hydrogenProduced']['grid'], columns['hydrogenProduced']['total'],
+            columns['hydrogenInStorage'],
+            columns['electrolyserOn']):
+        yield {
+            'electricityUsage': { 'wind': values[0], 'grid': values[1], 'total': values[2] },
+            'electricityCost': { 'wind': values[3], 'grid': values[4], 'total': values[5] },
+            'electricityCostCumulative': { 'wind': values[6], 'grid': values[7], 'total': values[8] },
+            'hydrogenProduced': { 'wind': values[9], 'grid': values[10], 'total': values[11] },
+            'hydrogenInStorage': values[12],
+            'electrolyserOn': values[13]
         }
 
 
-
-def runSimulations(request):
+# create the MILP model for the "optimal" simulation, without solving it
+#
+# the storage constraints (3 and 4) limit the electricity consumed since
+#  the start of the simulation. how that running total is expressed depends
+#  on config.formulation:
+#   - "dense"      - re-sum every earlier period in each constraint, which
+#                    grows the model with the square of the number of periods
+#   - "cumulative" - carry the running total in a state variable per period,
+#                    linked to the previous period by a one-step balance, so
+#                    each constraint only touches a handful of variables
+#
+# with config.tightened, constraint 6 uses the most power that can be used in
+#  each period as its M, rather than ten times the max consumption, and
+#  constraint 8 limits the power used when the electrolysers are turned on
+#  or off, so the LP relaxation is closer to the MILP
+#
+# returns the model, along with the variables holding the model outputs
+def buildOptimalModel(request):
     periods = request.config.range.periods
     period_duration = request.config.range.periodDuration
-    forecasts = request.forecasts
-    minimum_allowed_storage = request.config.storage.minStorageSetPoint
+    forecasts = getForecastColumns(request.forecasts)
     max_storage = request.config.storage.maxStorage
     storage_at_simulation_start = request.config.storage.initialStorage
+    final_storage = request.config.storage.finalStorage
     production_factor = request.config.productionLimits.productionFactor
-    min_production_rate = request.config.productionLimits.minProductionRate
     max_power_change = request.config.productionLimits.maxPowerChangePh
 
     # check that we have a valid request
-    assert periods == len(forecasts)
+    assert periods == len(forecasts['timestamp'])
 
     # calculate some limits that will be used by the model
     max_elec_consumption_by_electrolysers = calculateMaxConsumptionPerPeriod(request.config)
+    min_elec_consumption_of_electrolysers = calculateMinConsumptionPerPeriod(request.config)
+    on_off_limits = calculateOnOffLimits(request.config)
 
     #
     # create the model that will be used to run the "optimal" scenario simulations
@@ -224,6 +413,11 @@ def runSimulations(request):
     # on/off variable 0 - if electrolyser off, 1 if on and more than the minimum level is produced
     onOff = {i: LpVariable(name=f'onOff{i}', cat = 'Integer', lowBound=0, upBound=1) for i in range(periods)}
 
+    # total power consumed from the start of the simulation up to the end of each time slot in MWh
+    #  (only used by the cumulative formulation)
+    if request.config.formulation == 'cumulative':
+        cumulativePower = {i: LpVariable(name=f'cumulativePower{i}', lowBound=0) for i in range(periods)}
+
 
     #
     # specify the goal that the model should be optimising for
@@ -231,7 +425,7 @@ def runSimulations(request):
     #
 
     # create the objective function, price in £/MHw
-    model.setObjective(lpSum(calculateCostPerPeriod(forecasts[i], gridPower[i], windPower[i]) for i in range(periods)))
+    model.setObjective(lpSum(calculateCostPerPeriod(forecasts['gridPrice'][i], forecasts['renewablePrice'][i], gridPower[i], windPower[i]) for i in range(periods)))
 
 
     #
@@ -242,39 +436,41 @@ def runSimulations(request):
     cumulativeHydrogenDemand = 0
 
     for i in range(periods):
-        forecast = forecasts[i]
-
         # hydrogen demand since the start of the simulation
-        cumulativeHydrogenDemand += forecast.hydrogenDemand
+        cumulativeHydrogenDemand += forecasts['hydrogenDemand'][i]
 
         # constraint 1: don't use more wind power than the forecast says will be available
-        model += (windPower[i] <= forecast.renewableGeneration, 'Max wind power available ' + str(i))
+        model += (windPower[i] <= forecasts['renewableGeneration'][i], 'Max wind power available ' + str(i))
 
         # constraint 2: can't consume more electricity than the max usage of the electrolysers per period
         # TODO: original wording was around max hydrogen production - do we need this constraint in the model too? or is this sufficient?
         model += (gridPower[i]+ windPower[i] <= max_elec_consumption_by_electrolysers, 'Max elec consumption ' + str(i))
 
+        # electricity consumed since the start of the simulation
+        if request.config.formulation == 'cumulative':
+            previousCumulativePower = cumulativePower[i-1] if i > 0 else 0
+            model += (cumulativePower[i] - previousCumulativePower - gridPower[i] - windPower[i] == 0, 'Cumulative elec consumption ' + str(i))
+            cumulativeElecConsumption = cumulativePower[i]
+        else:
+            cumulativeElecConsumption = lpSum(gridPower[j] + windPower[j] for j in range(i+1))
+
         # constraint 3: min electricity to consume for hydrogen production this period
         # if we consume less, we will not produce enough hydrogen to meet min storage levels
+        minimum_allowed_storage = getMinimumStorage(request.config.storage, i == periods - 1)
         min_elec_consumption_to_maintain_min_storage = calculate_elec_needed_to_maintain_min_storage(storage_at_simulation_start, cumulativeHydrogenDemand, minimum_allowed_storage, production_factor)
-        model += (lpSum(gridPower[j] + windPower[j] for j in range(i+1)) >=  min_elec_consumption_to_maintain_min_storage , 'Elec to maintain min storage ' + str(i))
+        model += (cumulativeElecConsumption >=  min_elec_consumption_to_maintain_min_storage , 'Elec to maintain min storage ' + str(i))
 
         # constraint 4: max electricity to consume for hydrogen production this period
         # if we consume more, we will produce more hydrogen than we can store
-        if i < periods - 1:
-            max_elec_consumption_storage_constrained = (max_storage - storage_at_simulation_start + cumulativeHydrogenDemand) / production_factor
-        else:
-             max_elec_consumption_storage_constrained = (cumulativeHydrogenDemand) / production_factor # ensure we end up where we started
-        
-        model += (lpSum(gridPower[j] + windPower[j] for j in range(i+1)) <= max_elec_consumption_storage_constrained, 'Max elec used given storage limit' + str(i))
+        max_elec_consumption_storage_constrained = calculate_max_elec_consumption_given_storage(storage_at_simulation_start, cumulativeHydrogenDemand, max_storage, production_factor, i == periods - 1, final_storage)
+        model += (cumulativeElecConsumption <= max_elec_consumption_storage_constrained, 'Max elec used given storage limit' + str(i))
 
         # constraint 5: Ensure power is either 0 or more than the minimum level
-        min_elec_consumption_of_electrolysers = max_elec_consumption_by_electrolysers / production_factor * min_production_rate
         model += (gridPower[i] + windPower[i] - min_elec_consumption_of_electrolysers * onOff[i] >= 0, 'Min hydrolyser prod rate'+ str(i))
 
         # constraint 6: if power is being used, machines must be set to on
         # M is constant large enough to ensure that if power usage > 0 Z = 1
-        M = max_elec_consumption_by_electrolysers * 10
+        M = on_off_limits[i]
         model += (gridPower[i] + windPower[i] -  M * onOff[i] <= 0, 'Set on off'+ str(i))
 
         # constraint 7: don't change power usage faster than max_power_change
@@ -284,69 +480,346 @@ def runSimulations(request):
             model += (gridPower[i] - gridPower[i+1] + windPower[i] - windPower[i+1]<=  max_power_change_per_period, 'Max ramp down of electrolyser power usage ' + str(i))
             model += (gridPower[i] - gridPower[i+1] + windPower[i] - windPower[i+1]>= -max_power_change_per_period, 'Max ramp up of electrolyser power usage  ' + str(i))
 
+    # constraint 7 also applies to the change from the power used before the
+    #  simulation, and to the power used after it, where they are given
+    max_power_change_per_period = max_power_change * period_duration
+    initial_power = request.config.productionLimits.initialPower
+    final_power = request.config.productionLimits.finalPower
+    if initial_power is not None:
+        model += (gridPower[0] + windPower[0] <= initial_power + max_power_change_per_period, 'Max ramp up from initial power')
+        model += (gridPower[0] + windPower[0] >= initial_power - max_power_change_per_period, 'Max ramp down from initial power')
+    if final_power is not None:
+        model += (gridPower[periods-1] + windPower[periods-1] <= final_power + max_power_change_per_period, 'Max ramp down to final power')
+        model += (gridPower[periods-1] + windPower[periods-1] >= final_power - max_power_change_per_period, 'Max ramp up to final power')
+
+    # constraint 8 (tightened formulation only): the power used either side
+    #  of a period the electrolysers are off is 0, so in the period they are
+    #  turned on, and the period before they are turned off, they can use no
+    #  more than the ramp limit. as with the start-up and shut-down variables
+    #  of unit commitment models, this cuts off fractional on/off values that
+    #  constraints 6 and 7 allow, but with the onOff variables of the
+    #  neighbouring periods in place of extra variables
+    if request.config.tightened:
+        for i in range(periods):
+            excess = on_off_limits[i] - max_power_change_per_period
+            if excess <= 0:
+                continue
+            if i > 0:
+                model += (gridPower[i] + windPower[i] - max_power_change_per_period * onOff[i] - excess * onOff[i-1] <= 0, 'Max power when turned on ' + str(i))
+            if i+1 < periods:
+                model += (gridPower[i] + windPower[i] - max_power_change_per_period * onOff[i] - excess * onOff[i+1] <= 0, 'Max power before turned off ' + str(i))
+
+    return model, gridPower, windPower, onOff
+
+
+
+# look up a constraint added to a model by buildOptimalModel
+#  (PuLP replaces spaces in constraint names with underscores)
+def getModelConstraint(model, name):
+    return model.constraints[name.translate(pulp.LpElement.trans)]
+
+
+# update a model created by buildOptimalModel with the forecasts, initial
+#  storage, and initial and final power from another request, so that it
+#  can be re-solved without being rebuilt
+#
+# only the coefficients that depend on these are changed, so the rest of
+#  the request's config must be the same as the one the model was built
+#  from, including whether the initial and final power are given (and with
+#  the tightened formulation, their values)
+def updateOptimalModel(model, gridPower, windPower, request):
+    periods = request.config.range.periods
+    forecasts = getForecastColumns(request.forecasts)
+    max_storage = request.config.storage.maxStorage
+    storage_at_simulation_start = request.config.storage.initialStorage
+    final_storage = request.config.storage.finalStorage
+    production_factor = request.config.productionLimits.productionFactor
+
+    # check that we have a valid request
+    assert periods == len(forecasts['timestamp']) == len(gridPower)
+
+    cumulativeHydrogenDemand = 0
+
+    for i in range(periods):
+        cumulativeHydrogenDemand += forecasts['hydrogenDemand'][i]
+
+        # objective function, price in £/MHw
+        model.objective[gridPower[i]] = forecasts['gridPrice'][i]
+        model.objective[windPower[i]] = forecasts['renewablePrice'][i]
+
+        # constraint 1: don't use more wind power than the forecast says will be available
+        getModelConstraint(model, 'Max wind power available ' + str(i)).changeRHS(forecasts['renewableGeneration'][i])
+
+        # constraint 3: min electricity to consume to meet min storage levels
+        minimum_allowed_storage = getMinimumStorage(request.config.storage, i == periods - 1)
+        min_elec_consumption_to_maintain_min_storage = calculate_elec_needed_to_maintain_min_storage(storage_at_simulation_start, cumulativeHydrogenDemand, minimum_allowed_storage, production_factor)
+        getModelConstraint(model, 'Elec to maintain min storage ' + str(i)).changeRHS(min_elec_consumption_to_maintain_min_storage)
+
+        # constraint 4: max electricity to consume without exceeding storage capacity
+        max_elec_consumption_storage_constrained = calculate_max_elec_consumption_given_storage(storage_at_simulation_start, cumulativeHydrogenDemand, max_storage, production_factor, i == periods - 1, final_storage)
+        getModelConstraint(model, 'Max elec used given storage limit' + str(i)).changeRHS(max_elec_consumption_storage_constrained)
+
+    # constraint 7: the ramp limits from the initial power and to the final power
+    max_power_change_per_period = request.config.productionLimits.maxPowerChangePh * request.config.range.periodDuration
+    initial_power = request.config.productionLimits.initialPower
+    final_power = request.config.productionLimits.finalPower
+    if initial_power is not None:
+        getModelConstraint(model, 'Max ramp up from initial power').changeRHS(initial_power + max_power_change_per_period)
+        getModelConstraint(model, 'Max ramp down from initial power').changeRHS(initial_power - max_power_change_per_period)
+    if final_power is not None:
+        getModelConstraint(model, 'Max ramp down to final power').changeRHS(final_power + max_power_change_per_period)
+        getModelConstraint(model, 'Max ramp up to final power').changeRHS(final_power - max_power_change_per_period)
+
+
+# read the values of the model outputs from a solved PuLP model, given the
+#  variables returned by buildOptimalModel (any other variables in the
+#  model are internal to the formulation). variables without a value,
+#  where the solver didn't find a solution, are read as 0. the on/off
+#  values are rounded, as solvers such as HiGHS give binaries within their
+#  integrality tolerance of 0 or 1 (e.g. 0.9999999999999994), as
+#  matrixmodel.getMatrixModelSolution does
+def getPulpModelSolution(gridPower, windPower, onOff):
+    periods = len(gridPower)
+    values = lambda variables: np.fromiter((variables[i].varValue or 0 for i in range(periods)), dtype=float, count=periods)
+    return ModelSolution(values(gridPower), values(windPower), np.round(values(onOff)))
+
+
+# size of a PuLP model, for the stats in metrics.py
+def getPulpModelSize(model):
+    variables = model.variables()
+    return {
+        'variables': len(variables),
+        'integerVariables': sum(1 for var in variables if var.cat == pulp.LpInteger),
+        'constraints': len(model.constraints),
+        'nonZeros': sum(len(constraint) for constraint in model.constraints.values())
+    }
+
+
+# solve a PuLP model, adding the size of the model and what the solver
+#  reports about the solve to stats (if given)
+def solvePulpModel(model, solver, stats=None):
+    if stats is None:
+        model.solve(solver)
+        return
+
+    stats.update(getPulpModelSize(model))
+
+    # CBC only reports the gap and number of nodes in its log
+    log_path = None
+    echo_log = False
+    if isinstance(solver, pulp.COIN_CMD):
+        fd, log_path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        solver.optionsDict['logPath'] = log_path
+        # write the log to stdout ourselves, as PuLP would have
+        echo_log = solver.msg
+        solver.msg = False
+
+    try:
+        with timePhase(stats, 'solve'):
+            model.solve(solver)
+
+        if log_path is not None:
+            with open(log_path, encoding='utf-8', errors='replace') as log_file:
+                log = log_file.read()
+            if echo_log:
+                sys.stdout.write(log)
+            stats.update(parseCbcLog(log))
+        elif hasattr(getattr(model, 'solverModel', None), 'getInfo'):
+            # PuLP keeps the highspy model it solved with
+            stats.update(getHighsSolveInfo(model.solverModel))
+        else:
+            stats['objective'] = model.objective.value()
+    finally:
+        if log_path is not None:
+            del solver.optionsDict['logPath']
+            solver.msg = echo_log
+            os.remove(log_path)
+
+
+# status of a solved PuLP model, distinguishing a plan the solver proved
+#  optimal from one it found before stopping at its time limit (which
+#  PuLP reports as optimal)
+def getPulpModelStatus(model):
+    if model.status == pulp.LpStatusOptimal and model.sol_status == pulp.LpSolutionIntegerFeasible:
+        return FEASIBLE_STATUS
+    return pulp.LpStatus[model.status]
+
+
+# the on/off status to try in each period when repairing a plan from the
+#  LP relaxation of the model, given the power it used in each period:
+#   - on wherever the relaxation used power (i.e. rounding on/off up)
+#   - on in every period, in case the relaxation used less than the min
+#     production rate in a period where it can't be increased
+def getRepairOnOff(power):
+    return [ (power > RELAXATION_POWER_TOLERANCE).astype(float), np.ones(len(power)) ]
+
+
+# find a plan for a model the solver couldn't find one for within its time
+#  limit, by solving the LP relaxation of the model, fixing the on/off
+#  status of each period from it (see getRepairOnOff), and re-solving for
+#  the power used in each period - both of which are LPs, so are quick to
+#  solve. the cost of the LP relaxation bounds the cost of the optimal plan,
+#  so gives the gap added to stats
+#
+# returns the status of the model, with the variables holding the plan (if
+#  one was found), leaving the model as it was otherwise
+def repairPulpModel(model, gridPower, windPower, onOff, solver, stats=None):
+    periods = len(onOff)
+    try:
+        for var in onOff.values():
+            var.cat = pulp.LpContinuous
+        model.solve(solver)
+        if model.status != pulp.LpStatusOptimal:
+            return pulp.LpStatus[model.status]
+        relaxation_objective = model.objective.value()
+        relaxation = getPulpModelSolution(gridPower, windPower, onOff)
+
+        for on_off in getRepairOnOff(relaxation.gridPower + relaxation.windPower):
+            for i in range(periods):
+                onOff[i].lowBound = onOff[i].upBound = on_off[i]
+            model.solve(solver)
+            if model.status == pulp.LpStatusOptimal:
+                if stats is not None:
+                    stats['objective'] = model.objective.value()
+                    stats['mipGap'] = getRelativeGap(stats['objective'], relaxation_objective)
+                    stats['nodes'] = None
+                return HEURISTIC_STATUS
+
+        return pulp.LpStatus[pulp.LpStatusNotSolved]
+    finally:
+        for var in onOff.values():
+            var.cat = pulp.LpInteger
+            var.lowBound = 0
+            var.upBound = 1
+
+
+# solve a model created by buildOptimalModel, repairing a plan from its LP
+#  relaxation if the solver stops at its time limit without one, and
+#  returning the status of the model
+def solveOptimalModel(model, gridPower, windPower, onOff, solver, stats=None):
+    solvePulpModel(model, solver, stats)
+    model_status = getPulpModelStatus(model)
+    if model_status == pulp.LpStatus[pulp.LpStatusNotSolved]:
+        with timePhase(stats, 'solve'):
+            model_status = repairPulpModel(model, gridPower, windPower, onOff, solver, stats)
+    return model_status
+
+
+# build and solve the PuLP model, returning the model outputs as a
+#  ModelSolution, along with the status and name of the solver
+def runPulpModel(request, stats=None):
+    solver = getPulpSolver(getSolverConfiguration(request))
 
     #
-    # run the model
+    # create the model that will be used to run the "optimal" scenario simulations
     #
 
-    model.solve()
+    with timePhase(stats, 'build'):
+        model, gridPower, windPower, onOff = buildOptimalModel(request)
+
 
     #
-    # initialise output to return
+    # run the model
     #
 
-    output = []
-    for i in range(periods): output.append({ 'timestamp': request.forecasts[i].timestamp })
+    model_status = solveOptimalModel(model, gridPower, windPower, onOff, solver, stats)
+
+    with timePhase(stats, 'extract'):
+        solution = getPulpModelSolution(gridPower, windPower, onOff)
 
+    return solution, model_status, solver.name
+
+
+# run the model for the "optimal" scenario simulations, using the
+#  model builder chosen in the request's config
+#
+# stats (if given) is filled in with the timings and size of the model,
+#  as described in metrics.py
+def runOptimalSimulation(request, stats=None):
+    if request.config.stacks is not None:
+        # imported here as it builds the model of each stack with matrixmodel.py
+        from app.stacks import runStackModel
+        return runStackModel(request, stats)
+    if request.config.decomposition is not None:
+        # imported here as it solves the windows with this module
+        from app.decomposition import runDecomposedModel
+        return runDecomposedModel(request, stats)
+    if request.config.modelBuilder == 'matrix':
+        # imported here so that scipy is only needed for this builder
+        from app.matrixmodel import runMatrixModel
+        return runMatrixModel(request, stats)
+    return runPulpModel(request, stats)
+
+
+# combine the results of the "optimal" simulation with the alternate
+#  simulations into the output to return
+#
+# the simulations are returned as a list of results per time period, or
+#  if columnar is set, as a list of values per output field (see
+#  electricity.ColumnarSimulationOutput). with several stacks, the output
+#  also has the power used by each stack, as a list of values per field
+def buildSimulationOutput(request, solution, model_status, solver_name, columnar=False, stats=None):
+    with timePhase(stats, 'postProcess'):
+        output = _buildSimulationOutput(request, solution, model_status, solver_name, columnar)
+    # how far the plan could be from optimal, if it wasn't proved optimal
+    if model_status in [ FEASIBLE_STATUS, HEURISTIC_STATUS ] and stats is not None:
+        output['mipGapOfOptimalModel'] = stats['mipGap']
+    return output
+
+def _buildSimulationOutput(request, solution, model_status, solver_name, columnar):
+    period_duration = request.config.range.periodDuration
+    forecasts = getForecastColumns(request.forecasts)
+    max_storage = request.config.storage.maxStorage
+    storage_at_simulation_start = request.config.storage.initialStorage
+    production_factor = request.config.productionLimits.productionFactor
 
     #
-    # add simulation results to the output to return
+    # calculate the results of following each simulation
     #
 
-    # re-shape values from the model to let us index them
-    #  by timestamp
-    model_output_by_timestamp = list(map(lambda n: {}, range(periods)))
-    for var in model.variables():
-        output_type, time_period_id, value = get_model_output(var)
-        model_output_by_timestamp[time_period_id][output_type] = value
-
-    # add the model results to the output
-    addSimulationResultToOutput('optimal',
-        model_output_by_timestamp,
-        periods,
+    # the model results
+    optimal = getSimulationColumns(calculateSimulationResult(solution,
         period_duration,
-        production_factor,
+        getProductionFactor(request.config),
         storage_at_simulation_start,
         max_storage,
-        forecasts,
-        output)
+        forecasts))
 
-    # add the model status to the output
-    model_status = pulp.LpStatus[model.status]
-    #TODO: decide where to put this in output
-
-    #
     # generate alternate simulation results
-    #
-    renewable_simulation = runMaxRenewableSimulation(request)
-
-    addSimulationResultToOutput('hypotheticalWindOnly',
-        renewable_simulation,
-        periods,
+    hypothetical_wind_only = getSimulationColumns(calculateSimulationResult(calculateMaxRenewableSimulation(request),
         period_duration,
         production_factor,
         storage_at_simulation_start,
         max_storage,
-        forecasts,
-        output)
+        forecasts))
+
+
+    #
+    # add simulation results to the output to return
+    #
+
+    if columnar:
+        simulations = {
+            'timestamp': forecasts['timestamp'],
+            'optimal': optimal,
+            'hypotheticalWindOnly': hypothetical_wind_only
+        }
+    else:
+        simulations = [ { 'timestamp': timestamp } for timestamp in forecasts['timestamp'] ]
+        addSimulationColumnsToOutput('optimal', optimal, simulations)
+        addSimulationColumnsToOutput('hypotheticalWindOnly', hypothetical_wind_only, simulations)
 
 
     #
     # final output is ready to return
     #
 
-    return { "simulations": output,
+    return { "simulations": simulations,
             "statusOfOptimalModel": model_status,
+            "solverOfOptimalModel": solver_name,
+            "mipGapOfOptimalModel": None,
+            "stacks": getStackColumns(solution, request.config.stacks) if request.config.stacks is not None else None,
             "units": {
                 "electricityUsage": "MWh",
                 "electricityCost": "£",
@@ -355,3 +828,31 @@ def runSimulations(request):
                 "hydrogenInStorage": 'm^3',
                 "electrolyserOn": None
             } }
+
+
+
+# request can be a Forecast or a ColumnarForecast, and the output is
+#  columnar if columnar is set
+#
+# the stats of every run are recorded in metrics.metricsRegistry, and
+#  also filled in to stats if it is given
+#
+# raises feasibility.InfeasibleRequestError, without building the model,
+#  if no plan can meet the request
+def runSimulations(request, columnar=False, stats=None):
+    if stats is None:
+        stats = createSolveStats()
+
+    # imported here as it reads the request with this module
+    from app.feasibility import checkFeasibility
+    with timePhase(stats, 'feasibility'):
+        checkFeasibility(request)
+
+    solution, model_status, solver_name = runOptimalSimulation(request, stats)
+    output = buildSimulationOutput(request, solution, model_status, solver_name, columnar, stats)
+
+    stats['status'] = model_status
+    stats['solver'] = solver_name
+    metricsRegistry.recordSolve(stats)
+
+    return output
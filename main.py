@@ -1,16 +1,267 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from typing import List, Optional
 
-from app.electricity import Forecast, SimulationOutput
-from app.lpmodel import runSimulations
+import pydantic
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.batch import runBatchSimulations
+from app.cache import resultCache, runCachedSimulations
+from app.electricity import Forecast, ForecastBatch, ForecastEnsemble, ForecastSweep, JobStatus, PlanChanges, PlanSummary, SimulationOutputBatch, SimulationOutputWithMetadata, StochasticSimulationOutput, SweepOutput
+from app.feasibility import InfeasibleRequestError, checkFeasibility
+from app.formats import FORMATS, InvalidBodyError, NotAcceptableError, UnsupportedMediaTypeError, encodeSimulationOutput, isColumnar, isStreaming, iterSimulationOutput, negotiateResponseFormat, parseForecast
+from app.jobs import POLL_INTERVAL, JobQueueFullError, jobManager
+from app.metrics import createSolveStats, metricsRegistry
+from app.plans import planStore
+from app.rolling import clearRollingHorizonState, runRollingSimulations
+from app.solvers import SolverError
+from app.sweep import runSweepSimulations
+from app.warmup import warmUp
 
 
 app = FastAPI()
 
+# longest time a request for a job's status will wait for it to finish
+MAX_JOB_WAIT = 60
+
 
 @app.get("/")
 def read_root():
     return {"ok": "true"}
 
-@app.post("/electricity/hydrogen-production-optimisation", response_model=SimulationOutput)
-def applyLpModel(input: Forecast):
-    return runSimulations(input)
+# ready once the process has warmed up (see warmup.py), so that it isn't
+#  sent requests before then
+@app.get("/ready")
+def getReadiness():
+    return JSONResponse(warmUp.stats(), status_code=200 if warmUp.isReady() else 503)
+
+@app.on_event("startup")
+def startWarmUp():
+    warmUp.start()
+
+# the forecast can be sent, and the output returned, in any of the formats
+#  in formats.py, chosen by the Content-Type and Accept headers
+FORECAST_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": { media_type: { "schema": { "$ref": "#/components/schemas/Forecast" } if media_type == "application/json" else { "type": "string", "format": "binary" } }
+                     for media_type in FORMATS }
+    }
+}
+
+# time spent writing the chunks of a streamed response, not counting
+#  the time spent waiting to send them
+def timeSerialise(chunks):
+    seconds = 0
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        seconds += time.perf_counter() - start
+        if chunk is None:
+            break
+        yield chunk
+    metricsRegistry.observePhase("serialise", seconds)
+
+# metadata adds the timings and size of the model (see metrics.py)
+#  to the output. plantId records the plan in the plan store (see plans.py)
+@app.post("/electricity/hydrogen-production-optimisation", response_model=SimulationOutputWithMetadata, openapi_extra=FORECAST_REQUEST_BODY)
+async def applyLpModel(request: Request, metadata: bool = False, plantId: Optional[str] = None):
+    try:
+        response_format = negotiateResponseFormat(request.headers.get("accept"))
+    except NotAcceptableError as error:
+        raise HTTPException(status_code=406, detail=str(error))
+
+    try:
+        input = parseForecast(await request.body(), request.headers.get("content-type"))
+    except UnsupportedMediaTypeError as error:
+        raise HTTPException(status_code=415, detail=str(error))
+    except InvalidBodyError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except pydantic.ValidationError as error:
+        raise HTTPException(status_code=422, detail=error.errors())
+
+    stats = createSolveStats()
+    try:
+        output = await run_in_threadpool(runCachedSimulations, input, columnar=isColumnar(response_format), stats=stats)
+    except SolverError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except InfeasibleRequestError as error:
+        raise HTTPException(status_code=422, detail=error.toDict())
+    if plantId is not None:
+        await run_in_threadpool(planStore.record, plantId, output)
+    if metadata:
+        output["metadata"] = stats
+
+    if isStreaming(response_format):
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return StreamingResponse(timeSerialise(iterSimulationOutput(output, response_format)), media_type=response_format, headers=headers)
+
+    start = time.perf_counter()
+    content = encodeSimulationOutput(output, response_format)
+    metricsRegistry.observePhase("serialise", time.perf_counter() - start)
+
+    return Response(content=content, media_type=response_format)
+
+@app.post("/electricity/hydrogen-production-optimisation/batch", response_model=SimulationOutputBatch)
+def applyLpModelBatch(input: ForecastBatch):
+    return { "items": runBatchSimulations(input.items) }
+
+# solves the forecast for every combination of the parameters in its sweep
+#  config, returning a table of the cost and totals of each plan
+@app.post("/electricity/hydrogen-production-optimisation/sweep", response_model=SweepOutput)
+def applyLpModelSweep(input: ForecastSweep):
+    try:
+        return runSweepSimulations(input)
+    except SolverError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+# solves the forecast for the members of a renewable generation ensemble,
+#  with a plan for the first periods shared by every member
+@app.post("/electricity/hydrogen-production-optimisation/stochastic", response_model=StochasticSimulationOutput)
+def applyStochasticLpModel(input: ForecastEnsemble):
+    # imported here so that scipy is only needed for this endpoint
+    from app.stochastic import runStochasticSimulations
+    try:
+        return runStochasticSimulations(input)
+    except SolverError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except InfeasibleRequestError as error:
+        raise HTTPException(status_code=422, detail=error.toDict())
+
+@app.post("/electricity/hydrogen-production-optimisation/rolling/{plantId}", response_model=SimulationOutputWithMetadata, response_model_exclude_unset=True)
+def applyRollingLpModel(plantId: str, input: Forecast, metadata: bool = False):
+    stats = createSolveStats()
+    try:
+        output = runRollingSimulations(plantId, input, stats)
+    except SolverError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except InfeasibleRequestError as error:
+        raise HTTPException(status_code=422, detail=error.toDict())
+    planStore.record(plantId, output)
+    if metadata:
+        output["metadata"] = stats
+    return output
+
+@app.delete("/electricity/hydrogen-production-optimisation/rolling/{plantId}")
+def clearRollingLpModel(plantId: str):
+    if not clearRollingHorizonState(plantId):
+        raise HTTPException(status_code=404, detail=f'no rolling plan for plant: {plantId}')
+    return {"ok": "true"}
+
+@app.get("/electricity/hydrogen-production-optimisation/plans/{plantId}", response_model=List[PlanSummary])
+def getPlans(plantId: str):
+    plans = planStore.list(plantId)
+    if not plans:
+        raise HTTPException(status_code=404, detail=f'no plans for plant: {plantId}')
+    return plans
+
+# the periods of the plant's latest plan whose setpoints changed since the
+#  plan with id since (normally the latest one the client has seen), or
+#  since the plan before the latest if not given
+@app.get("/electricity/hydrogen-production-optimisation/plans/{plantId}/changes", response_model=PlanChanges)
+def getPlanChanges(plantId: str, since: Optional[int] = None):
+    changes = planStore.changes(plantId, since)
+    if changes is None:
+        raise HTTPException(status_code=404, detail=f'no plans for plant: {plantId}')
+    return changes
+
+@app.delete("/electricity/hydrogen-production-optimisation/plans/{plantId}")
+def clearPlans(plantId: str):
+    if not planStore.clear(plantId):
+        raise HTTPException(status_code=404, detail=f'no plans for plant: {plantId}')
+    return {"ok": "true"}
+
+@app.get("/electricity/hydrogen-production-optimisation/cache")
+def getResultCacheStats():
+    return resultCache.stats()
+
+@app.delete("/electricity/hydrogen-production-optimisation/cache")
+def clearResultCache():
+    resultCache.clear()
+    return {"ok": "true"}
+
+@app.post("/electricity/hydrogen-production-optimisation/jobs", response_model=JobStatus, status_code=202)
+async def submitLpModelJob(input: Forecast, timeout: Optional[float] = None):
+    # rather than queue a job that can only fail
+    try:
+        checkFeasibility(input)
+    except InfeasibleRequestError as error:
+        raise HTTPException(status_code=422, detail=error.toDict())
+    try:
+        job = jobManager.submit(input, timeout)
+    except JobQueueFullError as error:
+        raise HTTPException(status_code=429, detail=str(error), headers={"Retry-After": "5"})
+    return job.toDict()
+
+def getJobOr404(jobId):
+    job = jobManager.get(jobId)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f'unknown job: {jobId}')
+    return job
+
+# wait (in seconds) is how long to wait for the job to finish before
+#  returning its status
+@app.get("/electricity/hydrogen-production-optimisation/jobs/{jobId}", response_model=JobStatus)
+async def getLpModelJob(jobId: str, wait: float = 0):
+    job = getJobOr404(jobId)
+    deadline = time.monotonic() + min(wait, MAX_JOB_WAIT)
+    while not job.isFinished() and time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+    return job.toDict()
+
+# streams a line of JSON each time the job's status changes, the last
+#  of which includes the job's output
+@app.get("/electricity/hydrogen-production-optimisation/jobs/{jobId}/events")
+async def streamLpModelJob(jobId: str):
+    job = getJobOr404(jobId)
+
+    async def events():
+        status = None
+        while True:
+            if job.status != status:
+                status = job.status
+                yield JobStatus.parse_obj(job.toDict()).json() + '\n'
+            if job.isFinished():
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.delete("/electricity/hydrogen-production-optimisation/jobs/{jobId}")
+async def cancelLpModelJob(jobId: str):
+    getJobOr404(jobId)
+    if not jobManager.cancel(jobId):
+        raise HTTPException(status_code=409, detail=f'job has already finished: {jobId}')
+    return {"ok": "true"}
+
+@app.get("/electricity/hydrogen-production-optimisation/jobs")
+async def getLpModelJobStats():
+    return jobManager.stats()
+
+# metrics of the runs of the model in this process, in the Prometheus
+#  text format
+@app.get("/metrics", response_class=PlainTextResponse)
+def getMetrics():
+    cache_stats = resultCache.stats()
+    job_stats = jobManager.stats()
+    plan_stats = planStore.stats()
+    content = metricsRegistry.render([
+        ("hydrogen_result_cache_entries", "gauge", "Outputs held in memory by the result cache", cache_stats["entries"]),
+        ("hydrogen_result_cache_hits_total", "counter", "Outputs served from memory by the result cache", cache_stats["hits"]),
+        ("hydrogen_result_cache_disk_hits_total", "counter", "Outputs served from disk by the result cache", cache_stats["diskHits"]),
+        ("hydrogen_result_cache_misses_total", "counter", "Requests not found in the result cache", cache_stats["misses"]),
+        ("hydrogen_result_cache_evictions_total", "counter", "Outputs evicted from memory by the result cache", cache_stats["evictions"]),
+        ("hydrogen_result_cache_disk_evictions_total", "counter", "Outputs removed from disk by the result cache", cache_stats["diskEvictions"]),
+        ("hydrogen_jobs_queued", "gauge", "Jobs waiting to run", job_stats["queued"]),
+        ("hydrogen_jobs_running", "gauge", "Jobs running", job_stats["running"]),
+        ("hydrogen_plans_recorded_total", "counter", "Plans recorded in the plan store", plan_stats["recorded"]),
+        ("hydrogen_plan_store_errors_total", "counter", "Plans that failed to be recorded in the plan store", plan_stats["errors"])
+    ])
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
+
+@app.on_event("shutdown")
+def stopJobManager():
+    jobManager.shutdown()
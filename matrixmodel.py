@@ -0,0 +1,307 @@
+from collections import namedtuple
+
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, milp
+from scipy.sparse import coo_matrix
+
+from app.lpmodel import FEASIBLE_STATUS, HEURISTIC_STATUS, ModelSolution, calculateMaxConsumptionPerPeriod, calculateMinConsumptionPerPeriod, calculateOnOffLimits, getForecastColumns, getMinimumStorage, getRepairOnOff
+from app.metrics import timePhase
+from app.solvers import MATRIX_SOLVER_NAME, getMatrixSolverOptions, getRelativeGap
+
+#
+# alternative to the PuLP model built by lpmodel.buildOptimalModel
+#
+# the same MILP is assembled directly as sparse arrays from the forecast,
+#  without creating an expression object or named constraint per period,
+#  and is solved in-process by HiGHS through scipy.optimize.milp
+#
+# columns are laid out in four blocks of one column per period:
+#   gridPower, windPower, onOff, cumulativePower
+#
+# where cumulativePower is the electricity consumed since the start of the
+#  simulation (as in the "cumulative" formulation), so the number of
+#  non-zeros grows linearly with the number of periods
+#
+# constraints from lpmodel.buildOptimalModel that only involve a single
+#  variable are expressed as bounds on that variable:
+#   1   - windPower is bounded by the forecast renewable generation
+#   3,4 - cumulativePower is bounded by the storage limits
+#
+
+MatrixModel = namedtuple('MatrixModel', [
+    'periods',
+    # objective coefficients
+    'c',
+    # 1 for integer columns, 0 for continuous
+    'integrality',
+    # column bounds
+    'lb', 'ub',
+    # sparse constraint matrix, and its row bounds
+    'A', 'row_lb', 'row_ub'
+])
+
+# scipy.optimize.milp status codes, mapped to the PuLP status names used
+#  for statusOfOptimalModel
+MILP_STATUS = {
+    0: 'Optimal',
+    1: 'Not Solved',
+    2: 'Infeasible',
+    3: 'Unbounded',
+    4: 'Undefined'
+}
+
+
+def buildMatrixModel(request):
+    periods = request.config.range.periods
+    period_duration = request.config.range.periodDuration
+    forecasts = getForecastColumns(request.forecasts)
+    minimum_allowed_storage = request.config.storage.minStorageSetPoint
+    max_storage = request.config.storage.maxStorage
+    storage_at_simulation_start = request.config.storage.initialStorage
+    final_storage = request.config.storage.finalStorage
+    production_factor = request.config.productionLimits.productionFactor
+    max_power_change = request.config.productionLimits.maxPowerChangePh
+
+    # check that we have a valid request
+    assert periods == len(forecasts['timestamp'])
+
+    renewable_generation = np.asarray(forecasts['renewableGeneration'], dtype=float)
+    hydrogen_demand = np.asarray(forecasts['hydrogenDemand'], dtype=float)
+    grid_price = np.asarray(forecasts['gridPrice'], dtype=float)
+    renewable_price = np.asarray(forecasts['renewablePrice'], dtype=float)
+
+    max_elec_consumption_by_electrolysers = calculateMaxConsumptionPerPeriod(request.config)
+    min_elec_consumption_of_electrolysers = calculateMinConsumptionPerPeriod(request.config)
+    M = calculateOnOffLimits(request.config)
+    max_power_change_per_period = max_power_change * period_duration
+
+    # column offsets for each block of variables
+    grid_col = 0
+    wind_col = periods
+    on_off_col = 2 * periods
+    cumulative_col = 3 * periods
+    columns = 4 * periods
+
+    idx = np.arange(periods)
+
+    #
+    # objective - cost of electricity used, price in £/MWh
+    #
+    c = np.zeros(columns)
+    c[grid_col:wind_col] = grid_price
+    c[wind_col:on_off_col] = renewable_price
+
+    integrality = np.zeros(columns)
+    integrality[on_off_col:cumulative_col] = 1
+
+    #
+    # column bounds
+    #
+    cumulative_hydrogen_demand = np.cumsum(hydrogen_demand)
+
+    # constraint 3: min electricity consumed to maintain min storage levels
+    minimum_storage = np.full(periods, minimum_allowed_storage, dtype=float)
+    minimum_storage[-1] = getMinimumStorage(request.config.storage, True)
+    min_cumulative_consumption = np.maximum(0, (minimum_storage - (storage_at_simulation_start - cumulative_hydrogen_demand)) / production_factor)
+
+    # constraint 4: max electricity consumed without exceeding storage capacity,
+    #  ending the simulation where we started (or at the final storage)
+    max_cumulative_consumption = (max_storage - storage_at_simulation_start + cumulative_hydrogen_demand) / production_factor
+    if final_storage is None:
+        max_cumulative_consumption[-1] = cumulative_hydrogen_demand[-1] / production_factor
+    else:
+        max_cumulative_consumption[-1] = (final_storage - storage_at_simulation_start + cumulative_hydrogen_demand[-1]) / production_factor
+
+    lb = np.zeros(columns)
+    ub = np.full(columns, np.inf)
+    # constraint 1: don't use more wind power than the forecast says will be available
+    ub[wind_col:on_off_col] = renewable_generation
+    ub[on_off_col:cumulative_col] = 1
+    lb[cumulative_col:] = min_cumulative_consumption
+    ub[cumulative_col:] = max_cumulative_consumption
+
+    #
+    # constraint rows - each block adds rows/cols/values triplets
+    #
+    rows = []
+    cols = []
+    values = []
+    row_lb = []
+    row_ub = []
+    row_count = 0
+
+    def add_block(block_rows, block_cols, block_values, block_lb, block_ub):
+        nonlocal row_count
+        rows.append(block_rows + row_count)
+        cols.append(block_cols)
+        values.append(block_values)
+        row_lb.append(block_lb)
+        row_ub.append(block_ub)
+        row_count += len(block_lb)
+
+    ones = np.ones(periods)
+
+    # constraint 2: can't consume more electricity than the max usage of the electrolysers per period
+    add_block(np.concatenate([idx, idx]),
+              np.concatenate([grid_col + idx, wind_col + idx]),
+              np.concatenate([ones, ones]),
+              np.full(periods, -np.inf),
+              np.full(periods, max_elec_consumption_by_electrolysers))
+
+    # constraint 5: Ensure power is either 0 or more than the minimum level
+    add_block(np.concatenate([idx, idx, idx]),
+              np.concatenate([grid_col + idx, wind_col + idx, on_off_col + idx]),
+              np.concatenate([ones, ones, np.full(periods, -min_elec_consumption_of_electrolysers)]),
+              np.zeros(periods),
+              np.full(periods, np.inf))
+
+    # constraint 6: if power is being used, machines must be set to on
+    add_block(np.concatenate([idx, idx, idx]),
+              np.concatenate([grid_col + idx, wind_col + idx, on_off_col + idx]),
+              np.concatenate([ones, ones, -M]),
+              np.full(periods, -np.inf),
+              np.zeros(periods))
+
+    # constraint 7: don't change power usage faster than max_power_change
+    #  (ramp up and ramp down limits share a single ranged row)
+    if periods > 1:
+        ramp = np.arange(periods - 1)
+        ramp_ones = np.ones(periods - 1)
+        add_block(np.concatenate([ramp, ramp, ramp, ramp]),
+                  np.concatenate([grid_col + ramp, wind_col + ramp, grid_col + ramp + 1, wind_col + ramp + 1]),
+                  np.concatenate([ramp_ones, ramp_ones, -ramp_ones, -ramp_ones]),
+                  np.full(periods - 1, -max_power_change_per_period),
+                  np.full(periods - 1, max_power_change_per_period))
+
+    # constraint 7 also applies to the change from the power used before the
+    #  simulation, and to the power used after it, where they are given
+    for period, power in [ (0, request.config.productionLimits.initialPower), (periods - 1, request.config.productionLimits.finalPower) ]:
+        if power is not None:
+            add_block(np.zeros(2, dtype=int),
+                      np.array([ grid_col + period, wind_col + period ]),
+                      np.ones(2),
+                      np.array([ power - max_power_change_per_period ]),
+                      np.array([ power + max_power_change_per_period ]))
+
+    # constraint 8 (tightened formulation only): no more than the ramp limit
+    #  in the period the electrolysers are turned on, or before they're turned off
+    if request.config.tightened:
+        excess = M - max_power_change_per_period
+        for neighbour in [ -1, 1 ]:
+            limited = idx[(excess > 0) & (idx + neighbour >= 0) & (idx + neighbour < periods)]
+            row = np.arange(len(limited))
+            add_block(np.concatenate([row, row, row, row]),
+                      np.concatenate([grid_col + limited, wind_col + limited, on_off_col + limited, on_off_col + limited + neighbour]),
+                      np.concatenate([np.ones(len(limited)), np.ones(len(limited)), np.full(len(limited), -max_power_change_per_period), -excess[limited]]),
+                      np.full(len(limited), -np.inf),
+                      np.zeros(len(limited)))
+
+    # cumulative consumption: this period's total is last period's total
+    #  plus the power used this period
+    previous = np.arange(1, periods)
+    add_block(np.concatenate([idx, idx, idx, previous]),
+              np.concatenate([cumulative_col + idx, grid_col + idx, wind_col + idx, cumulative_col + previous - 1]),
+              np.concatenate([ones, -ones, -ones, -np.ones(periods - 1)]),
+              np.zeros(periods),
+              np.zeros(periods))
+
+    A = coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(row_count, columns)).tocsr()
+
+    return MatrixModel(periods, c, integrality, lb, ub, A, np.concatenate(row_lb), np.concatenate(row_ub))
+
+
+# size of the model, for the stats in metrics.py (constraints expressed
+#  as bounds on a single variable aren't counted)
+def getMatrixModelSize(matrix_model):
+    return {
+        'variables': len(matrix_model.c),
+        'integerVariables': int(np.count_nonzero(matrix_model.integrality)),
+        'constraints': matrix_model.A.shape[0],
+        'nonZeros': int(matrix_model.A.nnz)
+    }
+
+
+def _milp(matrix_model, integrality, lb, ub, options):
+    return milp(matrix_model.c,
+        integrality=integrality,
+        bounds=Bounds(lb, ub),
+        constraints=LinearConstraint(matrix_model.A, matrix_model.row_lb, matrix_model.row_ub),
+        options=options)
+
+
+# solve the model with HiGHS, returning the solution vector (or None if no
+#  solution was found) and the PuLP name for the solver status, and adding
+#  the size of the model and what HiGHS reports about the solve to stats
+#  (if given)
+#
+# if HiGHS stops at its time limit, the status is Feasible if it found a
+#  solution, and otherwise a solution is repaired from the LP relaxation of
+#  the model, as in lpmodel.repairPulpModel
+def solveMatrixModel(matrix_model, options=None, stats=None):
+    with timePhase(stats, 'solve'):
+        result = _milp(matrix_model, matrix_model.integrality, matrix_model.lb, matrix_model.ub, options)
+
+    if stats is not None:
+        stats.update(getMatrixModelSize(matrix_model))
+        stats['objective'] = result.get('fun')
+        stats['mipGap'] = result.get('mip_gap')
+        stats['nodes'] = result.get('mip_node_count')
+
+    model_status = MILP_STATUS.get(result.status, 'Undefined')
+    if model_status == 'Not Solved':
+        if result.x is not None:
+            return result.x, FEASIBLE_STATUS
+        with timePhase(stats, 'solve'):
+            return repairMatrixModel(matrix_model, options, stats)
+
+    return result.x, model_status
+
+
+# the columns of the model can be repeated in several sets of the four
+#  blocks (as in stochastic.py), where every integer column is an onOff
+def repairMatrixModel(matrix_model, options=None, stats=None):
+    periods = matrix_model.periods
+    on_off_columns = matrix_model.integrality == 1
+    continuous = np.zeros(len(matrix_model.c))
+
+    relaxation = _milp(matrix_model, continuous, matrix_model.lb, matrix_model.ub, options)
+    if relaxation.x is None:
+        return None, MILP_STATUS.get(relaxation.status, 'Undefined')
+
+    blocks = relaxation.x.reshape(-1, 4, periods)
+    for on_off in getRepairOnOff((blocks[:, 0] + blocks[:, 1]).ravel()):
+        lb = matrix_model.lb.copy()
+        ub = matrix_model.ub.copy()
+        lb[on_off_columns] = ub[on_off_columns] = on_off
+        result = _milp(matrix_model, continuous, lb, ub, options)
+        if result.x is not None:
+            if stats is not None:
+                stats['objective'] = result.fun
+                stats['mipGap'] = getRelativeGap(result.fun, relaxation.fun)
+                stats['nodes'] = None
+            return result.x, HEURISTIC_STATUS
+
+    return None, 'Not Solved'
+
+
+# the model outputs from the solution vector, as used by
+#  lpmodel.buildSimulationOutput
+def getMatrixModelSolution(matrix_model, solution):
+    periods = matrix_model.periods
+    if solution is None:
+        solution = np.zeros(4 * periods)
+
+    return ModelSolution(
+        gridPower=solution[0:periods],
+        windPower=solution[periods:2 * periods],
+        onOff=np.round(solution[2 * periods:3 * periods]))
+
+
+def runMatrixModel(request, stats=None):
+    options = getMatrixSolverOptions(request)
+    with timePhase(stats, 'build'):
+        matrix_model = buildMatrixModel(request)
+    solution, model_status = solveMatrixModel(matrix_model, options, stats)
+    with timePhase(stats, 'extract'):
+        model_solution = getMatrixModelSolution(matrix_model, solution)
+    return model_solution, model_status, MATRIX_SOLVER_NAME
@@ -0,0 +1,176 @@
+import threading
+import time
+from contextlib import contextmanager
+
+#
+# instrumentation of the "optimal" simulation
+#
+# each run of the model can fill in a dict of stats (see
+#  electricity.SolveMetadata), with:
+#   timings          - seconds spent in each phase:
+#                        feasibility - checking the request could have a
+#                                      plan (see feasibility.py)
+#                        build       - creating the model
+#                        solve       - running the solver
+#                        extract     - reading the solution from the model
+#                        postProcess - calculating the simulation results
+#   variables, integerVariables, constraints, nonZeros - size of the model
+#   status, solver   - as returned in the output
+#   objective        - cost of the plan found by the solver
+#   mipGap           - relative gap between the plan found and the best
+#                      possible plan, if the solver reports it
+#   nodes            - number of branch and bound nodes, if the solver
+#                      reports it
+#   cached           - whether the output came from the result cache
+#
+# the stats of every run in this process are aggregated by metricsRegistry,
+#  which can be rendered in the Prometheus text exposition format
+#
+
+PHASES = [ 'feasibility', 'build', 'solve', 'extract', 'postProcess', 'serialise' ]
+
+# buckets for the histograms, in seconds and number of non-zeros
+PHASE_BUCKETS = [ 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300 ]
+NON_ZERO_BUCKETS = [ 1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7 ]
+
+
+def createSolveStats():
+    return {
+        'timings': {},
+        'variables': None,
+        'integerVariables': None,
+        'constraints': None,
+        'nonZeros': None,
+        'status': None,
+        'solver': None,
+        'objective': None,
+        'mipGap': None,
+        'nodes': None,
+        'cached': False
+    }
+
+
+# time the code run in the with block as a phase of the stats
+#  (which does nothing if stats is None)
+@contextmanager
+def timePhase(stats, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats['timings'][phase] = stats['timings'].get(phase, 0) + time.perf_counter() - start
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [ 0 ] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _formatLabels(labels):
+    if not labels:
+        return ''
+    escaped = [ (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _formatValue(value):
+    if isinstance(value, int):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (status, solver) -> number of runs
+        self.runs = {}
+        # phase -> Histogram
+        self.phase_seconds = {}
+        self.non_zeros = Histogram(NON_ZERO_BUCKETS)
+        # stats of the most recent run
+        self.last = None
+
+    def recordSolve(self, stats):
+        with self.lock:
+            key = (stats['status'], stats['solver'])
+            self.runs[key] = self.runs.get(key, 0) + 1
+            for phase, seconds in stats['timings'].items():
+                self._observePhase(phase, seconds)
+            if stats['nonZeros'] is not None:
+                self.non_zeros.observe(stats['nonZeros'])
+            self.last = stats
+
+    def observePhase(self, phase, seconds):
+        with self.lock:
+            self._observePhase(phase, seconds)
+
+    # must be called holding self.lock
+    def _observePhase(self, phase, seconds):
+        if phase not in self.phase_seconds:
+            self.phase_seconds[phase] = Histogram(PHASE_BUCKETS)
+        self.phase_seconds[phase].observe(seconds)
+
+    # extra is a list of (name, type, help, value) for metrics that are
+    #  held elsewhere (e.g. the result cache), added to those rendered
+    def render(self, extra=None):
+        lines = []
+
+        def add_metric(name, metric_type, help, samples):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_formatLabels(labels)} {_formatValue(value)}')
+
+        def histogram_samples(name, labels, histogram):
+            samples = [ (name + '_bucket', labels + [ ('le', _formatValue(float(bucket))) ], count)
+                        for bucket, count in zip(histogram.buckets, histogram.counts) ]
+            samples.append((name + '_bucket', labels + [ ('le', '+Inf') ], histogram.count))
+            samples.append((name + '_sum', labels, histogram.sum))
+            samples.append((name + '_count', labels, histogram.count))
+            return samples
+
+        with self.lock:
+            add_metric('hydrogen_optimisations_total', 'counter', 'Runs of the optimal model, by solver status and solver',
+                [ ('hydrogen_optimisations_total', [ ('status', status), ('solver', solver) ], count)
+                  for (status, solver), count in sorted(self.runs.items(), key=str) ])
+
+            phase_samples = []
+            for phase in sorted(self.phase_seconds, key=lambda phase: PHASES.index(phase) if phase in PHASES else len(PHASES)):
+                phase_samples += histogram_samples('hydrogen_optimisation_phase_seconds', [ ('phase', phase) ], self.phase_seconds[phase])
+            add_metric('hydrogen_optimisation_phase_seconds', 'histogram', 'Time spent in each phase of a run of the optimal model', phase_samples)
+
+            add_metric('hydrogen_optimisation_nonzeros', 'histogram', 'Non-zeros in the constraint matrix of the optimal model',
+                histogram_samples('hydrogen_optimisation_nonzeros', [], self.non_zeros))
+
+            if self.last is not None:
+                for field, name, help in [
+                        ('variables', 'hydrogen_last_optimisation_variables', 'Variables in the most recent optimal model'),
+                        ('integerVariables', 'hydrogen_last_optimisation_integer_variables', 'Integer variables in the most recent optimal model'),
+                        ('constraints', 'hydrogen_last_optimisation_constraints', 'Constraints in the most recent optimal model'),
+                        ('nonZeros', 'hydrogen_last_optimisation_nonzeros', 'Non-zeros in the most recent optimal model'),
+                        ('mipGap', 'hydrogen_last_optimisation_mip_gap', 'Relative MIP gap of the most recent optimal model'),
+                        ('nodes', 'hydrogen_last_optimisation_nodes', 'Branch and bound nodes of the most recent optimal model'),
+                        ('objective', 'hydrogen_last_optimisation_objective', 'Objective of the most recent optimal model')]:
+                    if self.last[field] is not None:
+                        add_metric(name, 'gauge', help, [ (name, [], self.last[field]) ])
+
+        for name, metric_type, help, value in extra or []:
+            add_metric(name, metric_type, help, [ (name, [], value) ])
+
+        return '\n'.join(lines) + '\n'
+
+
+metricsRegistry = MetricsRegistry()
@@ -0,0 +1,223 @@
+import os
+import sqlite3
+import threading
+import time
+
+from app.lpmodel import PLAN_STATUSES
+
+#
+# store of the plans solved for each plant, so that clients can ask for
+#  only the periods that changed since the last plan they saw, rather than
+#  fetching every plan in full and comparing it themselves
+#
+# plans are recorded, with the time they were solved, when a request names
+#  its plant (the plantId query parameter, or the plant of a rolling-horizon
+#  re-plan) and the optimal model has a plan. only the setpoints of each
+#  period are kept - the electricity used from the grid and from wind, and
+#  whether the electrolyser is on - as the totals over all the stacks for
+#  plants with several stacks
+#
+# plans are held in SQLite, in two tables:
+#   plans   - a row per plan, with an id that increases with each plan
+#             recorded, indexed by plant and time solved
+#   periods - a row per period of each plan, keyed on the plan's id and the
+#             period's index, and indexed by the period's timestamp
+# so the periods that changed between two plans are found by joining their
+#  periods on timestamp, without reading either plan in full. forecasts can
+#  repeat a timestamp, so where they do, the first period with a timestamp
+#  is matched with the first period with that timestamp in the earlier plan,
+#  the second with the second, and so on. a period has
+#  changed if it wasn't in the earlier plan (normally those at the end of
+#  a horizon that has moved on), if the electrolyser is turned on or off, or
+#  if the electricity used from either source differs by more than
+#  PLAN_CHANGE_TOLERANCE
+#
+# a plan that fails to be recorded (e.g. if the database can't be written
+#  to) is counted in stats, rather than failing the request it was solved for
+#
+# the plan store used by the service is configured with environment variables:
+#   HYDROGEN_PLAN_STORE    - path of the SQLite database (optional, plans are
+#                            only held in memory if not given)
+#   HYDROGEN_PLAN_HISTORY  - max plans kept per plant, the oldest being
+#                            removed first (0 disables the store)
+#
+
+DEFAULT_PLAN_HISTORY = 100
+
+# MWh
+PLAN_CHANGE_TOLERANCE = 1e-6
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS plans (id INTEGER PRIMARY KEY AUTOINCREMENT, plant_id TEXT NOT NULL, created_at REAL NOT NULL, status TEXT NOT NULL, solver TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS plans_by_plant ON plans (plant_id, created_at)',
+    'CREATE TABLE IF NOT EXISTS periods (plan_id INTEGER NOT NULL, period INTEGER NOT NULL, timestamp TEXT NOT NULL, occurrence INTEGER NOT NULL, grid_power REAL NOT NULL, wind_power REAL NOT NULL, electrolyser_on INTEGER NOT NULL, PRIMARY KEY (plan_id, period)) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS periods_by_timestamp ON periods (plan_id, timestamp, occurrence)'
+]
+
+CHANGED_PERIODS_QUERY = '''
+    SELECT latest.timestamp, latest.grid_power, latest.wind_power, latest.electrolyser_on,
+           previous.grid_power, previous.wind_power, previous.electrolyser_on
+    FROM periods AS latest
+    LEFT JOIN periods AS previous ON previous.plan_id = ? AND previous.timestamp = latest.timestamp AND previous.occurrence = latest.occurrence
+    WHERE latest.plan_id = ?
+      AND (previous.timestamp IS NULL
+           OR latest.electrolyser_on != previous.electrolyser_on
+           OR abs(latest.grid_power - previous.grid_power) > ?
+           OR abs(latest.wind_power - previous.wind_power) > ?)
+    ORDER BY latest.period
+'''
+
+
+# (timestamp, grid power, wind power, electrolyser on) of each period of
+#  the "optimal" simulation, from an output in either layout
+def getPlanPeriods(output):
+    simulations = output['simulations']
+    if isinstance(simulations, dict):
+        optimal = simulations['optimal']
+        return list(zip(
+            simulations['timestamp'],
+            optimal['electricityUsage']['grid'],
+            optimal['electricityUsage']['wind'],
+            optimal['electrolyserOn']))
+    return [ (result['timestamp'],
+              result['optimal']['electricityUsage']['grid'],
+              result['optimal']['electricityUsage']['wind'],
+              result['optimal']['electrolyserOn'])
+             for result in simulations ]
+
+
+# the number of times each period's timestamp appears in the periods
+#  before it
+def getTimestampOccurrences(timestamps):
+    seen = {}
+    occurrences = []
+    for timestamp in timestamps:
+        occurrences.append(seen.get(timestamp, 0))
+        seen[timestamp] = occurrences[-1] + 1
+    return occurrences
+
+
+def getSetpoints(grid_power, wind_power, electrolyser_on):
+    return { 'gridPower': grid_power, 'windPower': wind_power, 'electrolyserOn': bool(electrolyser_on) }
+
+
+class PlanStore:
+    def __init__(self, path=':memory:', max_history=DEFAULT_PLAN_HISTORY):
+        self.path = path
+        self.max_history = max_history
+        # one connection shared by the threads serving requests, which
+        #  take turns to use it
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.recorded = 0
+        self.errors = 0
+        with self.lock, self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def enabled(self):
+        return self.max_history > 0
+
+    # returns the id of the plan, or None if the output has no plan or
+    #  it couldn't be recorded
+    def record(self, plant_id, output):
+        if not self.enabled() or output['statusOfOptimalModel'] not in PLAN_STATUSES:
+            return None
+        try:
+            periods = getPlanPeriods(output)
+            occurrences = getTimestampOccurrences([ timestamp for timestamp, *_ in periods ])
+            with self.lock, self.connection:
+                cursor = self.connection.execute(
+                    'INSERT INTO plans (plant_id, created_at, status, solver) VALUES (?, ?, ?, ?)',
+                    (plant_id, time.time(), output['statusOfOptimalModel'], output['solverOfOptimalModel']))
+                plan_id = cursor.lastrowid
+                self.connection.executemany(
+                    'INSERT INTO periods (plan_id, period, timestamp, occurrence, grid_power, wind_power, electrolyser_on) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [ (plan_id, i, timestamp, occurrence, float(grid_power), float(wind_power), int(bool(electrolyser_on)))
+                      for i, ((timestamp, grid_power, wind_power, electrolyser_on), occurrence) in enumerate(zip(periods, occurrences)) ])
+                self._removeOldPlans(plant_id)
+                self.recorded += 1
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            return None
+        return plan_id
+
+    def stats(self):
+        with self.lock:
+            return { 'recorded': self.recorded, 'errors': self.errors }
+
+    # the plans kept for the plant, oldest first
+    def list(self, plant_id):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, created_at, status, solver, (SELECT count(*) FROM periods WHERE plan_id = plans.id) FROM plans WHERE plant_id = ? ORDER BY created_at, id',
+                (plant_id,)).fetchall()
+        return [ { 'planId': plan_id, 'createdAt': created_at, 'statusOfOptimalModel': status, 'solverOfOptimalModel': solver, 'periods': periods }
+                 for plan_id, created_at, status, solver, periods in rows ]
+
+    # the periods of the plant's latest plan that changed since the plan
+    #  with id since, or since the plan before the latest if not given.
+    #  every period is returned if there's no such plan (e.g. it has been
+    #  removed), and none if since is the latest plan. returns None if
+    #  there are no plans for the plant
+    def changes(self, plant_id, since=None):
+        with self.lock:
+            plans = self.connection.execute(
+                'SELECT id, created_at FROM plans WHERE plant_id = ? ORDER BY created_at DESC, id DESC',
+                (plant_id,)).fetchall()
+            if not plans:
+                return None
+            latest_id, created_at = plans[0]
+            plan_ids = [ plan_id for plan_id, _ in plans ]
+            if since is None:
+                previous_id = plan_ids[1] if len(plan_ids) > 1 else None
+            else:
+                previous_id = since if since in plan_ids else None
+
+            if previous_id == latest_id:
+                rows = []
+            else:
+                rows = self.connection.execute(
+                    CHANGED_PERIODS_QUERY,
+                    (previous_id, latest_id, PLAN_CHANGE_TOLERANCE, PLAN_CHANGE_TOLERANCE)).fetchall()
+
+        return {
+            'plantId': plant_id,
+            'planId': latest_id,
+            'createdAt': created_at,
+            'previousPlanId': previous_id,
+            'periods': [ dict(getSetpoints(*row[1:4]),
+                              timestamp=row[0],
+                              previous=getSetpoints(*row[4:7]) if row[4] is not None else None)
+                         for row in rows ]
+        }
+
+    # returns False if there were no plans for the plant
+    def clear(self, plant_id):
+        with self.lock, self.connection:
+            plan_ids = [ (plan_id,) for plan_id, in self.connection.execute('SELECT id FROM plans WHERE plant_id = ?', (plant_id,)) ]
+            self.connection.executemany('DELETE FROM periods WHERE plan_id = ?', plan_ids)
+            self.connection.execute('DELETE FROM plans WHERE plant_id = ?', (plant_id,))
+        return len(plan_ids) > 0
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    # must be called holding self.lock, in a transaction
+    def _removeOldPlans(self, plant_id):
+        old_plan_ids = self.connection.execute(
+            'SELECT id FROM plans WHERE plant_id = ? ORDER BY created_at DESC, id DESC LIMIT -1 OFFSET ?',
+            (plant_id, self.max_history)).fetchall()
+        self.connection.executemany('DELETE FROM periods WHERE plan_id = ?', old_plan_ids)
+        self.connection.executemany('DELETE FROM plans WHERE id = ?', old_plan_ids)
+
+
+def createServicePlanStore():
+    return PlanStore(
+        path=os.environ.get('HYDROGEN_PLAN_STORE') or ':memory:',
+        max_history=int(os.environ.get('HYDROGEN_PLAN_HISTORY', DEFAULT_PLAN_HISTORY)))
+
+
+planStore = createServicePlanStore()
@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.feasibility import checkFeasibility
+from app.lpmodel import PLAN_STATUSES, buildOptimalModel, buildSimulationOutput, getForecastColumns, getPulpModelSolution, runSimulations, solveOptimalModel, updateOptimalModel
+from app.metrics import createSolveStats, metricsRegistry, timePhase
+from app.solvers import getPulpSolver, getSolverConfiguration
+
+#
+# rolling-horizon re-optimisation
+#
+# plants are re-planned regularly with a forecast that is mostly the previous
+#  forecast shifted on by one or more periods. for each plant id, the model
+#  from the previous re-plan is kept along with its solution, so that the
+#  next re-plan can:
+#   - update the coefficients of the existing model that depend on the
+#     forecast (prices, renewable generation, and the storage limits that
+#     depend on hydrogen demand and initial storage) and the ramp limits
+#     from the initial power and to the final power, rather than rebuilding it
+#   - warm-start the solver from the previous solution, shifted so that it
+#     lines up with the timestamps of the new forecast
+#
+# the model is rebuilt if anything else in the config changes. requests using
+#  the matrix model builder are solved from scratch, as that model is cheap to
+#  build and scipy can't warm-start HiGHS, as are decomposed requests and
+#  those with several stacks
+#
+# models are kept for the plants re-planned most recently, up to a maximum
+#  number of plants, and for a time to live since each plant's last re-plan,
+#  after which the next re-plan for the plant builds its model from scratch
+#
+# the models kept by the service are configured with environment variables:
+#   HYDROGEN_ROLLING_PLANTS - max plants whose models are kept
+#   HYDROGEN_ROLLING_TTL    - time to live of a plant's model, in seconds
+#
+
+DEFAULT_ROLLING_PLANTS = 64
+DEFAULT_ROLLING_TTL = 3600
+
+MAX_ROLLING_PLANTS = int(os.environ.get('HYDROGEN_ROLLING_PLANTS', DEFAULT_ROLLING_PLANTS))
+ROLLING_TTL = float(os.environ.get('HYDROGEN_ROLLING_TTL', DEFAULT_ROLLING_TTL))
+
+# number of locks shared out between the plants
+PLANT_LOCKS = 64
+
+class RollingHorizonState:
+    def __init__(self, structure, model, gridPower, windPower, onOff):
+        # the parts of the config the model was built from
+        self.structure = structure
+        self.model = model
+        self.gridPower = gridPower
+        self.windPower = windPower
+        self.onOff = onOff
+        # timestamps and ModelSolution from the last optimal solution
+        self.timestamps = None
+        self.solution = None
+        # time after which the state is forgotten
+        self.expires = None
+
+
+# plant id -> RollingHorizonState, least recently used first
+_states = OrderedDict()
+_states_lock = threading.Lock()
+# so that re-plans for the same plant don't share a model. a plant always
+#  gets the same lock, which it may share with other plants
+_plant_locks = [ threading.Lock() for _ in range(PLANT_LOCKS) ]
+
+
+def _getPlantLock(plant_id):
+    return _plant_locks[hash(plant_id) % len(_plant_locks)]
+
+
+def _getState(plant_id):
+    with _states_lock:
+        state = _states.get(plant_id)
+        if state is None:
+            return None
+        if state.expires <= time.time():
+            del _states[plant_id]
+            return None
+        _states.move_to_end(plant_id)
+        return state
+
+
+# keep the state for the plant, forgetting those that have expired, and
+#  those used least recently beyond MAX_ROLLING_PLANTS
+def _putState(plant_id, state):
+    now = time.time()
+    with _states_lock:
+        state.expires = now + ROLLING_TTL
+        _states[plant_id] = state
+        _states.move_to_end(plant_id)
+        while _states and (len(_states) > MAX_ROLLING_PLANTS or next(iter(_states.values())).expires <= now):
+            _states.popitem(last=False)
+
+
+# the parts of the config that determine the structure of the model, i.e.
+#  everything except the initial and final storage, the initial and final
+#  power (other than whether they are given) and the solver options. the
+#  tightened formulation limits the power of each period from the initial
+#  and final power (see lpmodel.calculateOnOffLimits), so for it they are
+#  part of the structure
+def getModelStructure(request):
+    limits = request.config.productionLimits
+    exclude = { 'storage': { 'initialStorage', 'finalStorage' }, 'solver': True }
+    if not request.config.tightened:
+        exclude['productionLimits'] = { 'initialPower', 'finalPower' }
+    structure = request.config.dict(exclude=exclude)
+    structure['initialPowerGiven'] = limits.initialPower is not None
+    structure['finalPowerGiven'] = limits.finalPower is not None
+    return structure
+
+
+# set the initial values of the model's variables from the previous
+#  solution, matching periods by timestamp. periods that weren't in the
+#  previous forecast (normally those at the end of the new horizon) start
+#  from the values of the last period that was
+def setWarmStart(state, previous_timestamps, previous_solution, request):
+    for var in state.model.variables():
+        var.varValue = None
+
+    if previous_solution is None:
+        return False
+
+    previous_index = { timestamp: i for i, timestamp in enumerate(previous_timestamps) }
+    last_matched = None
+    for i, timestamp in enumerate(getForecastColumns(request.forecasts)['timestamp']):
+        j = previous_index.get(timestamp, last_matched)
+        if j is None:
+            continue
+        last_matched = j
+
+        state.gridPower[i].setInitialValue(float(previous_solution.gridPower[j]))
+        state.windPower[i].setInitialValue(float(previous_solution.windPower[j]))
+        state.onOff[i].setInitialValue(round(previous_solution.onOff[j]))
+
+    return last_matched is not None
+
+
+# stats (if given) is filled in as described in metrics.py, where the
+#  build phase is the time taken to update or rebuild the model
+#
+# raises feasibility.InfeasibleRequestError if no plan can meet the request,
+#  leaving the plant's model as it was
+def runRollingSimulations(plant_id, request, stats=None):
+    if request.config.modelBuilder != 'pulp' or request.config.decomposition is not None or request.config.stacks is not None:
+        return runSimulations(request, stats=stats)
+
+    if stats is None:
+        stats = createSolveStats()
+
+    with timePhase(stats, 'feasibility'):
+        checkFeasibility(request)
+
+    structure = getModelStructure(request)
+
+    with _getPlantLock(plant_id):
+        previous_state = _getState(plant_id)
+
+        with timePhase(stats, 'build'):
+            if previous_state is not None and previous_state.structure == structure:
+                state = previous_state
+                updateOptimalModel(state.model, state.gridPower, state.windPower, request)
+            else:
+                state = RollingHorizonState(structure, *buildOptimalModel(request))
+
+        previous_timestamps = previous_state.timestamps if previous_state else None
+        previous_solution = previous_state.solution if previous_state else None
+        warm_start = setWarmStart(state, previous_timestamps, previous_solution, request)
+
+        solver = getPulpSolver(getSolverConfiguration(request), warm_start=warm_start)
+        model_status = solveOptimalModel(state.model, state.gridPower, state.windPower, state.onOff, solver, stats)
+        with timePhase(stats, 'extract'):
+            solution = getPulpModelSolution(state.gridPower, state.windPower, state.onOff)
+
+        # only warm-start the next re-plan from a solution that is a plan
+        #  (even if it wasn't proved optimal)
+        if model_status in PLAN_STATUSES:
+            state.timestamps = list(getForecastColumns(request.forecasts)['timestamp'])
+            state.solution = solution
+        else:
+            state.timestamps = None
+            state.solution = None
+        _putState(plant_id, state)
+
+    output = buildSimulationOutput(request, solution, model_status, solver.name, stats=stats)
+
+    stats['status'] = model_status
+    stats['solver'] = solver.name
+    metricsRegistry.recordSolve(stats)
+
+    return output
+
+
+# forget the model and solution kept for a plant, returning whether
+#  there was anything to forget
+def clearRollingHorizonState(plant_id):
+    with _getPlantLock(plant_id), _states_lock:
+        return _states.pop(plant_id, None) is not None
@@ -0,0 +1,167 @@
+import os
+import re
+
+import pulp
+
+from app.electricity import SolverConfiguration
+
+#
+# selection of the solver used for the "optimal" simulation
+#
+# the solver can be configured for the whole service using environment
+#  variables, and overridden for a single request using config.solver
+#
+#   HYDROGEN_SOLVER             - solver name (for the PuLP model builder)
+#   HYDROGEN_SOLVER_THREADS     - number of threads the solver may use
+#   HYDROGEN_SOLVER_TIME_LIMIT  - time limit in seconds (defaults to DEFAULT_TIME_LIMIT,
+#                                 or "none" for no limit)
+#   HYDROGEN_SOLVER_GAP_REL     - relative MIP gap at which the solver can stop
+#
+# solver names are PuLP solver names (see pulp.listSolvers()), and the
+#  shorthands:
+#   CBC   - the CBC binary bundled with PuLP, run as a subprocess
+#   HiGHS - HiGHS, run in-process through highspy
+#
+# if no solver is configured, PuLP's default solver (CBC) is used
+#
+# the time limit bounds how long a request can take to solve. if the solver
+#  stops at the time limit, the best plan it found is returned, or if it
+#  didn't find one, a plan repaired from the LP relaxation of the model (see
+#  lpmodel.solveOptimalModel)
+#
+
+DEFAULT_TIME_LIMIT = 60
+
+SOLVER_ALIASES = {
+    'CBC': 'PULP_CBC_CMD',
+    'HIGHS': 'HiGHS'
+}
+
+# the matrix model builder always solves in-process with HiGHS
+MATRIX_SOLVER_NAME = 'HiGHS'
+
+# PuLP solvers that can be started from the initial values of the variables
+WARM_START_SOLVERS = [ 'PULP_CBC_CMD', 'COIN_CMD', 'CPLEX_CMD', 'CPLEX_PY', 'GUROBI', 'GUROBI_CMD' ]
+
+
+class SolverError(ValueError):
+    pass
+
+
+def parseTimeLimit(time_limit):
+    if not time_limit:
+        return DEFAULT_TIME_LIMIT
+    if time_limit.lower() == 'none':
+        return None
+    return float(time_limit)
+
+
+def getServiceSolverConfiguration():
+    threads = os.environ.get('HYDROGEN_SOLVER_THREADS')
+    time_limit = os.environ.get('HYDROGEN_SOLVER_TIME_LIMIT')
+    gap_rel = os.environ.get('HYDROGEN_SOLVER_GAP_REL')
+
+    return SolverConfiguration(
+        name=os.environ.get('HYDROGEN_SOLVER') or None,
+        threads=int(threads) if threads else None,
+        timeLimit=parseTimeLimit(time_limit),
+        gapRel=float(gap_rel) if gap_rel else None)
+
+
+# service-level solver configuration, with any options given in the
+#  request taking precedence
+def getSolverConfiguration(request):
+    solver_config = getServiceSolverConfiguration()
+    if request.config.solver is None:
+        return solver_config
+    return solver_config.copy(update=request.config.solver.dict(exclude_none=True))
+
+
+def getSolverName(solver_config):
+    if solver_config.name is None:
+        return pulp.LpSolverDefault.name
+    return SOLVER_ALIASES.get(solver_config.name.upper(), solver_config.name)
+
+
+# if warm_start is set, solvers that support it will start from the
+#  initial values of the model's variables (other solvers ignore them)
+def getPulpSolver(solver_config, warm_start=False):
+    name = getSolverName(solver_config)
+
+    options = {}
+    if warm_start and name in WARM_START_SOLVERS:
+        options['warmStart'] = True
+    if solver_config.threads is not None:
+        options['threads'] = solver_config.threads
+    if solver_config.timeLimit is not None:
+        options['timeLimit'] = solver_config.timeLimit
+    if solver_config.gapRel is not None:
+        options['gapRel'] = solver_config.gapRel
+
+    try:
+        solver = pulp.getSolver(name, **options)
+    except pulp.PulpSolverError:
+        raise SolverError(f'unknown solver: {name}')
+
+    if not solver.available():
+        raise SolverError(f'solver is not available: {name}')
+
+    return solver
+
+
+# options for scipy.optimize.milp, used by the matrix model builder
+#  (scipy does not expose the number of threads used by HiGHS, so
+#  solver_config.threads is ignored)
+def getMatrixSolverOptions(request):
+    solver_config = getSolverConfiguration(request)
+
+    # the service-level solver name only applies to the PuLP model builder
+    requested_solver = request.config.solver
+    if requested_solver is not None and requested_solver.name is not None:
+        if getSolverName(requested_solver) != MATRIX_SOLVER_NAME:
+            raise SolverError(f'the matrix model builder can only use the {MATRIX_SOLVER_NAME} solver')
+
+    options = {}
+    if solver_config.timeLimit is not None:
+        options['time_limit'] = solver_config.timeLimit
+    if solver_config.gapRel is not None:
+        options['mip_rel_gap'] = solver_config.gapRel
+    return options
+
+
+# objective, relative MIP gap and number of branch and bound nodes
+#  from the log written by CBC, where it reports them
+def parseCbcLog(log):
+    info = { 'objective': None, 'mipGap': None, 'nodes': None }
+
+    objective = re.search(r'^Objective value:\s+(\S+)', log, re.MULTILINE)
+    if objective:
+        info['objective'] = float(objective.group(1))
+
+    nodes = re.search(r'^Enumerated nodes:\s+(\d+)', log, re.MULTILINE)
+    if nodes:
+        info['nodes'] = int(nodes.group(1))
+
+    # CBC rounds the gap it reports, so calculate it from the bound
+    bound = re.search(r'^Lower bound:\s+(\S+)', log, re.MULTILINE)
+    if bound and info['objective'] is not None:
+        info['mipGap'] = getRelativeGap(info['objective'], float(bound.group(1)))
+    elif re.search(r'^Result - Optimal solution found', log, re.MULTILINE):
+        info['mipGap'] = 0.0
+
+    return info
+
+
+# objective, relative MIP gap and number of branch and bound nodes
+#  from a highspy.Highs instance after it has solved a model
+def getHighsSolveInfo(highs):
+    info = highs.getInfo()
+    return {
+        'objective': highs.getObjectiveValue(),
+        'mipGap': info.mip_gap if info.mip_node_count >= 0 else None,
+        'nodes': info.mip_node_count if info.mip_node_count >= 0 else None
+    }
+
+
+def getRelativeGap(objective, bound):
+    return abs(objective - bound) / max(abs(objective), 1e-10)
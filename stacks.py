@@ -0,0 +1,104 @@
+import numpy as np
+from scipy.sparse import block_diag, coo_matrix, vstack
+
+from app.feasibility import calculateStorageBounds
+from app.lpmodel import ModelSolution, getForecastColumns
+from app.matrixmodel import MatrixModel, buildMatrixModel, solveMatrixModel
+from app.metrics import timePhase
+from app.solvers import MATRIX_SOLVER_NAME, getMatrixSolverOptions
+
+#
+# plants with several electrolyser stacks
+#
+# with config.stacks, the "optimal" simulation plans the power used by each
+#  stack, and whether it is on, in each period. every stack has its own
+#  limits (those of productionLimits - max production, production factor,
+#  min production rate, ramp limit, and initial and final power), while the
+#  wind power available and the hydrogen storage are shared by all of them
+#
+# the model of each stack is built by matrixmodel.buildMatrixModel, from
+#  the request with the stack's limits in place of productionLimits, so its
+#  columns are the same four blocks of one column per period - gridPower,
+#  windPower, onOff and cumulativePower. the stacks' models are placed along
+#  the diagonal of a sparse block matrix, with the columns of each stack in
+#  turn, and two rows per period are added across the stacks:
+#   1   - the wind power used by all the stacks is no more than the forecast
+#         renewable generation
+#   3,4 - the hydrogen produced by all the stacks since the start of the
+#         simulation (the cumulativePower of each stack, times its production
+#         factor) keeps storage within its limits, in place of the bounds on
+#         the cumulativePower of each stack's model
+#
+# so the model is assembled from a handful of array operations per stack,
+#  whatever the number of periods. the model is always solved with HiGHS,
+#  whatever the modelBuilder of the request, and with productionLimits only
+#  used for the hypotheticalWindOnly simulation
+#
+
+
+# the request with the limits of a single stack in place of productionLimits
+def createStackRequest(request, stack):
+    return request.copy(update={ 'config': request.config.copy(update={ 'productionLimits': stack, 'stacks': None }) })
+
+
+# the model of every stack in one MatrixModel, with the columns of each
+#  stack in turn (in the same blocks as matrixmodel.buildMatrixModel)
+def buildStackModel(request):
+    stacks = request.config.stacks
+    periods = request.config.range.periods
+    stack_models = [ buildMatrixModel(createStackRequest(request, stack)) for stack in stacks ]
+    columns = 4 * periods
+    stack_count = len(stacks)
+
+    c = np.concatenate([ model.c for model in stack_models ])
+    integrality = np.concatenate([ model.integrality for model in stack_models ])
+    lb = np.concatenate([ model.lb for model in stack_models ])
+    ub = np.concatenate([ model.ub for model in stack_models ])
+
+    # the storage limits apply to the stacks together, rather than each one
+    blocks = (lb.reshape(stack_count, 4, periods), ub.reshape(stack_count, 4, periods))
+    blocks[0][:, 3, :] = 0
+    blocks[1][:, 3, :] = np.inf
+
+    period = np.tile(np.arange(periods), stack_count)
+    stack_col = np.repeat(np.arange(stack_count) * columns, periods)
+    shape = (periods, columns * stack_count)
+
+    # constraint 1: don't use more wind power than the forecast says will be available
+    wind_rows = coo_matrix((np.ones(len(period)), (period, stack_col + periods + period)), shape=shape)
+    renewable_generation = np.asarray(getForecastColumns(request.forecasts)['renewableGeneration'], dtype=float)
+
+    # constraints 3 and 4: hydrogen produced to keep storage within its limits
+    production_factors = np.repeat([ stack.productionFactor for stack in stacks ], periods).astype(float)
+    storage_rows = coo_matrix((production_factors, (period, stack_col + 3 * periods + period)), shape=shape)
+    min_production, max_production = calculateStorageBounds(request, production_factor=1)
+
+    A = vstack([ block_diag([ model.A for model in stack_models ], format='csr'), wind_rows, storage_rows ], format='csr')
+    row_lb = np.concatenate([ model.row_lb for model in stack_models ] + [ np.full(periods, -np.inf), min_production ])
+    row_ub = np.concatenate([ model.row_ub for model in stack_models ] + [ renewable_generation, max_production ])
+
+    return MatrixModel(periods, c, integrality, lb, ub, A, row_lb, row_ub)
+
+
+# the model outputs from the solution vector, with a row per stack, as
+#  used by lpmodel.buildSimulationOutput
+def getStackModelSolution(matrix_model, solution):
+    periods = matrix_model.periods
+    if solution is None:
+        solution = np.zeros(len(matrix_model.c))
+
+    blocks = solution.reshape(-1, 4, periods)
+    return ModelSolution(
+        gridPower=blocks[:, 0],
+        windPower=blocks[:, 1],
+        onOff=np.round(blocks[:, 2]))
+
+
+def runStackModel(request, stats=None):
+    options = getMatrixSolverOptions(request)
+    with timePhase(stats, 'build'):
+        matrix_model = buildStackModel(request)
+    solution, model_status = solveMatrixModel(matrix_model, options, stats)
+    with timePhase(stats, 'extract'):
+        model_solution = getStackModelSolution(matrix_model, solution)
+    return model_solution, model_status, MATRIX_SOLVER_NAME
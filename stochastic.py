@@ -0,0 +1,188 @@
+import numpy as np
+from scipy.sparse import coo_matrix, identity, kron, vstack
+
+from app.electricity import ColumnarForecast, ForecastColumns
+from app.feasibility import checkFeasibility
+from app.lpmodel import PLAN_STATUSES, buildSimulationOutput, getForecastColumns
+from app.matrixmodel import MatrixModel, buildMatrixModel, getMatrixModelSolution, solveMatrixModel
+from app.metrics import createSolveStats, metricsRegistry, timePhase
+from app.solvers import MATRIX_SOLVER_NAME, getMatrixSolverOptions
+
+#
+# stochastic optimisation over an ensemble of renewable generation forecasts
+#
+# rather than a single renewableGeneration series, a request
+#  (electricity.ForecastEnsemble) can give the members of a forecast
+#  ensemble. the plan for the first firstStagePeriods periods - the power
+#  used and whether the electrolyser is on - has to be made now, so is the
+#  same whatever the renewable generation turns out to be, while the plan
+#  for the rest of the periods can differ between members. the plans are
+#  chosen to minimise the expected cost over the members
+#
+# a scenario for every member would multiply the size of the model by the
+#  size of the ensemble, so the members are first clustered (by weighted
+#  k-means over their renewable generation) into a few scenarios, each
+#  solved for the member closest to the centre of its cluster, with the
+#  total probability of the members in the cluster
+#
+# only the wind power bounds differ between scenarios, so the model is built
+#  once by matrixmodel.buildMatrixModel, then repeated along the diagonal of
+#  a sparse block matrix, one block per scenario, with rows tying the first
+#  stage periods of each scenario to those of the first. the model is always
+#  solved with HiGHS, whatever the modelBuilder of the request
+#
+
+# number of scenarios the ensemble is clustered into, unless the
+#  request asks for a different number
+DEFAULT_SCENARIOS = 10
+
+# most rounds of k-means to run when clustering the members
+MAX_CLUSTERING_ITERATIONS = 100
+
+
+# cluster the members of an ensemble into (at most) k scenarios, returning
+#  a list of (probability, representative, members) per scenario, where
+#  members are positions in the ensemble and the representative is the
+#  member closest to the centre of the cluster
+def reduceScenarios(members, probabilities, k):
+    members = np.asarray(members, dtype=float)
+    probabilities = np.asarray(probabilities, dtype=float)
+    if k >= len(members):
+        return [ (float(probability), i, [ i ]) for i, probability in enumerate(probabilities) ]
+
+    # start from the most probable member, then repeatedly add the member
+    #  furthest from the centres so far (so the result is deterministic)
+    centres = members[[ int(np.argmax(probabilities)) ]]
+    for _ in range(k - 1):
+        distances = ((members[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        centres = np.vstack([ centres, members[np.argmax(distances * probabilities)] ])
+
+    labels = None
+    for _ in range(MAX_CLUSTERING_ITERATIONS):
+        distances = ((members[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)
+        new_labels = np.argmin(distances, axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for cluster in range(len(centres)):
+            in_cluster = labels == cluster
+            weight = probabilities[in_cluster].sum()
+            if weight > 0:
+                centres[cluster] = probabilities[in_cluster] @ members[in_cluster] / weight
+
+    scenarios = []
+    for cluster in range(len(centres)):
+        cluster_members = np.flatnonzero(labels == cluster)
+        if len(cluster_members) == 0:
+            continue
+        representative = cluster_members[np.argmin(distances[cluster_members, cluster])]
+        scenarios.append((float(probabilities[cluster_members].sum()), int(representative), cluster_members.tolist()))
+    return sorted(scenarios, key=lambda scenario: scenario[2][0])
+
+
+# the scenarios to solve a request for, as returned by reduceScenarios
+def getScenarios(request):
+    ensemble = request.ensemble
+    members = len(ensemble.members)
+    probabilities = ensemble.probabilities or [ 1 / members ] * members
+    return reduceScenarios(ensemble.members, probabilities, ensemble.scenarios or DEFAULT_SCENARIOS)
+
+
+# the model of every scenario in one MatrixModel, with the columns of each
+#  scenario in turn (in the same blocks as matrixmodel.buildMatrixModel)
+def buildStochasticModel(request, scenarios):
+    model = buildMatrixModel(request)
+    periods = model.periods
+    columns = len(model.c)
+    first_stage_periods = request.ensemble.firstStagePeriods
+    scenario_count = len(scenarios)
+
+    # objective - the expected cost over the scenarios
+    probabilities = np.array([ probability for probability, _, _ in scenarios ])
+    c = np.kron(probabilities, model.c)
+    integrality = np.tile(model.integrality, scenario_count)
+    lb = np.tile(model.lb, scenario_count)
+    ub = np.tile(model.ub, scenario_count)
+
+    # constraint 1 for each scenario: don't use more wind power than its
+    #  representative member says will be available
+    generation = np.asarray(request.ensemble.members, dtype=float)[[ representative for _, representative, _ in scenarios ]]
+    ub.reshape(scenario_count, 4, periods)[:, 1, :] = generation
+
+    # the first stage periods of each scenario use the same power, and have
+    #  the electrolyser on or off, as those of the first scenario
+    scenario = np.repeat(np.arange(1, scenario_count), first_stage_periods)
+    period = np.tile(np.arange(first_stage_periods), scenario_count - 1)
+    row = np.arange(len(scenario))
+    ones = np.ones(len(scenario))
+    power_rows = coo_matrix((
+        np.concatenate([ ones, ones, -ones, -ones ]),
+        (np.concatenate([ row, row, row, row ]),
+         np.concatenate([ scenario * columns + period, scenario * columns + periods + period, period, periods + period ]))),
+        shape=(len(row), columns * scenario_count))
+    on_off_rows = coo_matrix((
+        np.concatenate([ ones, -ones ]),
+        (np.concatenate([ row, row ]),
+         np.concatenate([ scenario * columns + 2 * periods + period, 2 * periods + period ]))),
+        shape=(len(row), columns * scenario_count))
+
+    A = vstack([ kron(identity(scenario_count, format='csr'), model.A), power_rows, on_off_rows ], format='csr')
+    row_lb = np.concatenate([ np.tile(model.row_lb, scenario_count), np.zeros(2 * len(row)) ])
+    row_ub = np.concatenate([ np.tile(model.row_ub, scenario_count), np.zeros(2 * len(row)) ])
+
+    return MatrixModel(periods, c, integrality, lb, ub, A, row_lb, row_ub)
+
+
+# the request with the renewable generation of a member of the ensemble
+def createScenarioRequest(request, forecasts, member):
+    return ColumnarForecast(config=request.config, forecasts=ForecastColumns(**dict(forecasts, renewableGeneration=request.ensemble.members[member])))
+
+
+# solve the request for every scenario of its ensemble, returning the
+#  output described by electricity.StochasticSimulationOutput
+#
+# raises feasibility.InfeasibleRequestError, without building the model,
+#  if no plan can meet the request (which doesn't depend on the renewable
+#  generation, as grid power isn't limited)
+def runStochasticSimulations(request, stats=None):
+    if stats is None:
+        stats = createSolveStats()
+
+    with timePhase(stats, 'feasibility'):
+        checkFeasibility(request)
+
+    with timePhase(stats, 'build'):
+        scenarios = getScenarios(request)
+        model = buildStochasticModel(request, scenarios)
+    solution, model_status = solveMatrixModel(model, getMatrixSolverOptions(request), stats)
+
+    forecasts = getForecastColumns(request.forecasts)
+    columns = len(model.c) // len(scenarios)
+    scenario_outputs = []
+    expected_cost = 0
+    for i, (probability, representative, members) in enumerate(scenarios):
+        scenario_request = createScenarioRequest(request, forecasts, representative)
+        with timePhase(stats, 'extract'):
+            scenario_solution = getMatrixModelSolution(model, None if solution is None else solution[i * columns:(i + 1) * columns])
+        output = buildSimulationOutput(scenario_request, scenario_solution, model_status, MATRIX_SOLVER_NAME, columnar=True, stats=stats)
+        expected_cost += probability * sum(output['simulations']['optimal']['electricityCost']['total'])
+        scenario_outputs.append({
+            'probability': probability,
+            'representative': representative,
+            'members': members,
+            'simulations': output['simulations']
+        })
+
+    stats['status'] = model_status
+    stats['solver'] = MATRIX_SOLVER_NAME
+    metricsRegistry.recordSolve(stats)
+
+    return {
+        'scenarios': scenario_outputs,
+        'firstStagePeriods': request.ensemble.firstStagePeriods,
+        'expectedCost': expected_cost if model_status in PLAN_STATUSES else None,
+        'statusOfOptimalModel': model_status,
+        'solverOfOptimalModel': MATRIX_SOLVER_NAME,
+        'mipGapOfOptimalModel': output['mipGapOfOptimalModel'],
+        'units': output['units']
+    }
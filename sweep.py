@@ -0,0 +1,184 @@
+import itertools
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from app.batch import getBatchWorkers, getChunks, resetBatchExecutor, submitBatchTasks
+from app.electricity import ColumnarForecast, ForecastColumns
+from app.feasibility import InfeasibleRequestError, checkFeasibility
+from app.lpmodel import FEASIBLE_STATUS, HEURISTIC_STATUS, PLAN_STATUSES, buildOptimalModel, calculateSimulationResult, getForecastColumns, getProductionFactor, getPulpModelSolution, runOptimalSimulation, solveOptimalModel, updateOptimalModel
+from app.metrics import createSolveStats
+from app.solvers import getPulpSolver, getSolverConfiguration, getSolverName
+
+#
+# parametric sweeps, to see how the cost of the "optimal" simulation
+#  changes with the storage limits and the price of grid electricity
+#
+# a request (electricity.ForecastSweep) is solved for every combination of
+#  the values of minStorageSetPoint, maxStorage and gridPriceScale given in
+#  its sweep config. these only change the right-hand side of the storage
+#  constraints and the grid price coefficients of the objective, so each
+#  worker builds the model once for its first point, then for each of the
+#  following points updates those coefficients (see lpmodel.updateOptimalModel)
+#  and warm-starts the solver from the plan for the previous point
+#
+# the points are split into contiguous runs, one per worker process, so that
+#  neighbouring points (whose plans are most alike) share a model. points that
+#  no plan could meet (see feasibility.py) are not solved at all. as in
+#  rolling.py, requests using the matrix model builder are solved from scratch
+#  for each point, as that model is cheap to build and scipy can't warm-start
+#  HiGHS, as are decomposed requests and those with several stacks
+#
+# the output is a table of the status and totals of the plan for each point
+#  (electricity.SweepOutput), rather than the plans themselves
+#
+
+# fields of the output table, in the order of the parameters of a point
+SWEEP_PARAMETERS = [ 'minStorageSetPoint', 'maxStorage', 'gridPriceScale' ]
+
+SWEEP_UNITS = {
+    'minStorageSetPoint': 'm^3',
+    'maxStorage': 'm^3',
+    'gridPriceScale': None,
+    'electricityCost': '£',
+    'electricityUsageWind': 'MWh',
+    'electricityUsageGrid': 'MWh',
+    'hydrogenProduced': 'm^3',
+    'finalHydrogenInStorage': 'm^3',
+    'periodsElectrolyserOn': None
+}
+
+
+# every combination of the swept parameters, as tuples in the
+#  order of SWEEP_PARAMETERS
+def getSweepPoints(request):
+    sweep = request.sweep
+    storage = request.config.storage
+    return list(itertools.product(
+        sweep.minStorageSetPoint or [ storage.minStorageSetPoint ],
+        sweep.maxStorage or [ storage.maxStorage ],
+        sweep.gridPriceScale or [ 1.0 ]))
+
+
+# the request for a single point of the sweep
+def createPointRequest(request, forecasts, point):
+    min_storage_set_point, max_storage, grid_price_scale = point
+    config = request.config.copy(update={
+        'storage': request.config.storage.copy(update={ 'minStorageSetPoint': min_storage_set_point, 'maxStorage': max_storage })
+    })
+    grid_price = (np.asarray(forecasts['gridPrice'], dtype=float) * grid_price_scale).tolist()
+    return ColumnarForecast(config=config, forecasts=ForecastColumns(**dict(forecasts, gridPrice=grid_price)))
+
+
+# whether each point is solved with a PuLP model
+def usesPulpModel(request):
+    return request.config.modelBuilder == 'pulp' and request.config.stacks is None
+
+
+def getSweepSolverName(request):
+    if not usesPulpModel(request):
+        # imported here so that scipy is only needed for this builder
+        from app.matrixmodel import MATRIX_SOLVER_NAME
+        return MATRIX_SOLVER_NAME
+    return getSolverName(getSolverConfiguration(request))
+
+
+# the status and totals of the plan for a point, as a row of the table
+def getPointRow(point, point_request, solution, model_status, stats, error=None):
+    row = dict(zip(SWEEP_PARAMETERS, point))
+    row['statusOfOptimalModel'] = model_status
+    row['mipGapOfOptimalModel'] = stats['mipGap'] if model_status in [ FEASIBLE_STATUS, HEURISTIC_STATUS ] else None
+    row['error'] = error
+
+    if model_status not in PLAN_STATUSES:
+        for field in [ 'electricityCost', 'electricityUsageWind', 'electricityUsageGrid', 'hydrogenProduced', 'finalHydrogenInStorage', 'periodsElectrolyserOn' ]:
+            row[field] = None
+        return row
+
+    config = point_request.config
+    result = calculateSimulationResult(solution,
+        config.range.periodDuration,
+        getProductionFactor(config),
+        config.storage.initialStorage,
+        config.storage.maxStorage,
+        getForecastColumns(point_request.forecasts))
+    row['electricityCost'] = float(result['electricityCostTotal'].sum())
+    row['electricityUsageWind'] = float(result['electricityUsageWind'].sum())
+    row['electricityUsageGrid'] = float(result['electricityUsageGrid'].sum())
+    row['hydrogenProduced'] = float(result['hydrogenProducedTotal'].sum())
+    row['finalHydrogenInStorage'] = float(result['hydrogenInStorage'][-1])
+    row['periodsElectrolyserOn'] = int(result['electrolyserOn'].sum())
+    return row
+
+
+# solve a run of points of the sweep, in order, with one model
+#  (runs in the worker processes)
+def solveSweepPoints(request, points):
+    forecasts = getForecastColumns(request.forecasts)
+    reuse_model = usesPulpModel(request) and request.config.decomposition is None
+
+    rows = []
+    model = None
+    warm_start = False
+    for point in points:
+        point_request = createPointRequest(request, forecasts, point)
+        stats = createSolveStats()
+        try:
+            checkFeasibility(point_request)
+        except InfeasibleRequestError as error:
+            rows.append(getPointRow(point, point_request, None, 'Infeasible', stats, str(error)))
+            continue
+
+        if not reuse_model:
+            solution, model_status, _ = runOptimalSimulation(point_request, stats)
+            rows.append(getPointRow(point, point_request, solution, model_status, stats))
+            continue
+
+        if model is None:
+            model, gridPower, windPower, onOff = buildOptimalModel(point_request)
+        else:
+            updateOptimalModel(model, gridPower, windPower, point_request)
+
+        # the variables still hold the plan for the previous point, which
+        #  the solver starts from
+        solver = getPulpSolver(getSolverConfiguration(point_request), warm_start=warm_start)
+        model_status = solveOptimalModel(model, gridPower, windPower, onOff, solver, stats)
+        solution = getPulpModelSolution(gridPower, windPower, onOff)
+        rows.append(getPointRow(point, point_request, solution, model_status, stats))
+
+        warm_start = model_status in PLAN_STATUSES
+        if not warm_start:
+            for var in model.variables():
+                var.varValue = None
+
+    return rows
+
+
+# solve the request for every point of its sweep, returning the
+#  table of results (electricity.SweepOutput)
+def runSweepSimulations(request):
+    points = getSweepPoints(request)
+    # split into at most this many runs, solved in the shared pool of
+    #  worker processes (see batch.py)
+    workers = min(request.sweep.workers or getBatchWorkers(), len(points))
+    # fails early if the solver isn't available
+    solver_name = getSweepSolverName(request)
+    if usesPulpModel(request):
+        getPulpSolver(getSolverConfiguration(request))
+
+    if workers <= 1:
+        rows = solveSweepPoints(request, points)
+    else:
+        executor, futures = submitBatchTasks(solveSweepPoints, [ (request, run) for run in getChunks(points, workers) ])
+        try:
+            rows = [ row for future in futures for row in future.result() ]
+        except BrokenProcessPool:
+            # a worker process died, so start a new pool for the next batch
+            resetBatchExecutor(executor)
+            raise
+
+    return {
+        'table': { field: [ row[field] for row in rows ] for field in rows[0] },
+        'solverOfOptimalModel': solver_name,
+        'units': dict(SWEEP_UNITS)
+    }
@@ -0,0 +1,87 @@
+import pydantic
+import unittest
+from unittest import mock
+from app.batch import getBatchExecutor, getChunks, runBatchSimulations
+from app.cache import ResultCache
+from app.decomposition import solveSubRequests
+from app.electricity import Forecast, SimulationOutput, SolverConfiguration
+from app.metrics import MetricsRegistry
+
+
+def load_input(fixture):
+    return pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+
+
+def load_expected_output(fixture):
+    return pydantic.parse_file_as(path='app/test/' + fixture + '/expected-output.json', type_=SimulationOutput).dict()
+
+
+class BatchSimulationsTest(unittest.TestCase):
+
+    def check_batch(self, workers):
+        fixtures = [ '24-hours', '30-minutes', '48-hours', '60-minutes' ]
+        requests = [ load_input(fixture) for fixture in fixtures ]
+
+        # a failing request in the middle of the batch
+        failing_request = load_input('30-minutes')
+        failing_request.config.solver = SolverConfiguration(name='NOT_A_SOLVER')
+        requests.insert(2, failing_request)
+
+        # solves are recorded in this process, wherever they ran
+        registry = MetricsRegistry()
+        with mock.patch('app.batch.metricsRegistry', registry), mock.patch('app.lpmodel.metricsRegistry', registry):
+            results = runBatchSimulations(requests, cache=ResultCache(max_entries=0), workers=workers)
+        assert len(results) == 5
+        assert 4 == sum(registry.runs.values())
+
+        assert results[2]['output'] is None
+        assert 'NOT_A_SOLVER' in results[2]['error']
+
+        for fixture, result in zip(fixtures, results[:2] + results[3:]):
+            assert result['error'] is None
+            assert load_expected_output(fixture) == result['output']
+
+    def test_batch_in_parallel(self):
+        self.check_batch(workers=2)
+
+    def test_batch_in_process(self):
+        self.check_batch(workers=1)
+
+    def test_identical_requests_solved_once(self):
+        cache = ResultCache()
+        results = runBatchSimulations([ load_input('24-hours'), load_input('24-hours') ], cache=cache, workers=2)
+        assert results[0]['output'] == results[1]['output']
+        assert results[0]['output'] is not results[1]['output']
+        assert cache.stats()['misses'] == 2
+        assert cache.stats()['entries'] == 1
+
+    def test_cached_requests_not_solved(self):
+        cache = ResultCache()
+        runBatchSimulations([ load_input('24-hours') ], cache=cache, workers=2)
+        results = runBatchSimulations([ load_input('24-hours'), load_input('30-minutes') ], cache=cache, workers=2)
+        assert cache.stats()['hits'] == 1
+        assert load_expected_output('24-hours') == results[0]['output']
+        assert load_expected_output('30-minutes') == results[1]['output']
+
+
+class BatchExecutorTest(unittest.TestCase):
+
+    def test_pool_is_shared(self):
+        runBatchSimulations([ load_input('24-hours'), load_input('30-minutes') ], cache=ResultCache(max_entries=0), workers=2)
+        executor = getBatchExecutor()
+        runBatchSimulations([ load_input('24-hours'), load_input('30-minutes') ], cache=ResultCache(max_entries=0), workers=3)
+        solveSubRequests([ load_input('24-hours'), load_input('30-minutes') ], workers=5)
+        assert executor is getBatchExecutor()
+
+    def test_shut_down_pool_is_replaced(self):
+        # as if another request found the pool broken and shut it down
+        executor = getBatchExecutor()
+        executor.shutdown()
+        results = runBatchSimulations([ load_input('24-hours'), load_input('30-minutes') ], cache=ResultCache(max_entries=0), workers=2)
+        assert [ None, None ] == [ result['error'] for result in results ]
+        assert executor is not getBatchExecutor()
+
+    def test_chunks(self):
+        assert [ [ 1, 2 ], [ 3, 4 ], [ 5 ] ] == getChunks([ 1, 2, 3, 4, 5 ], 3)
+        assert [ [ 1 ], [ 2 ] ] == getChunks([ 1, 2 ], 5)
+        assert [ [ 1, 2, 3 ] ] == getChunks([ 1, 2, 3 ], 1)
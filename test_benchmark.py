@@ -0,0 +1,43 @@
+import unittest
+from app.benchmark import applyLimits, benchmarkSimulation, generateForecast
+
+
+class GenerateForecastTest(unittest.TestCase):
+
+    def test_periods_for_resolution(self):
+        for resolution_minutes, periods in [ (5, 288), (15, 96), (30, 48), (60, 24) ]:
+            request = generateForecast(1, resolution_minutes)
+            assert periods == request.config.range.periods == len(request.forecasts)
+            assert resolution_minutes / 60 == request.config.range.periodDuration
+
+    def test_same_daily_demand_at_any_resolution(self):
+        daily_demand = [ sum(item.hydrogenDemand for item in generateForecast(1, resolution_minutes).forecasts)
+                         for resolution_minutes in [ 15, 30 ] ]
+        assert abs(daily_demand[0] - daily_demand[1]) < 1e-6
+
+    def test_limits(self):
+        request = generateForecast(1, 30)
+        applyLimits(request, { 'exactMinProduction': True, 'maxPowerChangePh': 4, 'minProductionRate': 0.5, 'storageWindow': 300 })
+        assert request.config.exactMinProduction
+        assert 4 == request.config.productionLimits.maxPowerChangePh
+        assert 0.5 == request.config.productionLimits.minProductionRate
+        storage = request.config.storage
+        assert 300 == storage.maxStorage - storage.minStorageSetPoint
+        assert storage.initialStorage <= storage.maxStorage
+
+        # the fixture's limits are kept if none are given
+        request = generateForecast(1, 30)
+        applyLimits(request, None)
+        assert generateForecast(1, 30) == request
+
+
+class BenchmarkSimulationTest(unittest.TestCase):
+
+    def test_fixture(self):
+        case = { 'fixture': '24-hours', 'days': None, 'resolutionMinutes': None, 'model': 'cumulative', 'solver': 'CBC', 'timeLimit': 30 }
+        result = benchmarkSimulation(case)
+        assert 'Optimal' == result['status']
+        assert 48 == result['periods']
+        assert 200 == result['httpStatus']
+        for field in [ 'buildSeconds', 'solveSeconds', 'extractSeconds', 'postProcessSeconds', 'httpSeconds' ]:
+            assert result[field] >= 0
@@ -0,0 +1,123 @@
+import json
+import os
+import pydantic
+import tempfile
+import unittest
+from unittest import mock
+from app.cache import ResultCache, getCacheKey, runCachedSimulations
+from app.lpmodel import runSimulations
+from app.electricity import Forecast, SolverConfiguration
+
+
+def load_input(fixture='24-hours'):
+    return pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_same_key_for_equivalent_requests(self):
+        input = load_input()
+        with open('app/test/24-hours/sample-input.json') as input_file:
+            raw_input = json.load(input_file)
+        # same values, but with keys in a different order and floats for ints
+        reordered = Forecast.parse_obj({
+            'forecasts': [ { key: float(value) if key == 'gridPrice' else value for key, value in reversed(list(item.items())) }
+                           for item in raw_input['forecasts'] ],
+            'config': raw_input['config']
+        })
+        assert getCacheKey(input) == getCacheKey(reordered)
+
+    def test_different_key_for_different_forecasts(self):
+        input = load_input()
+        changed = load_input()
+        changed.forecasts[-1].gridPrice += 0.01
+        assert getCacheKey(input) != getCacheKey(changed)
+
+    def test_different_key_for_different_solver(self):
+        input = load_input()
+        changed = load_input()
+        changed.config.solver = SolverConfiguration(name='HiGHS')
+        assert getCacheKey(input) != getCacheKey(changed)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def test_cached_output_served_without_solving(self):
+        cache = ResultCache()
+        expected_output = runCachedSimulations(load_input(), cache)
+
+        with mock.patch('app.cache.runSimulations') as run:
+            output = runCachedSimulations(load_input(), cache)
+            run.assert_not_called()
+
+        assert expected_output == output
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_cached_output_is_a_copy(self):
+        cache = ResultCache()
+        output = runCachedSimulations(load_input(), cache)
+        output['simulations'].clear()
+        assert runCachedSimulations(load_input(), cache)['simulations']
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        cache.put('a', { 'value': 1 })
+        cache.put('b', { 'value': 2 })
+        cache.get('a')
+        cache.put('c', { 'value': 3 })
+
+        assert cache.get('b') is None
+        assert cache.get('a') == { 'value': 1 }
+        assert cache.get('c') == { 'value': 3 }
+        assert cache.stats()['evictions'] == 1
+
+    def test_ttl_expiry(self):
+        cache = ResultCache(ttl=60)
+        with mock.patch('app.cache.time.time', return_value=1000):
+            cache.put('a', { 'value': 1 })
+        with mock.patch('app.cache.time.time', return_value=1059):
+            assert cache.get('a') == { 'value': 1 }
+        with mock.patch('app.cache.time.time', return_value=1061):
+            assert cache.get('a') is None
+
+    def test_disk_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory=directory)
+            expected_output = runCachedSimulations(load_input('30-minutes'), cache)
+
+            restarted_cache = ResultCache(directory=directory)
+            with mock.patch('app.cache.runSimulations') as run:
+                output = runCachedSimulations(load_input('30-minutes'), restarted_cache)
+                run.assert_not_called()
+
+            assert expected_output == output
+            assert restarted_cache.stats()['diskHits'] == 1
+
+    def test_disk_tier_is_limited(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(ttl=60, directory=directory, max_disk_entries=2)
+            for i, key in enumerate([ 'a', 'b', 'c' ]):
+                with mock.patch('app.cache.time.time', return_value=1000 + i):
+                    cache.put(key, { 'value': i })
+            # the oldest entry is removed from disk
+            assert [ 'b.json', 'c.json' ] == sorted(os.listdir(directory))
+            assert cache.stats()['diskEvictions'] == 1
+
+            # expired entries are removed when the cache is created
+            with mock.patch('app.cache.time.time', return_value=1061):
+                ResultCache(ttl=60, directory=directory, max_disk_entries=2)
+            assert [ 'c.json' ] == os.listdir(directory)
+
+    def test_disabled_cache(self):
+        cache = ResultCache(max_entries=0)
+        runCachedSimulations(load_input('30-minutes'), cache)
+        assert cache.stats()['entries'] == 0
+
+    def test_non_optimal_output_not_cached(self):
+        cache = ResultCache()
+        input = load_input()
+        with mock.patch('app.cache.runSimulations', side_effect=lambda *args, **kwargs: { **runSimulations(*args, **kwargs), 'statusOfOptimalModel': 'Not Solved' }):
+            output = runCachedSimulations(input, cache)
+        assert output['statusOfOptimalModel'] != 'Optimal'
+        assert cache.stats()['entries'] == 0
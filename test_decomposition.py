@@ -0,0 +1,104 @@
+import numpy as np
+import pydantic
+import unittest
+from unittest import mock
+from app.decomposition import aggregateForecasts, getSeams, solveSubRequests
+from app.lpmodel import runSimulations
+from app.electricity import MAX_REQUEST_WORKERS, DecompositionConfiguration, Forecast, SimulationOutput
+
+
+def load_input(fixture, aggregate_periods, window_periods, model_builder='pulp'):
+    input = pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+    input.config.modelBuilder = model_builder
+    input.config.decomposition = DecompositionConfiguration(aggregatePeriods=aggregate_periods, windowPeriods=window_periods, workers=1)
+    return input
+
+
+class AggregateForecastsTest(unittest.TestCase):
+
+    def test_aggregate_forecasts(self):
+        forecasts = {
+            'timestamp': [ 'a', 'b', 'c', 'd', 'e' ],
+            'renewableGeneration': [ 1, 2, 3, 4, 5 ],
+            'hydrogenDemand': [ 10, 20, 30, 40, 50 ],
+            'gridPrice': [ 100, 200, 300, 400, 500 ],
+            'renewablePrice': [ 1, 1, 3, 3, 7 ]
+        }
+        aggregated = aggregateForecasts(forecasts, 2)
+        assert [ 'a', 'c', 'e' ] == aggregated['timestamp']
+        assert [ 3, 7, 5 ] == aggregated['renewableGeneration']
+        assert [ 30, 70, 50 ] == aggregated['hydrogenDemand']
+        assert [ 150, 350, 500 ] == aggregated['gridPrice']
+        assert [ 1, 3, 7 ] == aggregated['renewablePrice']
+
+    def test_workers_are_bounded(self):
+        for workers in [ 0, MAX_REQUEST_WORKERS + 1 ]:
+            with self.assertRaises(pydantic.ValidationError):
+                DecompositionConfiguration(aggregatePeriods=2, windowPeriods=4, workers=workers)
+
+    def test_window_must_be_a_multiple_of_aggregate(self):
+        with self.assertRaises(pydantic.ValidationError):
+            DecompositionConfiguration(aggregatePeriods=4, windowPeriods=10)
+
+    def test_seams_around_window_boundaries(self):
+        input = load_input('48-hours', 2, 40)
+        assert [ (30, 50), (70, 90) ] == getSeams(input)
+
+
+class DecomposedModelTest(unittest.TestCase):
+
+    def check_decomposed_model(self, fixture, aggregate_periods, window_periods, model_builder='pulp'):
+        input = load_input(fixture, aggregate_periods, window_periods, model_builder)
+        output = runSimulations(input)
+        expected_output = pydantic.parse_file_as(path='app/test/' + fixture + '/expected-output.json', type_=SimulationOutput).dict()
+
+        SimulationOutput.parse_obj(output)
+        assert 'Optimal' == output['statusOfOptimalModel']
+
+        # the plan can cost a little more than solving the whole forecast
+        expected_cost = expected_output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        cost = output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        assert cost >= expected_cost * (1 - 1e-4)
+        assert cost <= expected_cost * 1.01
+
+        # the plan must keep to the same constraints as the single model,
+        #  including across the boundaries between windows
+        config = input.config
+        power = np.array([ result['optimal']['electricityUsage']['total'] for result in output['simulations'] ])
+        storage = np.array([ result['optimal']['hydrogenInStorage'] for result in output['simulations'] ])
+        assert np.all(storage >= config.storage.minStorageSetPoint - 1e-3)
+        assert np.all(storage <= config.storage.maxStorage + 1e-3)
+        assert storage[-1] <= config.storage.initialStorage + 1e-3
+        assert np.all(np.abs(np.diff(power)) <= config.productionLimits.maxPowerChangePh * config.range.periodDuration + 1e-6)
+
+    def test_decomposed_48hours(self):
+        self.check_decomposed_model('48-hours', 2, 24)
+
+    def test_decomposed_48hours_uneven_windows(self):
+        self.check_decomposed_model('48-hours', 4, 40)
+
+    def test_decomposed_48hours_matrix(self):
+        self.check_decomposed_model('48-hours', 2, 24, 'matrix')
+
+    def test_single_window(self):
+        self.check_decomposed_model('24-hours', 2, 48)
+
+    def test_failed_seam(self):
+        input = load_input('48-hours', 2, 24)
+        calls = []
+
+        # the windows are solved first, then the seams
+        def solve_with_failed_seam(sub_requests, workers):
+            results = solveSubRequests(sub_requests, workers)
+            calls.append(len(sub_requests))
+            if len(calls) == 2:
+                solution, _, solver_name, stats = results[0]
+                results[0] = (solution, 'Infeasible', solver_name, stats)
+            return results
+
+        with mock.patch('app.decomposition.solveSubRequests', side_effect=solve_with_failed_seam):
+            output = runSimulations(input)
+        assert 2 == len(calls)
+        # the plan from the windows is kept around the failed seam
+        assert 'Optimal' == output['statusOfOptimalModel']
+        assert len(input.forecasts) == len(output['simulations'])
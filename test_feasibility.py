@@ -0,0 +1,80 @@
+import pydantic
+import unittest
+from unittest import mock
+from app.feasibility import MAX_CONSUMPTION_CONSTRAINT, MAX_STORAGE_CONSTRAINT, MIN_STORAGE_CONSTRAINT, InfeasibleRequestError, checkFeasibility
+from app.lpmodel import runSimulations
+from app.matrixmodel import runMatrixModel
+from app.electricity import Forecast
+
+
+def load_input(fixture='24-hours'):
+    return pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+
+
+class CheckFeasibilityTest(unittest.TestCase):
+
+    def check_infeasible(self, input):
+        with self.assertRaises(InfeasibleRequestError) as context:
+            checkFeasibility(input)
+        # the solver must agree that there's no plan
+        _, status, _ = runMatrixModel(input)
+        assert status == 'Infeasible'
+        return context.exception
+
+    def test_fixtures_are_feasible(self):
+        for fixture in [ '24-hours', '48-hours', '30-minutes' ]:
+            checkFeasibility(load_input(fixture))
+
+    def test_demand_spike_above_max_production(self):
+        input = load_input()
+        input.forecasts[30].hydrogenDemand = 2000
+        error = self.check_infeasible(input)
+        assert 30 == error.period
+        assert 'ignored-30' == error.timestamp
+        assert MIN_STORAGE_CONSTRAINT == error.constraint
+
+    def test_min_storage_above_max_storage(self):
+        input = load_input()
+        input.config.storage.minStorageSetPoint = 62000
+        error = self.check_infeasible(input)
+        assert 0 == error.period
+        assert MIN_STORAGE_CONSTRAINT == error.constraint
+
+    def test_final_storage_below_min_storage(self):
+        input = load_input()
+        input.config.storage.finalStorage = 59000
+        error = self.check_infeasible(input)
+        assert 47 == error.period
+        assert MIN_STORAGE_CONSTRAINT == error.constraint
+
+    def test_ramp_up_from_initial_power_too_slow(self):
+        input = load_input()
+        input.config.productionLimits.initialPower = 0
+        input.config.productionLimits.maxPowerChangePh = 0.01
+        error = self.check_infeasible(input)
+        assert 0 == error.period
+        assert MIN_STORAGE_CONSTRAINT == error.constraint
+
+    def test_ramp_down_from_initial_power_too_slow(self):
+        input = load_input()
+        input.config.productionLimits.initialPower = 2.2
+        input.config.storage.initialStorage = 60900
+        error = self.check_infeasible(input)
+        assert 0 == error.period
+        assert MAX_STORAGE_CONSTRAINT == error.constraint
+
+    def test_initial_power_above_max_consumption(self):
+        input = load_input()
+        input.config.productionLimits.initialPower = 10
+        error = self.check_infeasible(input)
+        assert 0 == error.period
+        assert MAX_CONSUMPTION_CONSTRAINT == error.constraint
+
+    def test_runs_without_building_the_model(self):
+        input = load_input()
+        input.config.storage.minStorageSetPoint = 62000
+        with mock.patch('app.lpmodel.buildOptimalModel') as buildOptimalModel:
+            with self.assertRaises(InfeasibleRequestError) as context:
+                runSimulations(input)
+        buildOptimalModel.assert_not_called()
+        assert { 'period': 0, 'timestamp': 'ignored-0', 'constraint': MIN_STORAGE_CONSTRAINT } == { field: value for field, value in context.exception.toDict().items() if field != 'message' }
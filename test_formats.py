@@ -0,0 +1,155 @@
+import json
+import pydantic
+import unittest
+from app.formats import ARROW, COLUMNAR_JSON, COLUMNAR_MSGPACK, EVENT_STREAM, JSON, NDJSON, STREAM_CHUNK_PERIODS, NotAcceptableError, UnsupportedMediaTypeError, decodeSimulationOutput, encodeSimulationOutput, isFormatAvailable, iterSimulationOutput, negotiateResponseFormat, parseForecast
+from app.lpmodel import runSimulations
+from app.electricity import ColumnarForecast, ColumnarSimulationOutput, Forecast, SimulationOutput
+
+
+def load_raw_input(fixture='24-hours'):
+    with open('app/test/' + fixture + '/sample-input.json') as input_file:
+        return json.load(input_file)
+
+
+# the same request as a fixture, with a list of values per forecast field
+def load_columnar_input(fixture='24-hours'):
+    raw_input = load_raw_input(fixture)
+    forecasts = raw_input['forecasts']
+    return {
+        'config': raw_input['config'],
+        'forecasts': { field: [ item[field] for item in forecasts ] for field in forecasts[0] }
+    }
+
+
+class NegotiateResponseFormatTest(unittest.TestCase):
+
+    def test_defaults_to_json(self):
+        assert JSON == negotiateResponseFormat(None)
+        assert JSON == negotiateResponseFormat('*/*')
+        assert JSON == negotiateResponseFormat('application/json')
+
+    def test_columnar_json(self):
+        assert COLUMNAR_JSON == negotiateResponseFormat('application/vnd.hydrogen.columnar+json, application/json;q=0.5')
+
+    def test_prefers_highest_quality(self):
+        assert JSON == negotiateResponseFormat('application/vnd.hydrogen.columnar+json;q=0.5, application/json')
+
+    def test_skips_unsupported_types(self):
+        assert COLUMNAR_JSON == negotiateResponseFormat('text/csv, application/vnd.hydrogen.columnar+json;q=0.1')
+
+    def test_streaming(self):
+        assert NDJSON == negotiateResponseFormat('application/x-ndjson')
+        assert EVENT_STREAM == negotiateResponseFormat('text/event-stream')
+
+    def test_not_acceptable(self):
+        with self.assertRaises(NotAcceptableError):
+            negotiateResponseFormat('text/csv')
+        with self.assertRaises(NotAcceptableError):
+            negotiateResponseFormat('application/json;q=0')
+
+
+class ParseForecastTest(unittest.TestCase):
+
+    def test_json(self):
+        body = json.dumps(load_raw_input()).encode('utf-8')
+        assert isinstance(parseForecast(body, 'application/json; charset=utf-8'), Forecast)
+        assert isinstance(parseForecast(body, None), Forecast)
+
+    def test_columnar_json(self):
+        body = json.dumps(load_columnar_input()).encode('utf-8')
+        input = parseForecast(body, COLUMNAR_JSON)
+        assert isinstance(input, ColumnarForecast)
+        assert 48 == len(input.forecasts.timestamp)
+
+    def test_columns_must_be_the_same_length(self):
+        columnar_input = load_columnar_input()
+        columnar_input['forecasts']['gridPrice'].pop()
+        with self.assertRaises(pydantic.ValidationError):
+            parseForecast(json.dumps(columnar_input).encode('utf-8'), COLUMNAR_JSON)
+
+    def test_unsupported_media_type(self):
+        with self.assertRaises(UnsupportedMediaTypeError):
+            parseForecast(b'', 'text/csv')
+        # only responses can be streamed
+        with self.assertRaises(UnsupportedMediaTypeError):
+            parseForecast(b'', NDJSON)
+
+    @unittest.skipUnless(isFormatAvailable(ARROW), 'requires pyarrow')
+    def test_arrow(self):
+        import pyarrow as pa
+        columnar_input = load_columnar_input()
+        table = pa.table(columnar_input['forecasts'], metadata={ 'config': json.dumps(columnar_input['config']) })
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        input = parseForecast(sink.getvalue().to_pybytes(), ARROW)
+        assert ColumnarForecast.parse_obj(columnar_input) == input
+
+
+class ColumnarSimulationTest(unittest.TestCase):
+
+    def test_columnar_matches_per_period_output(self):
+        expected_output = pydantic.parse_file_as(path='app/test/24-hours/expected-output.json', type_=SimulationOutput).dict()
+        output = runSimulations(ColumnarForecast.parse_obj(load_columnar_input()), columnar=True)
+        ColumnarSimulationOutput.parse_obj(output)
+
+        simulations = output['simulations']
+        assert [ period['timestamp'] for period in expected_output['simulations'] ] == simulations['timestamp']
+        for simulation_name in [ 'optimal', 'hypotheticalWindOnly' ]:
+            simulation = simulations[simulation_name]
+            for field in [ 'electricityUsage', 'electricityCost', 'electricityCostCumulative', 'hydrogenProduced' ]:
+                for source in [ 'wind', 'grid', 'total' ]:
+                    assert [ period[simulation_name][field][source] for period in expected_output['simulations'] ] == simulation[field][source]
+            for field in [ 'hydrogenInStorage', 'electrolyserOn' ]:
+                assert [ period[simulation_name][field] for period in expected_output['simulations'] ] == simulation[field]
+
+    def test_columnar_input_gives_same_output(self):
+        output = runSimulations(ColumnarForecast.parse_obj(load_columnar_input()))
+        expected_output = pydantic.parse_file_as(path='app/test/24-hours/expected-output.json', type_=SimulationOutput)
+        assert expected_output.dict() == output
+
+
+class EncodeSimulationOutputTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.output = runSimulations(ColumnarForecast.parse_obj(load_columnar_input('30-minutes')), columnar=True)
+
+    def check_round_trip(self, media_type):
+        body = encodeSimulationOutput(self.output, media_type)
+        assert self.output == decodeSimulationOutput(body, media_type)
+
+    def test_columnar_json(self):
+        self.check_round_trip(COLUMNAR_JSON)
+
+    @unittest.skipUnless(isFormatAvailable(COLUMNAR_MSGPACK), 'requires msgpack')
+    def test_msgpack(self):
+        self.check_round_trip(COLUMNAR_MSGPACK)
+
+    @unittest.skipUnless(isFormatAvailable(ARROW), 'requires pyarrow')
+    def test_arrow(self):
+        self.check_round_trip(ARROW)
+
+
+class StreamSimulationOutputTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.output = runSimulations(ColumnarForecast.parse_obj(load_columnar_input()), columnar=True)
+        cls.expected_output = pydantic.parse_file_as(path='app/test/24-hours/expected-output.json', type_=SimulationOutput).dict()
+
+    def test_ndjson(self):
+        chunks = list(iterSimulationOutput(self.output, NDJSON))
+        header = json.loads(chunks[0])
+        assert 48 == header['periods']
+        assert 'Optimal' == header['statusOfOptimalModel']
+        # the header, then the periods in chunks
+        assert 1 + -(-48 // STREAM_CHUNK_PERIODS) == len(chunks)
+        assert self.expected_output == decodeSimulationOutput(b''.join(chunks), NDJSON)
+
+    def test_event_stream(self):
+        body = encodeSimulationOutput(self.output, EVENT_STREAM)
+        assert body.startswith(b'event: header\ndata: ')
+        assert body.endswith(b'event: end\ndata: {}\n\n')
+        assert self.expected_output == decodeSimulationOutput(body, EVENT_STREAM)
@@ -0,0 +1,91 @@
+import pydantic
+import time
+import unittest
+from unittest import mock
+from app.cache import ResultCache
+from app.jobs import JobManager, JobQueueFullError, CANCELLED, SUCCEEDED, TIMED_OUT, FAILED, QUEUED
+from app.electricity import Forecast, JobStatus, SimulationOutput, SolverConfiguration
+from app.metrics import MetricsRegistry
+
+
+def load_input(fixture='30-minutes'):
+    return pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+
+
+# runs in the worker processes
+def slow_run_simulations(request, stats=None):
+    time.sleep(30)
+
+
+class JobManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = JobManager(workers=1, queue_size=2, timeout=60, cache=ResultCache(max_entries=0))
+        self.slow_manager = JobManager(workers=1, queue_size=2, timeout=60, cache=ResultCache(max_entries=0), run=slow_run_simulations)
+
+    def tearDown(self):
+        self.manager.shutdown()
+        self.slow_manager.shutdown()
+
+    def test_job_succeeds(self):
+        registry = MetricsRegistry()
+        with mock.patch('app.jobs.metricsRegistry', registry):
+            job = self.manager.submit(load_input('24-hours'))
+            assert job.finished.wait(30)
+        assert job.status == SUCCEEDED
+        # the solve is recorded in this process, rather than the worker's
+        assert { ('Optimal', 'PULP_CBC_CMD'): 1 } == registry.runs
+
+        expected_output = pydantic.parse_file_as(path='app/test/24-hours/expected-output.json', type_=SimulationOutput)
+        assert expected_output.dict() == job.result
+        assert JobStatus.parse_obj(job.toDict()).status == SUCCEEDED
+
+    def test_job_fails(self):
+        input = load_input()
+        input.config.solver = SolverConfiguration(name='NOT_A_SOLVER')
+        job = self.manager.submit(input)
+        assert job.finished.wait(30)
+        assert job.status == FAILED
+        assert 'NOT_A_SOLVER' in job.error
+
+    def test_queue_limit(self):
+        # the first job runs, the next two wait, and there is no room for a fourth
+        running_job = self.slow_manager.submit(load_input())
+        while running_job.status == QUEUED:
+            time.sleep(0.01)
+        self.slow_manager.submit(load_input())
+        self.slow_manager.submit(load_input())
+        with self.assertRaises(JobQueueFullError):
+            self.slow_manager.submit(load_input())
+
+    def test_cancel_queued_job(self):
+        self.slow_manager.submit(load_input())
+        job = self.slow_manager.submit(load_input())
+        assert self.slow_manager.cancel(job.id)
+        assert job.status == CANCELLED
+        assert not self.slow_manager.cancel(job.id)
+
+    def test_cancel_running_job(self):
+        job = self.slow_manager.submit(load_input())
+        while job.status == QUEUED:
+            time.sleep(0.01)
+        assert self.slow_manager.cancel(job.id)
+        assert job.finished.wait(10)
+        assert job.status == CANCELLED
+
+    def test_job_timeout(self):
+        job = self.slow_manager.submit(load_input(), timeout=0.5)
+        assert job.finished.wait(10)
+        assert job.status == TIMED_OUT
+
+    def test_cached_job(self):
+        manager = JobManager(workers=1, cache=ResultCache())
+        try:
+            first_job = manager.submit(load_input())
+            assert first_job.finished.wait(30)
+
+            second_job = manager.submit(load_input())
+            assert second_job.status == SUCCEEDED
+            assert second_job.result == first_job.result
+        finally:
+            manager.shutdown()
@@ -1,7 +1,14 @@
+import pulp
 import pydantic
 import unittest
-from app.lpmodel import runSimulations, calculate_elec_needed_to_maintain_min_storage
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+from app.lpmodel import runSimulations, buildOptimalModel, calculateMaxConsumptionPerPeriod, calculateMinConsumptionPerPeriod, calculateOnOffLimits, calculate_elec_needed_to_maintain_min_storage, calculateStorageTrajectory, getPulpModelSolution, getPulpModelStatus, repairPulpModel, solvePulpModel
+from app.solvers import getPulpSolver, getSolverConfiguration
+from app.benchmark import applyLimits, generateForecast
 from app.electricity import Forecast, SimulationOutput
+from app.metrics import createSolveStats
 
 
 class LpModelTest(unittest.TestCase):
@@ -52,6 +59,208 @@ class LpModelTest(unittest.TestCase):
 
 
 
+class CumulativeFormulationTest(unittest.TestCase):
+
+    def run_cumulative(self, fixture):
+        input = pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+        input.config.formulation = 'cumulative'
+        output = runSimulations(input)
+        expected_output = pydantic.parse_file_as(path='app/test/' + fixture + '/expected-output.json', type_=SimulationOutput)
+        return input, output, expected_output.dict()
+
+    def test_cumulative_matches_dense_24hours(self):
+        input, output, expected_output = self.run_cumulative('24-hours')
+        assert expected_output == output
+
+    def test_cumulative_matches_dense_single_period(self):
+        input, output, expected_output = self.run_cumulative('30-minutes')
+        assert expected_output == output
+
+    def check_same_cost(self, fixture):
+        input, output, expected_output = self.run_cumulative(fixture)
+        assert expected_output['statusOfOptimalModel'] == output['statusOfOptimalModel']
+        expected_cost = expected_output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        cost = output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        self.assertAlmostEqual(expected_cost, cost, places=4)
+        for result in output['simulations']:
+            storage = result['optimal']['hydrogenInStorage']
+            assert storage >= input.config.storage.minStorageSetPoint - 1e-3
+            assert storage <= input.config.storage.maxStorage + 1e-3
+
+    def test_cumulative_same_cost_48hours(self):
+        # the 48 hour fixture has several plans with the same optimal cost, so
+        #  the two formulations can choose different (equally good) plans
+        self.check_same_cost('48-hours')
+
+    def test_cumulative_same_cost_60minutes(self):
+        # both periods of the 60 minute fixture have the same prices, so the
+        #  wind power can be split between them in more than one way
+        self.check_same_cost('60-minutes')
+
+    def test_cumulative_model_is_linear_in_periods(self):
+        input = pydantic.parse_file_as(path='app/test/48-hours/sample-input.json', type_=Forecast)
+        dense_model, _, _, _ = buildOptimalModel(input)
+        input.config.formulation = 'cumulative'
+        cumulative_model, _, _, _ = buildOptimalModel(input)
+
+        periods = input.config.range.periods
+        dense_non_zeros = sum(len(constraint) for constraint in dense_model.constraints.values())
+        cumulative_non_zeros = sum(len(constraint) for constraint in cumulative_model.constraints.values())
+        assert cumulative_non_zeros <= 25 * periods
+        assert cumulative_non_zeros < dense_non_zeros
+
+    def test_final_storage(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        input.config.storage.finalStorage = 60500
+        output = runSimulations(input)
+        assert 'Optimal' == output['statusOfOptimalModel']
+        self.assertAlmostEqual(60500, output['simulations'][-1]['optimal']['hydrogenInStorage'], places=3)
+
+    def test_initial_and_final_power(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        input.config.productionLimits.initialPower = 0.05
+        input.config.productionLimits.finalPower = 0.05
+        output = runSimulations(input)
+        assert 'Optimal' == output['statusOfOptimalModel']
+        max_power_change = input.config.productionLimits.maxPowerChangePh * input.config.range.periodDuration
+        assert abs(output['simulations'][0]['optimal']['electricityUsage']['total'] - 0.05) <= max_power_change + 1e-6
+        assert abs(output['simulations'][-1]['optimal']['electricityUsage']['total'] - 0.05) <= max_power_change + 1e-6
+
+    def test_solution_ignores_auxiliary_variables(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        input.config.formulation = 'cumulative'
+        model, gridPower, windPower, onOff = buildOptimalModel(input)
+        solvePulpModel(model, getPulpSolver(getSolverConfiguration(input)))
+        assert len(model.variables()) > 3 * input.config.range.periods
+
+        solution = getPulpModelSolution(gridPower, windPower, onOff)
+        for values, variables in zip(solution, [ gridPower, windPower, onOff ]):
+            assert (input.config.range.periods,) == values.shape
+            assert [ variables[i].value() for i in range(input.config.range.periods) ] == values.tolist()
+
+
+
+class TightenedFormulationTest(unittest.TestCase):
+
+    def test_same_cost_as_original(self):
+        for fixture in [ '30-minutes', '24-hours', '48-hours' ]:
+            input = pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+            input.config.tightened = True
+            output = runSimulations(input)
+            expected_output = pydantic.parse_file_as(path='app/test/' + fixture + '/expected-output.json', type_=SimulationOutput).dict()
+            assert expected_output['statusOfOptimalModel'] == output['statusOfOptimalModel']
+            expected_cost = expected_output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+            cost = output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+            self.assertAlmostEqual(expected_cost, cost, places=4)
+
+    def test_on_off_limits(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        input.config.productionLimits.initialPower = 0
+        max_consumption = calculateMaxConsumptionPerPeriod(input.config)
+        assert (calculateOnOffLimits(input.config) == max_consumption * 10).all()
+
+        input.config.tightened = True
+        limits = calculateOnOffLimits(input.config)
+        assert (limits <= max_consumption + 1e-9).all()
+        # the first period can only ramp up from initialPower
+        max_power_change = input.config.productionLimits.maxPowerChangePh * input.config.range.periodDuration
+        self.assertAlmostEqual(max_power_change, limits[0])
+
+    def test_turn_on_constraints(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        model, _, _, _ = buildOptimalModel(input)
+        input.config.tightened = True
+        tightened_model, _, _, _ = buildOptimalModel(input)
+        names = set(tightened_model.constraints) - set(model.constraints)
+        assert names
+        assert all(name.startswith('Max_power_') for name in names)
+
+
+
+class ExactMinProductionTest(unittest.TestCase):
+
+    def load_input(self):
+        # the ramp limit of the fixture is below the exact min consumption,
+        #  so the electrolysers couldn't be turned on or off
+        input = generateForecast(1, 30)
+        applyLimits(input, { 'exactMinProduction': True, 'maxPowerChangePh': 4, 'minProductionRate': 0.3 })
+        return input
+
+    def test_min_consumption(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        limits = input.config.productionLimits
+        max_consumption = calculateMaxConsumptionPerPeriod(input.config)
+        self.assertAlmostEqual(max_consumption / limits.productionFactor * limits.minProductionRate, calculateMinConsumptionPerPeriod(input.config))
+        input.config.exactMinProduction = True
+        self.assertAlmostEqual(max_consumption * limits.minProductionRate, calculateMinConsumptionPerPeriod(input.config))
+
+    def test_off_or_above_min_consumption(self):
+        input = self.load_input()
+        min_consumption = calculateMinConsumptionPerPeriod(input.config)
+        output = runSimulations(input)
+        assert 'Optimal' == output['statusOfOptimalModel']
+        results = [ result['optimal'] for result in output['simulations'] ]
+        # the electrolysers are turned off for some of the day
+        assert any(result['electrolyserOn'] for result in results)
+        assert not all(result['electrolyserOn'] for result in results)
+        for result in results:
+            if result['electrolyserOn']:
+                assert result['electricityUsage']['total'] >= min_consumption - 1e-6
+            else:
+                assert result['electricityUsage']['total'] <= 1e-6
+
+    def test_tightened_same_cost(self):
+        costs = []
+        for tightened in [ False, True ]:
+            input = self.load_input()
+            input.config.tightened = tightened
+            output = runSimulations(input)
+            assert 'Optimal' == output['statusOfOptimalModel']
+            costs.append(output['simulations'][-1]['optimal']['electricityCostCumulative']['total'])
+        self.assertAlmostEqual(costs[0], costs[1], places=4)
+
+
+class SolveBudgetTest(unittest.TestCase):
+
+    def test_incumbent_is_feasible(self):
+        # PuLP reports a plan found before the time limit as optimal
+        assert 'Feasible' == getPulpModelStatus(SimpleNamespace(status=pulp.LpStatusOptimal, sol_status=pulp.LpSolutionIntegerFeasible))
+        assert 'Optimal' == getPulpModelStatus(SimpleNamespace(status=pulp.LpStatusOptimal, sol_status=pulp.LpSolutionOptimal))
+        assert 'Not Solved' == getPulpModelStatus(SimpleNamespace(status=pulp.LpStatusNotSolved, sol_status=pulp.LpSolutionNoSolutionFound))
+
+    def test_repair_from_relaxation(self):
+        input = pydantic.parse_file_as(path='app/test/48-hours/sample-input.json', type_=Forecast)
+        expected_output = pydantic.parse_file_as(path='app/test/48-hours/expected-output.json', type_=SimulationOutput)
+        expected_cost = expected_output.simulations[-1].optimal.electricityCostCumulative.total / input.config.range.periodDuration
+
+        model, gridPower, windPower, onOff = buildOptimalModel(input)
+        stats = createSolveStats()
+        status = repairPulpModel(model, gridPower, windPower, onOff, getPulpSolver(getSolverConfiguration(input)), stats)
+        assert 'Heuristic' == status
+        assert stats['objective'] >= expected_cost - 1e-6
+        assert 0 <= stats['mipGap'] < 0.05
+
+        # the plan must keep to the constraints of the model
+        solution = getPulpModelSolution(gridPower, windPower, onOff)
+        assert set(solution.onOff.tolist()) <= { 0, 1 }
+        for constraint in model.constraints.values():
+            assert constraint.valid(1e-6)
+
+        # the model is left as it was built
+        for var in onOff.values():
+            assert (pulp.LpInteger, 0, 1) == (var.cat, var.lowBound, var.upBound)
+
+    def test_heuristic_output_has_gap(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        # as if the solver stopped at its time limit without a plan
+        with mock.patch('app.lpmodel.getPulpModelStatus', return_value='Not Solved'):
+            output = runSimulations(input)
+        SimulationOutput.parse_obj(output)
+        assert 'Heuristic' == output['statusOfOptimalModel']
+        assert output['mipGapOfOptimalModel'] >= 0
+
+
+
 class CalculateElecNeededTest(unittest.TestCase):
 
     def test_calculate_elec_needed_to_maintain_min_storage(self):
@@ -95,3 +304,28 @@ class CalculateElecNeededTest(unittest.TestCase):
         # there is enough storage to meet the demand, without taking us below the min limit
         assert 0 == output
 
+
+
+
+class StorageTrajectoryTest(unittest.TestCase):
+
+    def test_storage_matches_fixture(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        expected_output = pydantic.parse_file_as(path='app/test/24-hours/expected-output.json', type_=SimulationOutput)
+        # the wind only simulation fills storage, then produces more than can be stored
+        for simulation in [ 'optimal', 'hypotheticalWindOnly' ]:
+            results = [ getattr(result, simulation) for result in expected_output.simulations ]
+            changes = np.array([ result.hydrogenProduced.total - forecast.hydrogenDemand for result, forecast in zip(results, input.forecasts) ])
+            output = calculateStorageTrajectory(input.config.storage.initialStorage, changes, input.config.storage.maxStorage)
+            np.testing.assert_allclose([ result.hydrogenInStorage for result in results ], output, rtol=0, atol=1e-6)
+
+    def test_storage_after_capacity(self):
+        # storage lost over capacity isn't regained when the level falls
+        changes = np.array([ 50.0, 80, -30, -100, 40 ])
+        output = calculateStorageTrajectory(100, changes, 200)
+        assert [ 150.0, 200, 170, 70, 110 ] == output.tolist()
+
+    def test_storage_never_over_capacity(self):
+        changes = np.full(10, 50.0)
+        output = calculateStorageTrajectory(100, changes, 200)
+        assert [ 150.0, 200, 200, 200, 200, 200, 200, 200, 200, 200 ] == output.tolist()
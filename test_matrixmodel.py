@@ -0,0 +1,125 @@
+import pydantic
+import unittest
+from app.lpmodel import runSimulations
+from app.matrixmodel import buildMatrixModel, repairMatrixModel, solveMatrixModel
+from app.benchmark import applyLimits, generateForecast
+from app.electricity import Forecast, SimulationOutput
+from app.metrics import createSolveStats
+
+
+class MatrixModelTest(unittest.TestCase):
+
+    def run_matrix_model(self, fixture):
+        input = pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+        input.config.modelBuilder = 'matrix'
+        output = runSimulations(input)
+        expected_output = pydantic.parse_file_as(path='app/test/' + fixture + '/expected-output.json', type_=SimulationOutput)
+        return input, output, expected_output.dict()
+
+    def check_same_cost_as_pulp(self, fixture):
+        input, output, expected_output = self.run_matrix_model(fixture)
+
+        # output should have the same structure as the PuLP model
+        SimulationOutput.parse_obj(output)
+        assert output['statusOfOptimalModel'] == 'Optimal'
+
+        # HiGHS stops at a relative MIP gap of 1e-4, and can choose a different
+        #  plan where several have the same cost
+        expected_cost = expected_output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        cost = output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        assert abs(expected_cost - cost) <= 1e-4 * abs(expected_cost) + 1e-6
+
+        for result in output['simulations']:
+            storage = result['optimal']['hydrogenInStorage']
+            assert storage >= input.config.storage.minStorageSetPoint - 1e-3
+            assert storage <= input.config.storage.maxStorage + 1e-3
+
+        # the hypothetical simulation doesn't use the model, so is unchanged
+        for result, expected_result in zip(output['simulations'], expected_output['simulations']):
+            assert result['hypotheticalWindOnly'] == expected_result['hypotheticalWindOnly']
+
+    def test_matrix_model_single_period(self):
+        self.check_same_cost_as_pulp('30-minutes')
+
+    def test_matrix_model_1hour(self):
+        self.check_same_cost_as_pulp('60-minutes')
+
+    def test_matrix_model_24hours(self):
+        self.check_same_cost_as_pulp('24-hours')
+
+    def test_matrix_model_48hours(self):
+        self.check_same_cost_as_pulp('48-hours')
+
+    def test_matrix_model_tightened(self):
+        input = pydantic.parse_file_as(path='app/test/48-hours/sample-input.json', type_=Forecast)
+        rows = buildMatrixModel(input).A.shape[0]
+        input.config.tightened = True
+        assert buildMatrixModel(input).A.shape[0] > rows
+
+        input.config.modelBuilder = 'matrix'
+        output = runSimulations(input)
+        expected_output = pydantic.parse_file_as(path='app/test/48-hours/expected-output.json', type_=SimulationOutput).dict()
+        assert output['statusOfOptimalModel'] == 'Optimal'
+        expected_cost = expected_output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        cost = output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        assert abs(expected_cost - cost) <= 1e-4 * abs(expected_cost) + 1e-6
+
+    def test_matrix_model_exact_min_production(self):
+        costs = []
+        for model_builder in [ 'pulp', 'matrix' ]:
+            input = generateForecast(1, 30, model_builder=model_builder)
+            applyLimits(input, { 'exactMinProduction': True, 'maxPowerChangePh': 4, 'minProductionRate': 0.3 })
+            output = runSimulations(input)
+            assert output['statusOfOptimalModel'] == 'Optimal'
+            costs.append(output['simulations'][-1]['optimal']['electricityCostCumulative']['total'])
+        assert abs(costs[0] - costs[1]) <= 1e-4 * abs(costs[0]) + 1e-6
+
+    def test_matrix_model_no_wind(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        input.config.modelBuilder = 'matrix'
+        for item in input.forecasts:
+            item.renewableGeneration = 0
+
+        output = runSimulations(input)
+        for result in output['simulations']:
+            assert result['optimal']['electricityUsage']['wind'] == 0
+            assert result['optimal']['electricityCost']['wind'] == 0
+
+    def test_matrix_model_infeasible(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        # far more demand than the electrolysers can produce
+        for item in input.forecasts:
+            item.hydrogenDemand = 10000
+
+        solution, status = solveMatrixModel(buildMatrixModel(input))
+        assert status == 'Infeasible'
+        assert solution is None
+
+    def test_matrix_model_repair(self):
+        input = pydantic.parse_file_as(path='app/test/48-hours/sample-input.json', type_=Forecast)
+        matrix_model = buildMatrixModel(input)
+        stats = createSolveStats()
+        solution, status = repairMatrixModel(matrix_model, stats=stats)
+        assert status == 'Heuristic'
+        assert 0 <= stats['mipGap'] < 0.05
+
+        periods = input.config.range.periods
+        assert set(solution[2 * periods:3 * periods].tolist()) <= { 0, 1 }
+        row_values = matrix_model.A @ solution
+        assert (row_values >= matrix_model.row_lb - 1e-6).all() and (row_values <= matrix_model.row_ub + 1e-6).all()
+
+    def test_matrix_model_final_storage(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        input.config.modelBuilder = 'matrix'
+        input.config.storage.finalStorage = 60500.5
+        output = runSimulations(input)
+        assert 'Optimal' == output['statusOfOptimalModel']
+        self.assertAlmostEqual(60500.5, output['simulations'][-1]['optimal']['hydrogenInStorage'], places=3)
+
+    def test_matrix_model_size(self):
+        input = pydantic.parse_file_as(path='app/test/48-hours/sample-input.json', type_=Forecast)
+        matrix_model = buildMatrixModel(input)
+
+        periods = input.config.range.periods
+        assert matrix_model.A.shape == (4 * periods + periods - 1, 4 * periods)
+        assert matrix_model.integrality.sum() == periods
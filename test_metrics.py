@@ -0,0 +1,83 @@
+import pydantic
+import unittest
+from app.lpmodel import runSimulations
+from app.metrics import MetricsRegistry, createSolveStats, timePhase
+from app.electricity import Forecast, SolveMetadata, SolverConfiguration
+
+
+def load_input(fixture='24-hours'):
+    return pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+
+
+class SolveStatsTest(unittest.TestCase):
+
+    def check_stats(self, input):
+        stats = createSolveStats()
+        output = runSimulations(input, stats=stats)
+        SolveMetadata.parse_obj(stats)
+
+        assert [ 'feasibility', 'build', 'solve', 'extract', 'postProcess' ] == list(stats['timings'])
+        assert all(seconds >= 0 for seconds in stats['timings'].values())
+        assert stats['status'] == output['statusOfOptimalModel'] == 'Optimal'
+        assert stats['solver'] == output['solverOfOptimalModel']
+        assert 48 == stats['integerVariables']
+        assert stats['nonZeros'] > stats['constraints'] > 0
+        assert 0 <= stats['mipGap'] <= 1e-4
+        assert stats['nodes'] >= 0
+
+        cost = output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        # the objective is the cost of the power used, per hour of each period
+        assert abs(stats['objective'] * input.config.range.periodDuration - cost) <= 1e-6 * abs(cost)
+        return stats
+
+    def test_cbc(self):
+        stats = self.check_stats(load_input())
+        assert 144 == stats['variables']
+
+    def test_highs(self):
+        input = load_input()
+        input.config.solver = SolverConfiguration(name='HiGHS')
+        self.check_stats(input)
+
+    def test_matrix_model(self):
+        input = load_input()
+        input.config.modelBuilder = 'matrix'
+        stats = self.check_stats(input)
+        # gridPower, windPower, onOff and cumulativePower for each period
+        assert 4 * 48 == stats['variables']
+
+    def test_output_unchanged(self):
+        assert runSimulations(load_input('30-minutes')) == runSimulations(load_input('30-minutes'), stats=createSolveStats())
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def test_time_phase(self):
+        stats = createSolveStats()
+        with timePhase(stats, 'build'):
+            pass
+        with timePhase(None, 'solve'):
+            pass
+        assert [ 'build' ] == list(stats['timings'])
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        stats = createSolveStats()
+        stats.update({ 'timings': { 'build': 0.002, 'solve': 2 }, 'status': 'Optimal', 'solver': 'PULP_CBC_CMD', 'nonZeros': 5512, 'mipGap': 0.0 })
+        registry.recordSolve(stats)
+        registry.recordSolve(stats)
+        registry.observePhase('serialise', 0.02)
+
+        lines = registry.render([ ('hydrogen_jobs_queued', 'gauge', 'Jobs waiting to run', 3) ]).splitlines()
+        assert 'hydrogen_optimisations_total{status="Optimal",solver="PULP_CBC_CMD"} 2' in lines
+        assert 'hydrogen_optimisation_phase_seconds_bucket{phase="build",le="0.005"} 2' in lines
+        assert 'hydrogen_optimisation_phase_seconds_bucket{phase="solve",le="1.0"} 0' in lines
+        assert 'hydrogen_optimisation_phase_seconds_bucket{phase="solve",le="+Inf"} 2' in lines
+        assert 'hydrogen_optimisation_phase_seconds_count{phase="serialise"} 1' in lines
+        assert 'hydrogen_optimisation_nonzeros_bucket{le="10000.0"} 2' in lines
+        assert 'hydrogen_last_optimisation_nonzeros 5512' in lines
+        assert 'hydrogen_last_optimisation_mip_gap 0.0' in lines
+        # stats that weren't reported aren't rendered
+        assert not any(line.startswith('hydrogen_last_optimisation_nodes') for line in lines)
+        assert '# TYPE hydrogen_jobs_queued gauge' in lines
+        assert 'hydrogen_jobs_queued 3' in lines
@@ -0,0 +1,158 @@
+import json
+import os
+import pydantic
+import tempfile
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+from app.electricity import Forecast, PlanChanges
+from app.lpmodel import runSimulations
+from app.main import app
+from app.plans import PlanStore
+
+
+def load_input(fixture='24-hours'):
+    return pydantic.parse_file_as(path='app/test/' + fixture + '/sample-input.json', type_=Forecast)
+
+
+class PlanStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = PlanStore()
+        self.output = runSimulations(load_input())
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_first_plan_is_all_changes(self):
+        plan_id = self.store.record('plant', self.output)
+        changes = self.store.changes('plant')
+        PlanChanges.parse_obj(changes)
+
+        assert plan_id == changes['planId']
+        assert changes['previousPlanId'] is None
+        assert [ result['timestamp'] for result in self.output['simulations'] ] == [ period['timestamp'] for period in changes['periods'] ]
+        first = self.output['simulations'][0]['optimal']
+        assert first['electricityUsage']['grid'] == changes['periods'][0]['gridPower']
+        assert first['electrolyserOn'] == changes['periods'][0]['electrolyserOn']
+        assert changes['periods'][0]['previous'] is None
+
+    def test_only_changed_periods(self):
+        first_id = self.store.record('plant', self.output)
+        self.output['simulations'][3]['optimal']['electricityUsage']['grid'] += 0.5
+        self.output['simulations'][5]['optimal']['electrolyserOn'] = not self.output['simulations'][5]['optimal']['electrolyserOn']
+        # too small a change to count
+        self.output['simulations'][7]['optimal']['electricityUsage']['wind'] += 1e-9
+        second_id = self.store.record('plant', self.output)
+
+        changes = self.store.changes('plant')
+        assert second_id == changes['planId']
+        assert first_id == changes['previousPlanId']
+        timestamps = [ result['timestamp'] for result in self.output['simulations'] ]
+        assert [ timestamps[3], timestamps[5] ] == [ period['timestamp'] for period in changes['periods'] ]
+        self.assertAlmostEqual(0.5, changes['periods'][0]['gridPower'] - changes['periods'][0]['previous']['gridPower'])
+
+        # nothing has changed since the latest plan
+        assert [] == self.store.changes('plant', since=second_id)['periods']
+
+    def test_periods_matched_by_timestamp(self):
+        self.store.record('plant', self.output)
+        # the horizon moves on by two periods
+        shifted = runSimulations(load_input())
+        shifted['simulations'] = shifted['simulations'][2:] + [ dict(result, timestamp=result['timestamp'] + '-next') for result in shifted['simulations'][:2] ]
+        self.store.record('plant', shifted)
+
+        # only the new periods, as the others haven't changed
+        changes = self.store.changes('plant')
+        assert [ result['timestamp'] for result in shifted['simulations'][-2:] ] == [ period['timestamp'] for period in changes['periods'] ]
+        assert all(period['previous'] is None for period in changes['periods'])
+
+    def test_repeated_timestamps(self):
+        self.output['simulations'][1]['timestamp'] = self.output['simulations'][0]['timestamp']
+        self.store.record('plant', self.output)
+        self.output['simulations'][1]['optimal']['electrolyserOn'] = not self.output['simulations'][1]['optimal']['electrolyserOn']
+        self.store.record('plant', self.output)
+
+        # periods with the same timestamp are matched in order
+        changes = self.store.changes('plant')
+        assert 1 == len(changes['periods'])
+        assert self.output['simulations'][1]['optimal']['electrolyserOn'] == changes['periods'][0]['electrolyserOn']
+        assert self.output['simulations'][1]['optimal']['electrolyserOn'] != changes['periods'][0]['previous']['electrolyserOn']
+
+    def test_failure_to_record(self):
+        self.store.close()
+        assert self.store.record('plant', self.output) is None
+        assert { 'recorded': 0, 'errors': 1 } == self.store.stats()
+        self.store = PlanStore()
+
+    def test_columnar_output(self):
+        self.store.record('plant', self.output)
+        self.store.record('plant', runSimulations(load_input(), columnar=True))
+        assert [] == self.store.changes('plant')['periods']
+
+    def test_no_plan_not_recorded(self):
+        self.output['statusOfOptimalModel'] = 'Infeasible'
+        assert self.store.record('plant', self.output) is None
+        assert self.store.changes('plant') is None
+
+    def test_history_is_limited(self):
+        store = PlanStore(max_history=2)
+        plan_ids = [ store.record('plant', self.output) for _ in range(3) ]
+        assert plan_ids[1:] == [ plan['planId'] for plan in store.list('plant') ]
+        # the client's last plan has gone, so everything is returned
+        changes = store.changes('plant', since=plan_ids[0])
+        assert changes['previousPlanId'] is None
+        assert len(self.output['simulations']) == len(changes['periods'])
+        store.close()
+
+    def test_plans_survive_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'plans.db')
+            store = PlanStore(path)
+            plan_id = store.record('plant', self.output)
+            store.close()
+
+            store = PlanStore(path)
+            assert plan_id == store.changes('plant')['planId']
+            assert store.clear('plant')
+            assert not store.clear('plant')
+            store.close()
+
+
+class PlanEndpointTest(unittest.TestCase):
+
+    def test_plans_recorded_for_plant(self):
+        store = PlanStore()
+        with mock.patch('app.main.planStore', store):
+            client = TestClient(app)
+            with open('app/test/24-hours/sample-input.json', 'rb') as input_file:
+                body = input_file.read()
+
+            assert 404 == client.get('/electricity/hydrogen-production-optimisation/plans/plant-1/changes').status_code
+            # plans are only recorded when the plant is given
+            client.post('/electricity/hydrogen-production-optimisation', content=body)
+            assert 404 == client.get('/electricity/hydrogen-production-optimisation/plans/plant-1').status_code
+
+            for _ in range(2):
+                response = client.post('/electricity/hydrogen-production-optimisation?plantId=plant-1', content=body)
+                assert 200 == response.status_code
+            plans = client.get('/electricity/hydrogen-production-optimisation/plans/plant-1').json()
+            assert 2 == len(plans)
+
+            response = client.get('/electricity/hydrogen-production-optimisation/plans/plant-1/changes')
+            assert 200 == response.status_code
+            assert [] == response.json()['periods']
+            response = client.get('/electricity/hydrogen-production-optimisation/plans/plant-1/changes?since=0')
+            assert len(response.json()['periods']) == plans[-1]['periods']
+
+            # a forecast with a repeated timestamp
+            with open('app/test/60-minutes/sample-input.json') as input_file:
+                raw_input = json.load(input_file)
+            raw_input['forecasts'][1]['timestamp'] = raw_input['forecasts'][0]['timestamp']
+            response = client.post('/electricity/hydrogen-production-optimisation?plantId=plant-2', json=raw_input)
+            assert 200 == response.status_code
+            assert len(raw_input['forecasts']) == len(client.get('/electricity/hydrogen-production-optimisation/plans/plant-2/changes').json()['periods'])
+
+            assert 200 == client.delete('/electricity/hydrogen-production-optimisation/plans/plant-1').status_code
+            assert 404 == client.delete('/electricity/hydrogen-production-optimisation/plans/plant-1').status_code
+        store.close()
@@ -0,0 +1,108 @@
+import pydantic
+import time
+import unittest
+from unittest import mock
+from app.lpmodel import runSimulations
+from app.rolling import runRollingSimulations, clearRollingHorizonState, _states
+from app.electricity import Forecast
+
+
+def load_window(start, periods):
+    input = pydantic.parse_file_as(path='app/test/48-hours/sample-input.json', type_=Forecast)
+    input.forecasts = input.forecasts[start:start + periods]
+    input.config.range.periods = periods
+    return input
+
+
+def total_cost(output):
+    return output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+
+
+class RollingHorizonTest(unittest.TestCase):
+
+    def tearDown(self):
+        clearRollingHorizonState('test-plant')
+
+    def test_first_plan_matches_cold_solve(self):
+        input = load_window(0, 48)
+        output = runRollingSimulations('test-plant', input)
+        assert runSimulations(load_window(0, 48)) == output
+
+    def test_shifted_plan_reuses_model(self):
+        runRollingSimulations('test-plant', load_window(0, 48))
+        model = _states['test-plant'].model
+
+        for start in range(1, 4):
+            output = runRollingSimulations('test-plant', load_window(start, 48))
+            assert _states['test-plant'].model is model
+
+            # same cost as building and solving the model from scratch
+            expected_output = runSimulations(load_window(start, 48))
+            assert output['statusOfOptimalModel'] == 'Optimal'
+            self.assertAlmostEqual(total_cost(expected_output), total_cost(output), places=4)
+
+    def test_updated_initial_storage(self):
+        runRollingSimulations('test-plant', load_window(0, 48))
+
+        input = load_window(1, 48)
+        input.config.storage.initialStorage = 60500
+        output = runRollingSimulations('test-plant', input)
+
+        input = load_window(1, 48)
+        input.config.storage.initialStorage = 60500
+        expected_output = runSimulations(input)
+        self.assertAlmostEqual(total_cost(expected_output), total_cost(output), places=4)
+
+    def test_config_change_rebuilds_model(self):
+        runRollingSimulations('test-plant', load_window(0, 48))
+        model = _states['test-plant'].model
+
+        input = load_window(1, 24)
+        output = runRollingSimulations('test-plant', input)
+        assert _states['test-plant'].model is not model
+        self.assertAlmostEqual(total_cost(runSimulations(load_window(1, 24))), total_cost(output), places=4)
+
+    def test_updated_initial_power(self):
+        runRollingSimulations('test-plant', load_window(0, 48))
+        model = _states['test-plant'].model
+
+        for initial_power in [ 0.5, 0.4 ]:
+            input = load_window(1, 48)
+            input.config.productionLimits.initialPower = initial_power
+            output = runRollingSimulations('test-plant', input)
+            if initial_power == 0.4:
+                # only the limit changed, so the model is kept
+                assert _states['test-plant'].model is model
+            model = _states['test-plant'].model
+
+            input = load_window(1, 48)
+            input.config.productionLimits.initialPower = initial_power
+            expected_output = runSimulations(input)
+            self.assertAlmostEqual(total_cost(expected_output), total_cost(output), places=4)
+            assert abs(output['simulations'][0]['optimal']['electricityUsage']['total'] - initial_power) <= input.config.productionLimits.maxPowerChangePh * input.config.range.periodDuration + 1e-6
+
+    def test_least_recently_used_plant_is_forgotten(self):
+        with mock.patch('app.rolling.MAX_ROLLING_PLANTS', 2):
+            for plant_id in [ 'test-plant', 'test-plant-2', 'test-plant', 'test-plant-3' ]:
+                runRollingSimulations(plant_id, load_window(0, 24))
+            assert [ 'test-plant', 'test-plant-3' ] == list(_states)
+        clearRollingHorizonState('test-plant-3')
+
+    def test_expired_plant_is_forgotten(self):
+        runRollingSimulations('test-plant', load_window(0, 48))
+        model = _states['test-plant'].model
+        _states['test-plant'].expires = time.time() - 1
+        runRollingSimulations('test-plant', load_window(1, 48))
+        assert _states['test-plant'].model is not model
+
+    def test_clear_state(self):
+        runRollingSimulations('test-plant', load_window(0, 48))
+        assert clearRollingHorizonState('test-plant')
+        assert not clearRollingHorizonState('test-plant')
+
+    def test_matrix_builder_is_not_kept(self):
+        input = load_window(0, 48)
+        input.config.modelBuilder = 'matrix'
+        output = runRollingSimulations('test-plant', input)
+        assert output['statusOfOptimalModel'] == 'Optimal'
+        assert 'test-plant' not in _states
@@ -0,0 +1,98 @@
+import os
+import pydantic
+import unittest
+from unittest import mock
+from app.lpmodel import runSimulations
+from app.solvers import DEFAULT_TIME_LIMIT, SolverError, getPulpSolver, getSolverConfiguration, parseCbcLog
+from app.electricity import Forecast, SimulationOutput, SolverConfiguration
+
+
+class SolverSelectionTest(unittest.TestCase):
+
+    def test_default_solver(self):
+        input = pydantic.parse_file_as(path='app/test/30-minutes/sample-input.json', type_=Forecast)
+        output = runSimulations(input)
+        assert output['solverOfOptimalModel'] == 'PULP_CBC_CMD'
+
+    def test_highs_solver(self):
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        input.config.solver = SolverConfiguration(name='HiGHS', threads=1, gapRel=0.0001)
+        output = runSimulations(input)
+        assert output['solverOfOptimalModel'] == 'HiGHS'
+        assert output['statusOfOptimalModel'] == 'Optimal'
+
+        # HiGHS can stop within the MIP gap of the best plan CBC found
+        expected_output = pydantic.parse_file_as(path='app/test/24-hours/expected-output.json', type_=SimulationOutput)
+        expected_cost = expected_output.simulations[-1].optimal.electricityCostCumulative.total
+        cost = output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+        assert abs(expected_cost - cost) <= 1e-4 * abs(expected_cost) + 1e-6
+
+    def test_highs_electrolyser_on(self):
+        # HiGHS gives binaries that are only within its tolerance of 1
+        input = pydantic.parse_file_as(path='app/test/24-hours/sample-input.json', type_=Forecast)
+        input.config.solver = SolverConfiguration(name='HiGHS')
+        output = runSimulations(input)
+        assert output['statusOfOptimalModel'] == 'Optimal'
+        for result in output['simulations']:
+            usage = result['optimal']['electricityUsage']
+            assert result['optimal']['electrolyserOn'] == (usage['grid'] + usage['wind'] > 0), result['timestamp']
+
+    def test_solver_shorthand(self):
+        solver = getPulpSolver(SolverConfiguration(name='cbc', timeLimit=5, threads=2))
+        assert solver.name == 'PULP_CBC_CMD'
+        assert solver.timeLimit == 5
+        assert solver.optionsDict['threads'] == 2
+
+    def test_request_overrides_service_configuration(self):
+        input = pydantic.parse_file_as(path='app/test/30-minutes/sample-input.json', type_=Forecast)
+        input.config.solver = SolverConfiguration(name='HiGHS')
+        with mock.patch.dict(os.environ, { 'HYDROGEN_SOLVER': 'CBC', 'HYDROGEN_SOLVER_TIME_LIMIT': '10' }):
+            solver_config = getSolverConfiguration(input)
+        assert solver_config.name == 'HiGHS'
+        assert solver_config.timeLimit == 10
+
+    def test_default_time_limit(self):
+        input = pydantic.parse_file_as(path='app/test/30-minutes/sample-input.json', type_=Forecast)
+        with mock.patch.dict(os.environ, { 'HYDROGEN_SOLVER_TIME_LIMIT': '' }):
+            assert getSolverConfiguration(input).timeLimit == DEFAULT_TIME_LIMIT
+        with mock.patch.dict(os.environ, { 'HYDROGEN_SOLVER_TIME_LIMIT': 'none' }):
+            assert getSolverConfiguration(input).timeLimit is None
+
+    def test_service_solver(self):
+        input = pydantic.parse_file_as(path='app/test/30-minutes/sample-input.json', type_=Forecast)
+        with mock.patch.dict(os.environ, { 'HYDROGEN_SOLVER': 'HiGHS' }):
+            output = runSimulations(input)
+        assert output['solverOfOptimalModel'] == 'HiGHS'
+
+    def test_unknown_solver(self):
+        input = pydantic.parse_file_as(path='app/test/30-minutes/sample-input.json', type_=Forecast)
+        input.config.solver = SolverConfiguration(name='NOT_A_SOLVER')
+        with self.assertRaises(SolverError):
+            runSimulations(input)
+
+    def test_matrix_builder_only_uses_highs(self):
+        input = pydantic.parse_file_as(path='app/test/30-minutes/sample-input.json', type_=Forecast)
+        input.config.modelBuilder = 'matrix'
+        input.config.solver = SolverConfiguration(name='CBC')
+        with self.assertRaises(SolverError):
+            runSimulations(input)
+
+        input.config.solver = SolverConfiguration(name='HiGHS', timeLimit=10)
+        output = runSimulations(input)
+        assert output['solverOfOptimalModel'] == 'HiGHS'
+
+
+class CbcLogTest(unittest.TestCase):
+
+    def test_optimal(self):
+        log = 'Result - Optimal solution found\n\nObjective value:                1127.53267045\nEnumerated nodes:               12\n'
+        assert { 'objective': 1127.53267045, 'mipGap': 0.0, 'nodes': 12 } == parseCbcLog(log)
+
+    def test_stopped_on_time_limit(self):
+        log = 'Result - Stopped on time limit\n\nObjective value:                4447.44204545\nLower bound:                    4292.864\nGap:                            0.04\nEnumerated nodes:               0\n'
+        info = parseCbcLog(log)
+        assert abs(info['mipGap'] - (4447.44204545 - 4292.864) / 4447.44204545) < 1e-12
+        assert 0 == info['nodes']
+
+    def test_no_solution(self):
+        assert { 'objective': None, 'mipGap': None, 'nodes': None } == parseCbcLog('Result - Linear relaxation infeasible\n')
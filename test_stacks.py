@@ -0,0 +1,99 @@
+import json
+import numpy as np
+import pydantic
+import unittest
+from app.benchmark import generateForecast
+from app.electricity import DecompositionConfiguration, ElectrolyserStackConfiguration, Forecast, SimulationOutput
+from app.feasibility import MAX_CONSUMPTION_CONSTRAINT, InfeasibleRequestError, checkFeasibility
+from app.lpmodel import runSimulations
+from app.stacks import buildStackModel, runStackModel
+
+
+def load_input(stacks, fixture='24-hours'):
+    with open('app/test/' + fixture + '/sample-input.json') as input_file:
+        raw_input = json.load(input_file)
+    limits = raw_input['config']['productionLimits']
+    raw_input['config']['stacks'] = [ dict(limits, **stack) for stack in stacks ]
+    return Forecast.parse_obj(raw_input)
+
+
+class StackModelTest(unittest.TestCase):
+
+    def test_single_stack_matches_matrix_model(self):
+        for fixture in [ '24-hours', '48-hours' ]:
+            input = load_input([ { 'name': 'a' } ], fixture)
+            output = runSimulations(input)
+            SimulationOutput.parse_obj(output)
+
+            expected_output = pydantic.parse_file_as(path='app/test/' + fixture + '/expected-output.json', type_=SimulationOutput).dict()
+            assert 'Optimal' == output['statusOfOptimalModel']
+            expected_cost = expected_output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+            cost = output['simulations'][-1]['optimal']['electricityCostCumulative']['total']
+            assert abs(expected_cost - cost) <= 1e-4 * abs(expected_cost) + 1e-6
+            assert [ 'a' ] == [ stack['name'] for stack in output['stacks'] ]
+
+    def test_stacks_share_wind_and_storage(self):
+        input = load_input([
+            { 'name': 'a', 'maxProductionPh': 500 },
+            { 'name': 'b', 'maxProductionPh': 500, 'productionFactor': 240, 'maxPowerChangePh': 0.1 }
+        ])
+        output = runSimulations(input)
+        assert 'Optimal' == output['statusOfOptimalModel']
+
+        renewable_generation = np.array([ forecast.renewableGeneration for forecast in input.forecasts ])
+        wind = sum(np.array(stack['electricityUsage']['wind']) for stack in output['stacks'])
+        assert (wind <= renewable_generation + 1e-6).all()
+
+        for result in output['simulations']:
+            storage = result['optimal']['hydrogenInStorage']
+            assert storage >= input.config.storage.minStorageSetPoint - 1e-3
+            assert storage <= input.config.storage.maxStorage + 1e-3
+
+        # the output for all the stacks is the total of each stack's
+        hydrogen_produced = sum(np.array(stack['hydrogenProduced']['total']) for stack in output['stacks'])
+        np.testing.assert_allclose(hydrogen_produced, [ result['optimal']['hydrogenProduced']['total'] for result in output['simulations'] ])
+
+        # each stack keeps to its own limits
+        for stack, limits in zip(output['stacks'], input.config.stacks):
+            power = np.array(stack['electricityUsage']['total'])
+            assert (power <= limits.maxProductionPh * input.config.range.periodDuration / limits.productionFactor + 1e-6).all()
+            assert (np.abs(np.diff(power)) <= limits.maxPowerChangePh * input.config.range.periodDuration + 1e-6).all()
+
+    def test_model_size_grows_with_stacks(self):
+        request = generateForecast(7, 30, model_builder='matrix')
+        limits = request.config.productionLimits.dict()
+        request.config.stacks = [ ElectrolyserStackConfiguration(name=str(i), **limits) for i in range(20) ]
+        model = buildStackModel(request)
+        assert 20 * 336 == np.count_nonzero(model.integrality)
+        # a block per stack, and two rows per period across the stacks
+        single_stack_rows = buildStackModel(request.copy(update={ 'config': request.config.copy(update={ 'stacks': request.config.stacks[:1] }) })).A.shape[0] - 2 * 336
+        assert 20 * single_stack_rows + 2 * 336 == model.A.shape[0]
+
+
+class StackConfigurationTest(unittest.TestCase):
+
+    def test_names_must_differ(self):
+        with self.assertRaises(pydantic.ValidationError):
+            load_input([ { 'name': 'a' }, { 'name': 'a' } ])
+
+    def test_no_decomposition(self):
+        input = load_input([ { 'name': 'a' } ])
+        with self.assertRaises(pydantic.ValidationError):
+            Forecast.parse_obj(dict(input.dict(), config=dict(input.config.dict(), decomposition=DecompositionConfiguration(aggregatePeriods=4, windowPeriods=8).dict())))
+
+    def test_infeasible_stack(self):
+        input = load_input([ { 'name': 'a' }, { 'name': 'b', 'initialPower': 10 } ])
+        with self.assertRaises(InfeasibleRequestError) as context:
+            checkFeasibility(input)
+        assert 0 == context.exception.period
+        assert MAX_CONSUMPTION_CONSTRAINT == context.exception.constraint
+        assert 'stack b' in context.exception.reason
+
+    def test_demand_above_stacks_production(self):
+        input = load_input([ { 'name': 'a', 'maxProductionPh': 400 }, { 'name': 'b', 'maxProductionPh': 400 } ])
+        input.forecasts[30].hydrogenDemand = 1500
+        with self.assertRaises(InfeasibleRequestError):
+            checkFeasibility(input)
+        # the solver must agree that there's no plan
+        _, status, _ = runStackModel(input)
+        assert 'Infeasible' == status
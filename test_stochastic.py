@@ -0,0 +1,85 @@
+import json
+import numpy as np
+import pydantic
+import subprocess
+import sys
+import unittest
+from app.stochastic import reduceScenarios, runStochasticSimulations
+from app.electricity import ForecastEnsemble, SimulationOutput, StochasticSimulationOutput
+
+
+def load_input(ensemble, fixture='24-hours'):
+    with open('app/test/' + fixture + '/sample-input.json') as input_file:
+        raw_input = json.load(input_file)
+    raw_input['ensemble'] = ensemble
+    return ForecastEnsemble.parse_obj(raw_input)
+
+
+def load_renewable_generation(fixture='24-hours'):
+    with open('app/test/' + fixture + '/sample-input.json') as input_file:
+        return [ forecast['renewableGeneration'] for forecast in json.load(input_file)['forecasts'] ]
+
+
+class ReduceScenariosTest(unittest.TestCase):
+
+    def test_clusters_members(self):
+        scenarios = reduceScenarios([ [ 0, 0 ], [ 10, 10 ], [ 0, 1 ], [ 10, 12 ], [ 10, 11 ] ], [ 0.1, 0.2, 0.3, 0.2, 0.2 ], 2)
+        assert [ (0.4, 2, [ 0, 2 ]), (0.6, 4, [ 1, 3, 4 ]) ] == [ (round(probability, 6), representative, members) for probability, representative, members in scenarios ]
+
+    def test_no_reduction_needed(self):
+        assert [ (0.5, 0, [ 0 ]), (0.5, 1, [ 1 ]) ] == reduceScenarios([ [ 0 ], [ 1 ] ], [ 0.5, 0.5 ], 3)
+
+
+class StochasticModelTest(unittest.TestCase):
+
+    def test_single_member_matches_fixture(self):
+        expected_output = pydantic.parse_file_as(path='app/test/24-hours/expected-output.json', type_=SimulationOutput).dict()
+        output = runStochasticSimulations(load_input({ 'members': [ load_renewable_generation() ] }))
+        StochasticSimulationOutput.parse_obj(output)
+
+        assert 'Optimal' == output['statusOfOptimalModel']
+        assert 1 == len(output['scenarios'])
+        expected_cost = sum(period['optimal']['electricityCost']['total'] for period in expected_output['simulations'])
+        self.assertAlmostEqual(expected_cost, output['expectedCost'], places=4)
+
+    def test_first_stage_shared_by_scenarios(self):
+        renewable_generation = np.array(load_renewable_generation())
+        members = [ (renewable_generation * scale).tolist() for scale in [ 0, 0.5, 1, 2, 4, 4.5 ] ]
+        output = runStochasticSimulations(load_input({ 'members': members, 'firstStagePeriods': 6, 'scenarios': 3 }))
+
+        assert 'Optimal' == output['statusOfOptimalModel']
+        assert 3 == len(output['scenarios'])
+        self.assertAlmostEqual(1, sum(scenario['probability'] for scenario in output['scenarios']))
+        assert list(range(6)) == sorted(member for scenario in output['scenarios'] for member in scenario['members'])
+
+        first = output['scenarios'][0]['simulations']['optimal']
+        for scenario in output['scenarios'][1:]:
+            optimal = scenario['simulations']['optimal']
+            np.testing.assert_allclose(first['electricityUsage']['total'][:6], optimal['electricityUsage']['total'][:6], atol=1e-6)
+            assert first['electrolyserOn'][:6] == optimal['electrolyserOn'][:6]
+
+        # the plans after the first stage adapt to each scenario's wind
+        costs = [ sum(scenario['simulations']['optimal']['electricityCost']['total']) for scenario in output['scenarios'] ]
+        assert len(set(np.round(costs, 6))) == 3
+
+    def test_members_must_match_forecasts(self):
+        with self.assertRaises(pydantic.ValidationError):
+            load_input({ 'members': [ [ 1, 2, 3 ] ] })
+        with self.assertRaises(pydantic.ValidationError):
+            load_input({ 'members': [ load_renewable_generation(), load_renewable_generation() ], 'probabilities': [ 0.5, 0.6 ] })
+
+
+class StochasticEndpointTest(unittest.TestCase):
+
+    def test_stochastic_endpoint(self):
+        from fastapi.testclient import TestClient
+        from app.main import app
+        input = load_input({ 'members': [ load_renewable_generation() ] })
+        response = TestClient(app).post('/electricity/hydrogen-production-optimisation/stochastic', content=input.json())
+        assert 200 == response.status_code
+        StochasticSimulationOutput.parse_obj(response.json())
+
+    def test_service_does_not_import_scipy(self):
+        # scipy is only needed by the models built from sparse arrays
+        result = subprocess.run([ sys.executable, '-c', "import sys, app.main; sys.exit('scipy' in sys.modules)" ], capture_output=True, text=True)
+        assert 0 == result.returncode, result.stderr
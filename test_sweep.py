@@ -0,0 +1,74 @@
+import json
+import pydantic
+import unittest
+from unittest import mock
+from app.batch import getBatchExecutor
+from app.lpmodel import buildOptimalModel
+from app.sweep import runSweepSimulations
+from app.electricity import MAX_REQUEST_WORKERS, ForecastSweep, SimulationOutput, SweepOutput
+
+
+def load_input(sweep, fixture='24-hours', model_builder='pulp'):
+    with open('app/test/' + fixture + '/sample-input.json') as input_file:
+        raw_input = json.load(input_file)
+    raw_input['config']['modelBuilder'] = model_builder
+    raw_input['sweep'] = dict({ 'workers': 1 }, **sweep)
+    return ForecastSweep.parse_obj(raw_input)
+
+
+def total_cost(output):
+    return sum(period['optimal']['electricityCost']['total'] for period in output['simulations'])
+
+
+class SweepTest(unittest.TestCase):
+
+    def test_every_combination(self):
+        output = runSweepSimulations(load_input({ 'minStorageSetPoint': [ 59000, 60000 ], 'gridPriceScale': [ 1, 2 ] }))
+        SweepOutput.parse_obj(output)
+
+        table = output['table']
+        assert [ 59000, 59000, 60000, 60000 ] == table['minStorageSetPoint']
+        assert [ 61000, 61000, 61000, 61000 ] == table['maxStorage']
+        assert [ 1, 2, 1, 2 ] == table['gridPriceScale']
+        assert [ 'Optimal' ] * 4 == table['statusOfOptimalModel']
+
+    def test_matches_fixture(self):
+        expected_output = pydantic.parse_file_as(path='app/test/24-hours/expected-output.json', type_=SimulationOutput).dict()
+        for model_builder in [ 'pulp', 'matrix' ]:
+            with self.subTest(model_builder=model_builder):
+                table = runSweepSimulations(load_input({ 'gridPriceScale': [ 2, 1 ] }, model_builder=model_builder))['table']
+                self.assertAlmostEqual(total_cost(expected_output), table['electricityCost'][1], places=4)
+                self.assertAlmostEqual(expected_output['simulations'][-1]['optimal']['hydrogenInStorage'], table['finalHydrogenInStorage'][1], places=4)
+                # doubling the grid price makes the plan dearer
+                assert table['electricityCost'][0] > table['electricityCost'][1]
+
+    def test_in_parallel(self):
+        sweep = { 'minStorageSetPoint': [ 59000, 59500, 60000 ] }
+        expected_table = runSweepSimulations(load_input(sweep))['table']
+        executor = getBatchExecutor()
+        table = runSweepSimulations(load_input(dict(sweep, workers=2)))['table']
+        for expected_cost, cost in zip(expected_table['electricityCost'], table['electricityCost']):
+            self.assertAlmostEqual(expected_cost, cost, places=4)
+        # fewer points than the pool has workers doesn't replace the pool
+        runSweepSimulations(load_input(dict(sweep, workers=3)))
+        assert executor is getBatchExecutor()
+
+    def test_workers_are_bounded(self):
+        for workers in [ 0, MAX_REQUEST_WORKERS + 1 ]:
+            with self.assertRaises(pydantic.ValidationError):
+                load_input({ 'workers': workers })
+
+    def test_builds_model_once(self):
+        with mock.patch('app.sweep.buildOptimalModel', wraps=buildOptimalModel) as build:
+            table = runSweepSimulations(load_input({ 'minStorageSetPoint': [ 59000, 59500, 60000 ], 'maxStorage': [ 61000, 62000 ] }))['table']
+        assert 1 == build.call_count
+        assert [ 'Optimal' ] * 6 == table['statusOfOptimalModel']
+        # lowering the min storage set point can only make the plan cheaper
+        assert table['electricityCost'][0] <= table['electricityCost'][2] <= table['electricityCost'][4]
+
+    def test_infeasible_points_are_not_solved(self):
+        table = runSweepSimulations(load_input({ 'minStorageSetPoint': [ 62000, 60000 ] }))['table']
+        assert [ 'Infeasible', 'Optimal' ] == table['statusOfOptimalModel']
+        assert table['error'][0].startswith('no plan can meet the request')
+        assert table['electricityCost'][0] is None
+        assert table['error'][1] is None
@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+from app.main import app
+from app.metrics import metricsRegistry
+from app.warmup import WarmUp
+
+
+class WarmUpTest(unittest.TestCase):
+
+    def test_warm_up(self):
+        runs = dict(metricsRegistry.runs)
+        warm_up = WarmUp()
+        assert not warm_up.isReady()
+        warm_up.start()
+        assert warm_up.finished.wait(60)
+
+        stats = warm_up.stats()
+        assert stats['ready']
+        assert [] == stats['errors']
+        assert stats['seconds'] > 0
+        # the solves aren't counted as runs of the model
+        assert runs == metricsRegistry.runs
+
+    def test_disabled(self):
+        warm_up = WarmUp(enabled=False)
+        warm_up.start()
+        assert warm_up.isReady()
+        assert warm_up.thread is None
+
+    def test_failed_step_is_reported(self):
+        def failingStep():
+            raise RuntimeError('no solver')
+        warm_up = WarmUp(steps=[ failingStep ])
+        warm_up.start()
+        assert warm_up.finished.wait(10)
+        assert [ 'failingStep: RuntimeError: no solver' ] == warm_up.stats()['errors']
+
+
+class ReadinessTest(unittest.TestCase):
+
+    def test_not_ready_until_warmed_up(self):
+        warm_up = WarmUp(steps=[])
+        with mock.patch('app.main.warmUp', warm_up):
+            client = TestClient(app)
+            response = client.get('/ready')
+            assert 503 == response.status_code
+            assert not response.json()['ready']
+
+            # the startup event starts warm-up
+            with client:
+                assert warm_up.finished.wait(10)
+                response = client.get('/ready')
+            assert 200 == response.status_code
+            assert response.json()['ready']
@@ -0,0 +1,123 @@
+import importlib
+import os
+import threading
+import time
+
+from app.electricity import Forecast
+from app.jobs import getWorkerProcessContext
+from app.lpmodel import buildSimulationOutput, runOptimalSimulation
+
+#
+# warm-up of a newly started server process
+#
+# the first requests served by a new process (e.g. after autoscaling) would
+#  otherwise pay for importing the modules that are only imported when first
+#  needed, and for the solver's first run - finding the CBC binary, and
+#  paging it (or HiGHS) in. so when the app starts, warm-up:
+#   - imports those modules (the matrix model builder, stacks and
+#     decomposition, and the packages of the binary formats), where their
+#     optional packages are installed
+#   - solves the 30-minutes test fixture with the service's solver, and
+#     with the matrix model builder where it can be imported, without
+#     recording the runs in metrics.metricsRegistry
+#   - starts the forkserver that job and batch worker processes are forked
+#     from (see jobs.getWorkerProcessContext), which preloads the model
+#
+# warm-up runs in a background thread, so "/" (liveness) answers straight
+#  away, while "/ready" only reports ready once warm-up has finished. a step
+#  that fails doesn't stop the server becoming ready, as it only means the
+#  first request that needs it will be slower, but is reported by "/ready"
+#
+# warm-up for the service is configured with the environment variable:
+#   HYDROGEN_WARM_UP - "false" to skip warm-up, so the server is ready
+#                      as soon as it starts
+#
+
+WARM_UP_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test', '30-minutes', 'sample-input.json')
+
+# modules imported by warm-up, where they can be
+WARM_UP_MODULES = [ 'app.matrixmodel', 'app.stacks', 'app.decomposition', 'msgpack', 'pyarrow' ]
+
+
+def importModules():
+    for module in WARM_UP_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            # optional packages that aren't installed
+            pass
+
+
+def solveFixture():
+    request = Forecast.parse_file(WARM_UP_FIXTURE)
+    model_builders = [ 'pulp' ]
+    try:
+        importlib.import_module('app.matrixmodel')
+        model_builders.append('matrix')
+    except ImportError:
+        pass
+
+    for model_builder in model_builders:
+        request.config.modelBuilder = model_builder
+        solution, model_status, solver_name = runOptimalSimulation(request)
+        buildSimulationOutput(request, solution, model_status, solver_name)
+
+
+# run a worker process that does nothing, which with forkserver waits for
+#  the forkserver to start and preload the model (rather than it doing so
+#  in the background while serving the first requests)
+def startWorkerProcesses():
+    process = getWorkerProcessContext().Process(target=time.sleep, args=(0,))
+    process.start()
+    process.join()
+
+
+WARM_UP_STEPS = [ importModules, solveFixture, startWorkerProcesses ]
+
+
+class WarmUp:
+    def __init__(self, enabled=True, steps=None):
+        self.enabled = enabled
+        self.steps = steps if steps is not None else WARM_UP_STEPS
+        self.finished = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.seconds = None
+        # why each step that failed did so
+        self.errors = []
+
+    # start warming up in a background thread, if it hasn't been already
+    def start(self):
+        with self.lock:
+            if self.thread is not None or self.finished.is_set():
+                return
+            if not self.enabled:
+                self.finished.set()
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def isReady(self):
+        return self.finished.is_set()
+
+    def stats(self):
+        return { 'ready': self.isReady(), 'seconds': self.seconds, 'errors': list(self.errors) }
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            for step in self.steps:
+                try:
+                    step()
+                except Exception as error:
+                    self.errors.append(f'{step.__name__}: {type(error).__name__}: {error}')
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.finished.set()
+
+
+def createServiceWarmUp():
+    return WarmUp(enabled=os.environ.get('HYDROGEN_WARM_UP', 'true').lower() not in [ 'false', '0', 'no' ])
+
+
+warmUp = createServiceWarmUp()